@@ -0,0 +1,76 @@
+"""
+Сравнение FSM-хранилищ асинхронного бота: MemoryStorage, BoundedMemoryStorage и SQLiteStorage
+
+Каждый "обработчик" делает то же, что типичный шаг диалога в handlers_*.py:
+get_state, get_data, update_data дважды и set_state. Запуск:
+
+    python benchmarks/storage.py [пользователей] [шагов на пользователя]
+"""
+import asyncio
+import importlib
+import os
+import sys
+import tempfile
+import time
+
+# Модули бота лежат в корне репозитория
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+async def run_steps(storage, users: int, steps: int) -> float:
+    from aiogram.fsm.storage.base import StorageKey
+
+    async def user_flow(user_id: int):
+        key = StorageKey(bot_id=1, chat_id=user_id, user_id=user_id)
+        for step in range(steps):
+            await storage.get_state(key)
+            await storage.get_data(key)
+            await storage.update_data(key, {'step': step})
+            await storage.update_data(key, {'channel_ids': ['@a', '@b', f'@c{step}']})
+            await storage.set_state(key, f"UploadStates:step_{step % 3}")
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user_flow(user_id) for user_id in range(1, users + 1)))
+    if hasattr(storage, 'flush'):
+        await storage.flush()
+    return time.perf_counter() - started
+
+
+async def main(users: int, steps: int):
+    from aiogram.fsm.storage.memory import MemoryStorage
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['DATABASE_FILE'] = os.path.join(tmp, 'benchmark.db')
+        import database_async as db
+        importlib.reload(db)
+        await db.init_db()
+        from storage_async import BoundedMemoryStorage, SQLiteStorage
+
+        operations = users * steps * 5
+        storages = (
+            ('MemoryStorage', MemoryStorage()),
+            ('BoundedMemory', BoundedMemoryStorage(max_keys=users)),
+            ('SQLiteStorage', SQLiteStorage()),
+        )
+        for name, storage in storages:
+            elapsed = await run_steps(storage, users, steps)
+            print(f"{name:14} {elapsed:7.3f} s  {operations / elapsed:10.0f} ops/s")
+            if isinstance(storage, BoundedMemoryStorage):
+                print(f"{'':14} resident: {storage.resident_size() / 1024:.0f} KiB for {users} users")
+            if isinstance(storage, SQLiteStorage):
+                stats = storage.get_stats()
+                print(f"{'':14} changes: {stats['changes']}, rows written: {stats['written']}, "
+                      f"transactions: {stats['flushes']}")
+            await storage.close()
+
+        # Холодный старт: состояния читаются из БД
+        cold = SQLiteStorage()
+        elapsed = await run_steps(cold, users, 1)
+        print(f"{'SQLite (cold)':14} {elapsed:7.3f} s  for {users} users")
+        await db.close_db()
+
+
+if __name__ == '__main__':
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    steps = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    asyncio.run(main(users, steps))
@@ -0,0 +1,167 @@
+"""
+Кеши в памяти процесса, общие для синхронной и асинхронной версий
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, Optional, Set, Tuple
+
+
+class ProfileCache:
+    """Последний известный профиль (username, name) каждого админа.
+
+    Позволяет не писать в БД на каждое сообщение: observe() возвращает True
+    только если профиль изменился, а изменённые профили копятся до drain().
+    """
+
+    def __init__(self):
+        self._known: Dict[int, Tuple[Optional[str], Optional[str]]] = {}
+        self._dirty: Dict[int, Tuple[Optional[str], Optional[str]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, user_id: int, username: Optional[str], name: Optional[str]) -> bool:
+        """Запомнить профиль; True, если он отличается от последнего известного"""
+        profile = (username, name)
+        with self._lock:
+            if self._known.get(user_id) == profile:
+                return False
+            self._known[user_id] = profile
+            self._dirty[user_id] = profile
+            return True
+
+    def drain(self) -> Dict[int, Tuple[Optional[str], Optional[str]]]:
+        """Забрать все изменённые профили для записи в БД"""
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+        return dirty
+
+    def forget(self, *user_ids: int):
+        """Забыть профили (следующий observe() снова запишет их в БД)"""
+        with self._lock:
+            for user_id in user_ids:
+                self._known.pop(user_id, None)
+                self._dirty.pop(user_id, None)
+
+    @property
+    def pending(self) -> int:
+        return len(self._dirty)
+
+
+# Какие виды тегов кеша зависят от таблицы БД: тег - это строка ('admins')
+# или кортеж, первый элемент которого - вид (('admin', user_id))
+TABLE_TAGS = {
+    'admins': ('admins', 'admin', 'channel_admins'),
+    'channels': ('channels', 'channel', 'admin_channels'),
+    'admin_channels': ('admin_channels', 'channel_admins'),
+    'templates': ('templates', 'template', 'channel_template'),
+    'channel_templates': ('channel_template', 'channel_templates'),
+}
+
+
+class QueryCache:
+    """Кеш результатов чтения из БД с инвалидацией по тегам.
+
+    Каждая запись помечена тегами ('admins', ('admin', user_id), ...);
+    изменяющие функции сбрасывают ровно те теги, которые затронули.
+    TTL (секунды, 0 - без TTL) - страховка на случай пропущенной инвалидации.
+    Размер ограничен maxsize записями (0 - без ограничения), лишние вытесняются
+    по LRU: отрицательные результаты (например, "не админ") тоже кешируются,
+    и без ограничения их число росло бы с каждым новым пользователем.
+    """
+
+    def __init__(self, ttl: float = 0, maxsize: int = 0):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+        self._entries: 'OrderedDict[Hashable, Tuple[Any, Tuple[Hashable, ...], float]]' = OrderedDict()
+        self._tags: Dict[Hashable, Set[Hashable]] = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Tuple[bool, Any]:
+        """(True, копия значения) при попадании, (False, None) при промахе"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] and entry[2] < time.monotonic():
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return False, None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            value = entry[0]
+        return True, copy.deepcopy(value)
+
+    def token(self) -> int:
+        """Снимок поколения перед чтением из БД (см. set())"""
+        return self._generation
+
+    def set(self, key: Hashable, value: Any, tags: Iterable[Hashable], token: int):
+        """Сохранить значение, если с момента token() не было инвалидаций.
+
+        Иначе чтение могло застать данные до записи, и кешировать их нельзя.
+        """
+        value = copy.deepcopy(value)
+        expires = time.monotonic() + self.ttl if self.ttl else 0
+        tags = tuple(tags)
+        with self._lock:
+            if token != self._generation:
+                return
+            self._drop(key)
+            self._entries[key] = (value, tags, expires)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while self.maxsize and len(self._entries) > self.maxsize:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, *tags: Hashable):
+        """Сбросить все записи, помеченные любым из тегов"""
+        with self._lock:
+            self._generation += 1
+            self.invalidations += 1
+            for tag in tags:
+                for key in list(self._tags.get(tag, ())):
+                    self._drop(key)
+
+    def invalidate_tables(self, *tables: str):
+        """Сбросить все записи, зависящие от таблиц (изменения из других процессов)"""
+        kinds = {kind for table in tables for kind in TABLE_TAGS.get(table, ())}
+        with self._lock:
+            self._generation += 1
+            self.invalidations += 1
+            for tag in list(self._tags):
+                if (tag[0] if isinstance(tag, tuple) else tag) in kinds:
+                    for key in list(self._tags.get(tag, ())):
+                        self._drop(key)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._tags.clear()
+
+    def _drop(self, key: Hashable):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[1]:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def stats(self) -> Dict:
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+            'evictions': self.evictions,
+        }
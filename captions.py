@@ -0,0 +1,276 @@
+"""
+Шаблоны подписей к публикациям (общие для синхронной и асинхронной версий)
+
+Текст шаблона один раз разбирается в план отрисовки: литералы, переменные
+и условные секции. Синтаксис:
+    {title}            - переменная
+    {episode:2}        - число, дополненное нулями до 2 знаков (01, 01-12)
+    {#range}...{/range}   - только для диапазона серий
+    {#single}...{/single} - только для одной серии
+    {{ и }}            - фигурные скобки как есть
+"""
+import logging
+import re
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+# Лимит Telegram на подпись к медиа
+CAPTION_LIMIT = 1024
+
+# Переменные и их описания (для подсказок при создании шаблона)
+VARIABLES = {
+    'title': 'название',
+    'season': 'сезон',
+    'episode': 'серия (или диапазон 1-12)',
+    'episode_start': 'первая серия',
+    'episode_end': 'последняя серия',
+    'episode_count': 'количество серий',
+    'tag': 'тег',
+    'date': 'дата публикации (ДД.ММ.ГГГГ)',
+}
+
+# Переменные, к которым применимо дополнение нулями {var:N}
+NUMERIC_VARIABLES = {'season', 'episode', 'episode_start', 'episode_end', 'episode_count'}
+
+SECTIONS = {'range', 'single'}
+
+VARIABLES_HELP = (
+    "\n".join(f"• `{{{name}}}` - {description}" for name, description in VARIABLES.items())
+    + "\n• `{episode:2}` - серия с нулями: 01"
+    + "\n• `{#range}...{/range}` - текст только для диапазона"
+    + "\n• `{#single}...{/single}` - текст только для одной серии"
+)
+
+# Подпись по умолчанию (канал без шаблона)
+DEFAULT_TEMPLATE = (
+    "🎬 {title}\n\n"
+    "📺 Сезон {season}\n"
+    "{#single}📺 Серия {episode}{/single}{#range}📺 Серии {episode}{/range}\n\n"
+    "{tag}\n\n"
+    "Наш канал: https://t.me/+XaaureBEZzMwNDk6\n"
+    "Наш чат: https://t.me/Anume2D"
+)
+
+_TOKEN_RE = re.compile(r"\{\{|\}\}|\{([^{}]*)\}")
+# Переменные шаблонов, сохранённых до компилятора (подставлялись через str.replace)
+_LEGACY_RE = re.compile(r"\{(title|season|episode|tag)\}")
+_PLACEHOLDER_RE = re.compile(r"^(?:([#/])(\w+)|(\w+)(?::(\d+))?)$")
+
+# Данные для проверки длины при сохранении шаблона
+_SAMPLE_SINGLE = {'title': 'Название аниме средней длины', 'season': 1, 'episode': 12,
+                  'tag': '#Название_аниме_средней_длины', 'is_range': False}
+_SAMPLE_RANGE = {'title': 'Название аниме средней длины', 'season': 1, 'episode_start': 1,
+                 'episode_end': 12, 'tag': '#Название_аниме_средней_длины', 'is_range': True}
+
+
+class TemplateError(ValueError):
+    """Ошибка в тексте шаблона"""
+
+
+class CompiledTemplate:
+    """Разобранный шаблон: план из ('text', str), ('var', name, width), ('section', name, plan)"""
+
+    def __init__(self, source: str, plan: list):
+        self.source = source
+        self.plan = plan
+
+    def render(self, context: Dict) -> str:
+        parts: List[str] = []
+        self._render(self.plan, context, parts)
+        return "".join(parts)
+
+    def _render(self, plan: list, context: Dict, parts: List[str]):
+        for op in plan:
+            if op[0] == 'text':
+                parts.append(op[1])
+            elif op[0] == 'var':
+                parts.append(_format_value(context[op[1]], op[2]))
+            elif context['is_range'] == (op[1] == 'range'):
+                self._render(op[2], context, parts)
+
+
+def _format_value(value, width: int) -> str:
+    if isinstance(value, tuple):
+        return "-".join(str(v).zfill(width) for v in value)
+    return str(value).zfill(width)
+
+
+def compile_template(text: str) -> CompiledTemplate:
+    """Разобрать текст шаблона в план отрисовки (TemplateError при ошибке)"""
+    root: list = []
+    stack: List[Tuple[Optional[str], list]] = [(None, root)]
+    position = 0
+
+    for match in _TOKEN_RE.finditer(text):
+        plan = stack[-1][1]
+        if match.start() > position:
+            plan.append(('text', text[position:match.start()]))
+        position = match.end()
+
+        token = match.group(0)
+        if token in ('{{', '}}'):
+            plan.append(('text', token[0]))
+            continue
+
+        placeholder = _PLACEHOLDER_RE.match(match.group(1).strip())
+        if not placeholder:
+            raise TemplateError(f"Некорректная переменная: {token}")
+        marker, section, name, width = placeholder.groups()
+
+        if marker == '#':
+            if section not in SECTIONS:
+                raise TemplateError(f"Неизвестная секция: {token}")
+            body: list = []
+            plan.append(('section', section, body))
+            stack.append((section, body))
+        elif marker == '/':
+            if stack[-1][0] != section:
+                raise TemplateError(f"Лишнее закрытие секции: {token}")
+            stack.pop()
+        else:
+            if name not in VARIABLES:
+                raise TemplateError(f"Неизвестная переменная: {token}")
+            if width and name not in NUMERIC_VARIABLES:
+                raise TemplateError(f"Дополнение нулями только для чисел: {token}")
+            plan.append(('var', name, int(width or 0)))
+
+    if len(stack) > 1:
+        raise TemplateError(f"Не закрыта секция: {{#{stack[-1][0]}}}")
+    if position < len(text):
+        stack[-1][1].append(('text', text[position:]))
+
+    return CompiledTemplate(text, _merge_text(root))
+
+
+def _merge_text(plan: list) -> list:
+    """Склеить соседние литералы (например, после {{ и }})"""
+    merged: list = []
+    for op in plan:
+        if op[0] == 'section':
+            op = ('section', op[1], _merge_text(op[2]))
+        if op[0] == 'text' and merged and merged[-1][0] == 'text':
+            merged[-1] = ('text', merged[-1][1] + op[1])
+        else:
+            merged.append(op)
+    return merged
+
+
+def compile_legacy_template(text: str) -> CompiledTemplate:
+    """Шаблон по старым правилам: {title}, {season}, {episode}, {tag}, остальное - как есть"""
+    plan: list = []
+    position = 0
+    for match in _LEGACY_RE.finditer(text):
+        if match.start() > position:
+            plan.append(('text', text[position:match.start()]))
+        plan.append(('var', match.group(1), 0))
+        position = match.end()
+    if position < len(text):
+        plan.append(('text', text[position:]))
+    return CompiledTemplate(text, plan)
+
+
+def validate_template(text: str) -> Optional[str]:
+    """Проверить шаблон перед сохранением; вернуть текст ошибки или None"""
+    try:
+        compiled = compile_template(text)
+    except TemplateError as e:
+        return str(e)
+
+    for sample in (_SAMPLE_SINGLE, _SAMPLE_RANGE):
+        length = len(compiled.render(build_context(sample)))
+        if length > CAPTION_LIMIT:
+            return f"Подпись получится длиннее {CAPTION_LIMIT} символов ({length})"
+    return None
+
+
+def legacy_warning(text: str) -> str:
+    """Предупреждение для просмотра шаблона, сохранённого до проверки ("" - шаблон корректен)"""
+    try:
+        compile_template(text)
+    except TemplateError as e:
+        return (f"⚠️ Шаблон в старом формате ({e}): неизвестное выводится как есть. "
+                "Отредактируйте его, чтобы использовать новые переменные.\n\n")
+    return ""
+
+
+def build_context(data: Dict, now: Optional[datetime] = None) -> Dict:
+    """Значения переменных из данных серии (результат parse_input)"""
+    if data.get('is_range'):
+        start, end = int(data['episode_start']), int(data['episode_end'])
+        episode = (start, end)
+    else:
+        start = end = int(data['episode'])
+        episode = start
+
+    return {
+        'title': data['title'],
+        'season': int(data['season']),
+        'episode': episode,
+        'episode_start': start,
+        'episode_end': end,
+        'episode_count': end - start + 1,
+        'tag': data['tag'],
+        'date': (now or datetime.now()).strftime("%d.%m.%Y"),
+        'is_range': bool(data.get('is_range')),
+    }
+
+
+def first_episode(data: Dict, next_episode: Optional[int] = None) -> int:
+    """Номер серии следующего файла: next_episode, иначе начало диапазона или серия (0 - тоже номер)"""
+    if next_episode is not None:
+        return next_episode
+    if data.get('is_range') or data.get('episode') is None:
+        return data['episode_start']
+    return data['episode']
+
+
+def episode_data(data: Dict, episode: int) -> Dict:
+    """Данные одной серии из данных диапазона/сессии (для подписи и статистики)"""
+    return dict(data, episode=episode, episode_start=None, episode_end=None, is_range=False)
+
+
+# ================== PER-CHANNEL CACHE ==================
+
+_default_template = compile_template(DEFAULT_TEMPLATE)
+
+# channel_id -> (исходный текст, скомпилированный шаблон); перекомпилируется при смене текста
+_compiled: Dict[str, Tuple[str, CompiledTemplate]] = {}
+_compiled_lock = threading.Lock()
+
+
+def get_compiled(channel_id: str, template_text: Optional[str]) -> CompiledTemplate:
+    """Скомпилированный шаблон канала (DEFAULT_TEMPLATE, если шаблона нет)"""
+    if template_text is None:
+        return _default_template
+
+    cached = _compiled.get(channel_id)
+    if cached is not None and cached[0] == template_text:
+        return cached[1]
+
+    try:
+        compiled = compile_template(template_text)
+    except TemplateError as e:
+        # Шаблоны, сохранённые до проверки, отрисовываются как раньше: неизвестное - как есть
+        logging.warning(f"Template for channel {channel_id} uses the old syntax ({e}), rendering it literally")
+        compiled = compile_legacy_template(template_text)
+
+    with _compiled_lock:
+        _compiled[channel_id] = (template_text, compiled)
+    return compiled
+
+
+def render_caption(channel_id: str, template: Optional[Dict], data: Dict) -> str:
+    """Подпись для публикации в канал по его шаблону (template - запись из БД или None)"""
+    compiled = get_compiled(channel_id, template['template_text'] if template else None)
+    caption = compiled.render(build_context(data))
+    if len(caption) > CAPTION_LIMIT:
+        caption = caption[:CAPTION_LIMIT - 1] + "…"
+    return caption
+
+
+def episode_label(data: Dict) -> str:
+    """Серия/серии для сообщений админу: "Серия 5" или "Серии 1-12" """
+    if data.get('is_range'):
+        return f"Серии {data['episode_start']}-{data['episode_end']}"
+    return f"Серия {data['episode']}"
@@ -1,107 +1,432 @@
 import sqlite3
 import json
 import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
 from datetime import datetime
-from typing import List, Dict, Optional, Tuple
+from typing import List, Dict, Optional, Tuple, Any
+
+import migrations
+from cache import ProfileCache, QueryCache
 
 DB_FILE = os.getenv("DATABASE_FILE", "bot_database.db")
 
-def get_connection():
-    """Получить соединение с БД"""
-    conn = sqlite3.connect(DB_FILE)
+# Как часто (в секундах) проверять, что закешированное соединение живо
+DB_HEALTH_CHECK_INTERVAL = int(os.getenv("DB_HEALTH_CHECK_INTERVAL", 60))
+
+# Режим группового коммита: все записи идут через один поток-писатель,
+# который объединяет их в одну транзакцию на окно/пачку
+DB_GROUP_COMMIT = os.getenv("DB_GROUP_COMMIT", "0") == "1"
+DB_GROUP_COMMIT_WINDOW_MS = int(os.getenv("DB_GROUP_COMMIT_WINDOW_MS", 5))
+DB_GROUP_COMMIT_BATCH = int(os.getenv("DB_GROUP_COMMIT_BATCH", 100))
+
+# Через сколько секунд после первого изменения профиля админа сбрасывать пачку в БД
+PROFILE_FLUSH_INTERVAL = float(os.getenv("PROFILE_FLUSH_INTERVAL", 5))
+
+# Сколько секунд живут записи кеша чтений (0 - пока их не сбросит запись в БД)
+DB_CACHE_TTL = float(os.getenv("DB_CACHE_TTL", 300))
+DB_CACHE_MAXSIZE = int(os.getenv("DB_CACHE_MAXSIZE", 4096))
+
+# Не чаще раза в столько секунд проверять изменения БД другими процессами (0 - при каждом чтении)
+DB_CACHE_CHECK_INTERVAL = float(os.getenv("DB_CACHE_CHECK_INTERVAL", 1))
+
+# PRAGMA, которые применяются к соединению один раз при открытии
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+)
+
+# Соединения кешируются по одному на поток (потоки-обработчики telebot)
+_local = threading.local()
+_connections: List[sqlite3.Connection] = []
+_connections_lock = threading.Lock()
+# Растёт при close_connections(): соединения потоков прошлого поколения уже закрыты
+_generation = 0
+
+
+def _open_connection() -> sqlite3.Connection:
+    # check_same_thread=False нужен только для close_connections() из главного потока,
+    # рабочие запросы соединение получает только в своём потоке
+    conn = sqlite3.connect(DB_FILE, check_same_thread=False)
     conn.row_factory = sqlite3.Row
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    with _connections_lock:
+        _connections.append(conn)
     return conn
 
-def init_db():
-    """Инициализация базы данных"""
+
+def _discard_connection():
+    """Закрыть и забыть соединение текущего потока"""
+    conn = getattr(_local, 'conn', None)
+    _local.conn = None
+    if conn is None:
+        return
+    with _connections_lock:
+        if conn in _connections:
+            _connections.remove(conn)
+    try:
+        conn.close()
+    except sqlite3.Error:
+        pass
+
+
+def get_connection():
+    """Получить соединение с БД (одно постоянное соединение на поток)"""
+    conn = getattr(_local, 'conn', None)
+    now = time.monotonic()
+
+    # Другая БД или соединение закрыто через close_connections() из другого потока
+    if conn is not None and (_local.db_file != DB_FILE or _local.generation != _generation):
+        _discard_connection()
+        conn = None
+
+    # Периодическая проверка, что соединение не сломано
+    if conn is not None and now - _local.checked_at > DB_HEALTH_CHECK_INTERVAL:
+        try:
+            conn.execute("SELECT 1")
+            _local.checked_at = now
+        except sqlite3.Error:
+            _discard_connection()
+            conn = None
+
+    if conn is None:
+        generation = _generation
+        conn = _open_connection()
+        _local.conn = conn
+        _local.generation = generation
+        _local.db_file = DB_FILE
+        _local.checked_at = now
+    return conn
+
+
+def close_connections():
+    """Закрыть все открытые соединения (потоки откроют новые при следующем запросе)"""
+    global _generation
+    flush_admin_profiles()
+    stop_group_commit()
+    with _connections_lock:
+        _generation += 1
+        connections = list(_connections)
+        _connections.clear()
+    for conn in connections:
+        try:
+            conn.close()
+        except sqlite3.Error as e:
+            print(f"Error closing connection: {e}")
+    _local.conn = None
+
+
+def _handle_db_error(conn: sqlite3.Connection, error: Exception):
+    """Откатить транзакцию; при сбое самого соединения - переподключиться"""
+    try:
+        conn.rollback()
+    except sqlite3.Error:
+        pass
+    # Ошибки данных (IntegrityError и т.п.) не ломают соединение
+    if isinstance(error, (sqlite3.OperationalError, sqlite3.InterfaceError)) or type(error) is sqlite3.DatabaseError:
+        _discard_connection()
+
+
+@contextmanager
+def _cursor():
+    """Курсор на соединении текущего потока"""
     conn = get_connection()
-    cursor = conn.cursor()
-    
-    # Таблица администраторов
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS admins (
-            user_id INTEGER PRIMARY KEY,
-            username TEXT,
-            added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-    
-    # Таблица каналов
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS channels (
-            channel_id TEXT PRIMARY KEY,
-            channel_name TEXT NOT NULL,
-            added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-    
-    # Таблица шаблонов подписей
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS templates (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL UNIQUE,
-            template_text TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-    
-    # Таблица связи каналов и шаблонов (один канал - один шаблон)
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS channel_templates (
-            channel_id TEXT PRIMARY KEY,
-            template_id INTEGER,
-            assigned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (channel_id) REFERENCES channels(channel_id) ON DELETE CASCADE,
-            FOREIGN KEY (template_id) REFERENCES templates(id) ON DELETE SET NULL
-        )
-    """)
-    
-    # Таблица связи админов и каналов (many-to-many)
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS admin_channels (
-            admin_id INTEGER,
-            channel_id TEXT,
-            assigned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            PRIMARY KEY (admin_id, channel_id),
-            FOREIGN KEY (admin_id) REFERENCES admins(user_id) ON DELETE CASCADE,
-            FOREIGN KEY (channel_id) REFERENCES channels(channel_id) ON DELETE CASCADE
-        )
-    """)
-    
-    # Таблица статистики загрузок (с полями для file_id и message_id)
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS upload_stats (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            admin_id INTEGER,
-            channel_id TEXT,
-            title TEXT,
-            season INTEGER,
-            episode INTEGER,
-            file_id TEXT,
-            message_id TEXT,
-            uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (admin_id) REFERENCES admins(user_id),
-            FOREIGN KEY (channel_id) REFERENCES channels(channel_id)
-        )
-    """)
+    try:
+        yield conn.cursor()
+    except sqlite3.Error as e:
+        _handle_db_error(conn, e)
+        raise
+
+
+def _execute_statements(cursor: sqlite3.Cursor, statements) -> Optional[int]:
+    for sql, params in statements:
+        if isinstance(params, list):
+            cursor.executemany(sql, params)
+        else:
+            cursor.execute(sql, params)
+    return cursor.lastrowid
+
+
+# ================== GROUP COMMIT ==================
+
+class GroupCommitWriter:
+    """Поток-писатель с очередью: пачка запросов коммитится одной транзакцией.
+
+    Каждый запрос выполняется в своём SAVEPOINT, поэтому ошибка одного
+    запроса не откатывает остальные запросы пачки. Future вызывающего
+    разрешается только после COMMIT всей пачки.
+    """
+
+    def __init__(self, window_ms: int = DB_GROUP_COMMIT_WINDOW_MS, batch_size: int = DB_GROUP_COMMIT_BATCH):
+        self.window = window_ms / 1000
+        self.batch_size = max(1, batch_size)
+        self.batches = 0
+        self.requests = 0
+        self.max_batch = 0
+        self._queue: queue.Queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        """Дописать очередь и остановить поток"""
+        self._queue.put(None)
+        self._thread.join()
+
+    @property
+    def alive(self) -> bool:
+        return self._thread.is_alive()
+
+    def submit(self, statements) -> Future:
+        future = Future()
+        self._queue.put((statements, future))
+        return future
+
+    def _collect(self, first) -> Tuple[list, bool]:
+        batch = [first]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        try:
+            conn = _open_connection()
+            conn.isolation_level = None  # транзакциями управляем сами
+        except Exception as e:
+            print(f"Error opening group commit connection: {e}")
+            # Поток не запустился: ожидающие получают ошибку, новые запросы пишутся напрямую
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    return
+                if item is not None:
+                    item[1].set_exception(e)
+        stopping = False
+        while not stopping:
+            first = self._queue.get()
+            if first is None:
+                break
+            batch, stopping = self._collect(first)
+            try:
+                self._commit(conn, batch)
+            except Exception as e:
+                # Например, не удался ROLLBACK: пачка завершается ошибкой, поток продолжает работу
+                print(f"Error committing write batch: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _commit(self, conn: sqlite3.Connection, batch: list):
+        results = []
+        if conn.in_transaction:
+            # Транзакция, оставшаяся от пачки с неудачным ROLLBACK
+            conn.execute("ROLLBACK")
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            cursor = conn.cursor()
+            for statements, future in batch:
+                cursor.execute("SAVEPOINT request")
+                try:
+                    lastrowid = _execute_statements(cursor, statements)
+                    cursor.execute("RELEASE request")
+                    results.append((future, lastrowid, None))
+                except Exception as e:
+                    cursor.execute("ROLLBACK TO request")
+                    cursor.execute("RELEASE request")
+                    results.append((future, None, e))
+            conn.execute("COMMIT")
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            results = [(future, None, e) for _, future in batch]
+
+        self.batches += 1
+        self.requests += len(batch)
+        self.max_batch = max(self.max_batch, len(batch))
+        for future, result, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def stats(self) -> Dict:
+        return {
+            'batches': self.batches,
+            'requests': self.requests,
+            'max_batch': self.max_batch,
+            'queued': self._queue.qsize(),
+        }
+
+
+_group_writer: Optional[GroupCommitWriter] = None
+
+
+def start_group_commit():
+    """Включить режим группового коммита (один поток-писатель)"""
+    global _group_writer
+    if _group_writer is None:
+        _group_writer = GroupCommitWriter()
+        _group_writer.start()
+
+
+def stop_group_commit():
+    """Выключить режим группового коммита, дописав очередь"""
+    global _group_writer
+    writer, _group_writer = _group_writer, None
+    if writer is not None:
+        writer.stop()
+
+
+def get_write_stats() -> Dict:
+    """Статистика группового коммита"""
+    if _group_writer is None:
+        return {'group_commit': False}
+    return {'group_commit': True, **_group_writer.stats()}
+
+
+def _write(*statements: Tuple[str, Any]) -> Optional[int]:
+    """Выполнить запросы одной транзакцией.
+
+    Каждый запрос - пара (sql, params); если params - список кортежей,
+    запрос выполняется через executemany. Возвращает lastrowid последнего запроса.
+    В режиме группового коммита запросы уходят потоку-писателю.
+    """
+    if _group_writer is not None and _group_writer.alive:
+        return _group_writer.submit(statements).result()
+
+    conn = get_connection()
+    try:
+        lastrowid = _execute_statements(conn.cursor(), statements)
+        conn.commit()
+        return lastrowid
+    except Exception as e:
+        _handle_db_error(conn, e)
+        raise
+
+
+def _fetchone(query: str, params: tuple = ()) -> Optional[Dict]:
+    with _cursor() as cursor:
+        cursor.execute(query, params)
+        row = cursor.fetchone()
+        return dict(row) if row else None
+
+
+def _fetchall(query: str, params: tuple = ()) -> List[Dict]:
+    with _cursor() as cursor:
+        cursor.execute(query, params)
+        return [dict(row) for row in cursor.fetchall()]
+
+
+# ================== QUERY CACHE ==================
+
+# Небольшие таблицы (админы, каналы, назначения, шаблоны) читаются почти
+# в каждом обработчике, поэтому их чтения кешируются в процессе
+_cache = QueryCache(ttl=DB_CACHE_TTL, maxsize=DB_CACHE_MAXSIZE)
+
+# Последние известные версии таблиц из table_versions (общие для всех потоков)
+_seen_versions: Dict[str, int] = {}
+_seen_versions_lock = threading.Lock()
+_last_cache_check = 0.0
+
+
+def _revalidate_cache():
+    """Сбросить кеш таблиц, изменённых другими соединениями (процессами).
+
+    PRAGMA data_version меняется, только если в БД закоммитило другое
+    соединение; лишь тогда читаем крошечную таблицу table_versions.
+    """
+    global _last_cache_check
+    now = time.monotonic()
+    if now - _last_cache_check < DB_CACHE_CHECK_INTERVAL:
+        return
+    _last_cache_check = now
+
+    try:
+        conn = get_connection()
+        data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+        if getattr(_local, 'data_version', None) == data_version:
+            return
+        _local.data_version = data_version
+        versions = {row['table_name']: row['version']
+                    for row in conn.execute("SELECT table_name, version FROM table_versions")}
+    except sqlite3.Error as e:
+        print(f"Error checking data version: {e}")
+        _cache.clear()
+        return
+
+    with _seen_versions_lock:
+        changed = [table for table, version in versions.items()
+                   if _seen_versions.get(table, version) != version]
+        _seen_versions.update(versions)
+    if changed:
+        _cache.invalidate_tables(*changed)
 
-    # Миграции для добавления колонок в существующие таблицы (совместимость)
-    cursor.execute("PRAGMA table_info(admins)")
-    admin_cols = [row['name'] for row in cursor.fetchall()]
-    if 'role' not in admin_cols:
-        cursor.execute("ALTER TABLE admins ADD COLUMN role TEXT NOT NULL DEFAULT 'junior'")
-    if 'name' not in admin_cols:
-        cursor.execute("ALTER TABLE admins ADD COLUMN name TEXT")
 
-    cursor.execute("PRAGMA table_info(upload_stats)")
-    up_cols = [row['name'] for row in cursor.fetchall()]
-    if 'file_id' not in up_cols:
-        cursor.execute("ALTER TABLE upload_stats ADD COLUMN file_id TEXT")
-    if 'message_id' not in up_cols:
-        cursor.execute("ALTER TABLE upload_stats ADD COLUMN message_id TEXT")
+def _cached(key, tags, load):
+    """Вернуть значение из кеша или загрузить его через load() и закешировать"""
+    _revalidate_cache()
+    found, value = _cache.get(key)
+    if found:
+        return value
+    token = _cache.token()
+    value = load()
+    _cache.set(key, value, tags, token)
+    return value
 
-    conn.commit()
-    conn.close()
+
+def get_cache_stats() -> Dict:
+    """Счётчики кеша чтений (попадания, промахи, размер)"""
+    return _cache.stats()
+
+
+def _apply_migrations(conn: sqlite3.Connection):
+    """Довести схему до migrations.SCHEMA_VERSION (по одной транзакции на миграцию)"""
+    if conn.execute("PRAGMA user_version").fetchone()[0] >= migrations.SCHEMA_VERSION:
+        return
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Перечитываем версию под блокировкой: другой процесс мог мигрировать раньше
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for target, steps in migrations.pending(version):
+            for step in steps:
+                if isinstance(step, migrations.AddColumn):
+                    columns = [row['name'] for row in conn.execute(f"PRAGMA table_info({step.table})")]
+                    if step.column not in columns:
+                        conn.execute(step.sql)
+                else:
+                    conn.execute(step)
+            conn.execute(f"PRAGMA user_version = {target}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def init_db():
+    """Инициализация базы данных"""
+    _apply_migrations(get_connection())
+
+    if DB_GROUP_COMMIT:
+        start_group_commit()
 
 def migrate_from_json(json_file: str):
     """Миграция данных из admins.json в БД"""
@@ -118,6 +443,7 @@ def migrate_from_json(json_file: str):
             if not get_admin(admin_id):
                 add_admin(admin_id, username=None)
         
+        _cache.clear()
         print(f"Migrated {len(admins)} admins from {json_file}")
     except Exception as e:
         print(f"Migration error: {e}")
@@ -126,20 +452,16 @@ def migrate_from_json(json_file: str):
 
 def add_admin(user_id: int, username: Optional[str] = None, role: str = 'junior', name: Optional[str] = None) -> bool:
     """Добавить администратора (или обновить существующего)"""
+    _profiles.forget(user_id)
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            "INSERT OR IGNORE INTO admins (user_id, username, role, name) VALUES (?, ?, ?, ?)",
-            (user_id, username, role, name)
+        _write(
+            ("INSERT OR IGNORE INTO admins (user_id, username, role, name) VALUES (?, ?, ?, ?)",
+             (user_id, username, role, name)),
+            # Обновляем поля, если админ уже существует (username/role/name)
+            ("UPDATE admins SET username = COALESCE(?, username), role = COALESCE(?, role), name = COALESCE(?, name) WHERE user_id = ?",
+             (username, role, name, user_id)),
         )
-        # Обновляем поля, если админ уже существует (username/role/name)
-        cursor.execute(
-            "UPDATE admins SET username = COALESCE(?, username), role = COALESCE(?, role), name = COALESCE(?, name) WHERE user_id = ?",
-            (username, role, name, user_id)
-        )
-        conn.commit()
-        conn.close()
+        _cache.invalidate(('admin', user_id), 'admins')
         return True
     except Exception as e:
         print(f"Error adding admin: {e}")
@@ -147,12 +469,14 @@ def add_admin(user_id: int, username: Optional[str] = None, role: str = 'junior'
 
 def remove_admin(user_id: int) -> bool:
     """Удалить администратора"""
+    _profiles.forget(user_id)
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM admins WHERE user_id = ?", (user_id,))
-        conn.commit()
-        conn.close()
+        # foreign_keys выключены - связи удаляются в той же транзакции
+        _write(
+            ("DELETE FROM admin_channels WHERE admin_id = ?", (user_id,)),
+            ("DELETE FROM admins WHERE user_id = ?", (user_id,)),
+        )
+        _cache.invalidate(('admin', user_id), 'admins', ('admin_channels', user_id))
         return True
     except Exception as e:
         print(f"Error removing admin: {e}")
@@ -160,62 +484,109 @@ def remove_admin(user_id: int) -> bool:
 
 def get_admin(user_id: int) -> Optional[Dict]:
     """Получить информацию об админе"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM admins WHERE user_id = ?", (user_id,))
-    row = cursor.fetchone()
-    conn.close()
-    return dict(row) if row else None
+    return _cached(('admin', user_id), [('admin', user_id)],
+                   lambda: _fetchone("SELECT * FROM admins WHERE user_id = ?", (user_id,)))
 
 def get_all_admins() -> List[Dict]:
     """Получить список всех админов"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM admins ORDER BY added_at")
-    rows = cursor.fetchall()
-    conn.close()
-    return [dict(row) for row in rows]
+    return _cached('all_admins', ['admins'],
+                   lambda: _fetchall("SELECT * FROM admins ORDER BY added_at"))
 
 def is_admin(user_id: int) -> bool:
-    """Проверить, является ли пользователь админом"""
-    return get_admin(user_id) is not None
+    """Проверить, является ли пользователь админом (кешируются и положительные, и отрицательные ответы)"""
+    return _cached(('is_admin', user_id), [('admin', user_id)],
+                   lambda: _fetchone("SELECT 1 FROM admins WHERE user_id = ?", (user_id,)) is not None)
 
 def get_admins_by_role(role: str) -> List[Dict]:
     """Получить админов по роли (main/junior)"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM admins WHERE role = ? ORDER BY added_at", (role,))
-    rows = cursor.fetchall()
-    conn.close()
-    return [dict(row) for row in rows]
+    return _cached(('admins_by_role', role), ['admins'],
+                   lambda: _fetchall("SELECT * FROM admins WHERE role = ? ORDER BY added_at", (role,)))
 
 
 def set_admin_role(user_id: int, role: str) -> bool:
     """Установить роль администратора ("main" или "junior")"""
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("UPDATE admins SET role = ? WHERE user_id = ?", (role, user_id))
-        conn.commit()
-        conn.close()
+        _write(("UPDATE admins SET role = ? WHERE user_id = ?", (role, user_id)))
+        _cache.invalidate(('admin', user_id), 'admins')
         return True
     except Exception as e:
         print(f"Error setting admin role: {e}")
         return False
 
+
+def set_default_channel(user_id: int, channel_id: Optional[str]) -> bool:
+    """Запомнить канал по умолчанию для загрузки одним сообщением"""
+    try:
+        _write(("UPDATE admins SET default_channel_id = ? WHERE user_id = ?", (channel_id, user_id)))
+        _cache.invalidate(('admin', user_id), 'admins')
+        return True
+    except Exception as e:
+        print(f"Error setting default channel: {e}")
+        return False
+
+# ================== ADMIN PROFILES ==================
+
+_profiles = ProfileCache()
+_profile_event = threading.Event()
+_profile_flusher: Optional[threading.Thread] = None
+_profile_flusher_lock = threading.Lock()
+
+
+def _run_profile_flusher():
+    while True:
+        _profile_event.wait()
+        # Окно накопления: все изменения за интервал уходят одной пачкой
+        time.sleep(PROFILE_FLUSH_INTERVAL)
+        _profile_event.clear()
+        flush_admin_profiles()
+
+
+def touch_admin_profile(user_id: int, username: Optional[str] = None, name: Optional[str] = None):
+    """Обновить username/имя админа.
+
+    В БД ничего не пишется, если профиль не изменился; изменения
+    сбрасываются пачкой в фоне через PROFILE_FLUSH_INTERVAL секунд.
+    """
+    global _profile_flusher
+    if not _profiles.observe(user_id, username, name):
+        return
+    with _profile_flusher_lock:
+        if _profile_flusher is None:
+            _profile_flusher = threading.Thread(target=_run_profile_flusher, name="profile-flusher", daemon=True)
+            _profile_flusher.start()
+    _profile_event.set()
+
+
+def flush_admin_profiles() -> int:
+    """Записать накопленные изменения профилей одной транзакцией"""
+    profiles = _profiles.drain()
+    if not profiles:
+        return 0
+    try:
+        _write(
+            ("INSERT OR IGNORE INTO admins (user_id, username, name) VALUES (?, ?, ?)",
+             [(user_id, username, name) for user_id, (username, name) in profiles.items()]),
+            ("UPDATE admins SET username = COALESCE(?, username), name = COALESCE(?, name) WHERE user_id = ?",
+             [(username, name, user_id) for user_id, (username, name) in profiles.items()]),
+        )
+    except Exception as e:
+        print(f"Error flushing admin profiles: {e}")
+        # Забываем профили, чтобы следующее сообщение снова их записало
+        _profiles.forget(*profiles)
+        return 0
+    _cache.invalidate('admins', *[('admin', user_id) for user_id in profiles])
+    return len(profiles)
+
 # ================== CHANNEL FUNCTIONS ==================
 
 def add_channel(channel_id: str, channel_name: str) -> bool:
     """Добавить канал"""
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
+        _write((
             "INSERT OR REPLACE INTO channels (channel_id, channel_name) VALUES (?, ?)",
             (channel_id, channel_name)
-        )
-        conn.commit()
-        conn.close()
+        ))
+        _cache.invalidate(('channel', channel_id), 'channels')
         return True
     except Exception as e:
         print(f"Error adding channel: {e}")
@@ -224,11 +595,14 @@ def add_channel(channel_id: str, channel_name: str) -> bool:
 def remove_channel(channel_id: str) -> bool:
     """Удалить канал"""
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM channels WHERE channel_id = ?", (channel_id,))
-        conn.commit()
-        conn.close()
+        # foreign_keys выключены - связи удаляются в той же транзакции
+        _write(
+            ("DELETE FROM admin_channels WHERE channel_id = ?", (channel_id,)),
+            ("DELETE FROM channel_templates WHERE channel_id = ?", (channel_id,)),
+            ("DELETE FROM channels WHERE channel_id = ?", (channel_id,)),
+        )
+        _cache.invalidate(('channel', channel_id), 'channels', ('channel_admins', channel_id),
+                          ('channel_template', channel_id), 'channel_templates')
         return True
     except Exception as e:
         print(f"Error removing channel: {e}")
@@ -236,35 +610,24 @@ def remove_channel(channel_id: str) -> bool:
 
 def get_channel(channel_id: str) -> Optional[Dict]:
     """Получить информацию о канале"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM channels WHERE channel_id = ?", (channel_id,))
-    row = cursor.fetchone()
-    conn.close()
-    return dict(row) if row else None
+    return _cached(('channel', channel_id), [('channel', channel_id)],
+                   lambda: _fetchone("SELECT * FROM channels WHERE channel_id = ?", (channel_id,)))
 
 def get_all_channels() -> List[Dict]:
     """Получить список всех каналов"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM channels ORDER BY added_at")
-    rows = cursor.fetchall()
-    conn.close()
-    return [dict(row) for row in rows]
+    return _cached('all_channels', ['channels'],
+                   lambda: _fetchall("SELECT * FROM channels ORDER BY added_at"))
 
 # ================== ADMIN-CHANNEL ASSIGNMENT ==================
 
 def assign_admin_to_channel(admin_id: int, channel_id: str) -> bool:
     """Назначить админа на канал"""
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
+        _write((
             "INSERT OR IGNORE INTO admin_channels (admin_id, channel_id) VALUES (?, ?)",
             (admin_id, channel_id)
-        )
-        conn.commit()
-        conn.close()
+        ))
+        _cache.invalidate(('admin_channels', admin_id), ('channel_admins', channel_id))
         return True
     except Exception as e:
         print(f"Error assigning admin to channel: {e}")
@@ -273,14 +636,11 @@ def assign_admin_to_channel(admin_id: int, channel_id: str) -> bool:
 def unassign_admin_from_channel(admin_id: int, channel_id: str) -> bool:
     """Убрать админа с канала"""
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
+        _write((
             "DELETE FROM admin_channels WHERE admin_id = ? AND channel_id = ?",
             (admin_id, channel_id)
-        )
-        conn.commit()
-        conn.close()
+        ))
+        _cache.invalidate(('admin_channels', admin_id), ('channel_admins', channel_id))
         return True
     except Exception as e:
         print(f"Error unassigning admin from channel: {e}")
@@ -288,168 +648,174 @@ def unassign_admin_from_channel(admin_id: int, channel_id: str) -> bool:
 
 def get_admin_channels(admin_id: int) -> List[Dict]:
     """Получить список каналов админа"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
+    return _cached(('admin_channels', admin_id), [('admin_channels', admin_id), 'channels'], lambda: _fetchall("""
         SELECT c.* FROM channels c
         JOIN admin_channels ac ON c.channel_id = ac.channel_id
         WHERE ac.admin_id = ?
         ORDER BY c.channel_name
-    """, (admin_id,))
-    rows = cursor.fetchall()
-    conn.close()
-    return [dict(row) for row in rows]
+    """, (admin_id,)))
+
+def get_channels_with_admin_flags(admin_id: int) -> List[Dict]:
+    """Все каналы одним запросом; assigned - прикреплён ли канал к админу"""
+    return _cached(('channels_admin_flags', admin_id), [('admin_channels', admin_id), 'channels'], lambda: _fetchall("""
+        SELECT c.*, ac.admin_id IS NOT NULL AS assigned FROM channels c
+        LEFT JOIN admin_channels ac ON ac.channel_id = c.channel_id AND ac.admin_id = ?
+        ORDER BY c.added_at
+    """, (admin_id,)))
 
 def get_channel_admins(channel_id: str) -> List[Dict]:
     """Получить список админов канала"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
+    return _cached(('channel_admins', channel_id), [('channel_admins', channel_id), 'admins'], lambda: _fetchall("""
         SELECT a.* FROM admins a
         JOIN admin_channels ac ON a.user_id = ac.admin_id
         WHERE ac.channel_id = ?
         ORDER BY a.username
-    """, (channel_id,))
-    rows = cursor.fetchall()
-    conn.close()
-    return [dict(row) for row in rows]
+    """, (channel_id,)))
 
 # ================== STATISTICS ==================
 
 def log_upload(admin_id: int, channel_id: str, title: str, season: int, episode: int, file_id: Optional[str] = None, message_id: Optional[str] = None) -> bool:
     """Записать загрузку в статистику (с file_id и message_id)"""
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
+        _write(("""
             INSERT INTO upload_stats (admin_id, channel_id, title, season, episode, file_id, message_id)
             VALUES (?, ?, ?, ?, ?, ?, ?)
-        """, (admin_id, channel_id, title, season, episode, file_id, message_id))
-        conn.commit()
-        conn.close()
+        """, (admin_id, channel_id, title, season, episode, file_id, message_id)))
         return True
     except Exception as e:
         print(f"Error logging upload: {e}")
         return False
 
+def log_uploads(uploads: List[Tuple]) -> bool:
+    """Записать несколько загрузок одной транзакцией.
+
+    Каждая загрузка - кортеж (admin_id, channel_id, title, season, episode, file_id, message_id)
+    """
+    if not uploads:
+        return True
+    try:
+        _write(("""
+            INSERT INTO upload_stats (admin_id, channel_id, title, season, episode, file_id, message_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, list(uploads)))
+        return True
+    except Exception as e:
+        print(f"Error logging uploads: {e}")
+        return False
+
 def get_admin_stats(admin_id: int) -> Dict:
-    """Получить статистику админа"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    # Общее количество загрузок
-    cursor.execute(
-        "SELECT COUNT(*) as total FROM upload_stats WHERE admin_id = ?",
-        (admin_id,)
-    )
-    total = cursor.fetchone()['total']
-    
-    # По каналам
-    cursor.execute("""
-        SELECT c.channel_name, COUNT(*) as count
-        FROM upload_stats us
-        JOIN channels c ON us.channel_id = c.channel_id
-        WHERE us.admin_id = ?
-        GROUP BY c.channel_id
-        ORDER BY count DESC
-    """, (admin_id,))
-    by_channel = [dict(row) for row in cursor.fetchall()]
-    
-    # Последние загрузки
-    cursor.execute("""
-        SELECT title, season, episode, uploaded_at
-        FROM upload_stats
-        WHERE admin_id = ?
-        ORDER BY uploaded_at DESC
-        LIMIT 5
-    """, (admin_id,))
-    recent = [dict(row) for row in cursor.fetchall()]
-    
-    conn.close()
+    """Получить статистику админа (из агрегатов stats_*)"""
+    with _cursor() as cursor:
+        # Общее количество загрузок
+        cursor.execute(
+            "SELECT total, last_upload FROM stats_admin WHERE admin_id = ?",
+            (admin_id,)
+        )
+        row = cursor.fetchone()
+        
+        # По каналам
+        cursor.execute("""
+            SELECT c.channel_name, s.total as count
+            FROM stats_admin_channel s
+            JOIN channels c ON s.channel_id = c.channel_id
+            WHERE s.admin_id = ? AND s.total > 0
+            ORDER BY count DESC
+        """, (admin_id,))
+        by_channel = [dict(row) for row in cursor.fetchall()]
+        
+        # Последние загрузки (по индексу admin_id, uploaded_at)
+        cursor.execute("""
+            SELECT title, season, episode, uploaded_at
+            FROM upload_stats
+            WHERE admin_id = ?
+            ORDER BY uploaded_at DESC
+            LIMIT 5
+        """, (admin_id,))
+        recent = [dict(row) for row in cursor.fetchall()]
     
     return {
-        'total': total,
+        'total': row['total'] if row else 0,
+        'last_upload': row['last_upload'] if row else None,
         'by_channel': by_channel,
         'recent': recent
     }
 
 def get_channel_stats(channel_id: str) -> Dict:
-    """Получить статистику канала"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    # Общее количество загрузок
-    cursor.execute(
-        "SELECT COUNT(*) as total FROM upload_stats WHERE channel_id = ?",
-        (channel_id,)
-    )
-    total = cursor.fetchone()['total']
-    
-    # По админам
-    cursor.execute("""
-        SELECT a.user_id, a.username, COUNT(*) as count
-        FROM upload_stats us
-        JOIN admins a ON us.admin_id = a.user_id
-        WHERE us.channel_id = ?
-        GROUP BY a.user_id
-        ORDER BY count DESC
-    """, (channel_id,))
-    by_admin = [dict(row) for row in cursor.fetchall()]
-    
-    # Последние загрузки
-    cursor.execute("""
-        SELECT title, season, episode, uploaded_at, admin_id
-        FROM upload_stats
-        WHERE channel_id = ?
-        ORDER BY uploaded_at DESC
-        LIMIT 5
-    """, (channel_id,))
-    recent = [dict(row) for row in cursor.fetchall()]
-    
-    conn.close()
+    """Получить статистику канала (из агрегатов stats_*)"""
+    with _cursor() as cursor:
+        # Общее количество загрузок
+        cursor.execute(
+            "SELECT total, last_upload FROM stats_channel WHERE channel_id = ?",
+            (channel_id,)
+        )
+        row = cursor.fetchone()
+        
+        # По админам
+        cursor.execute("""
+            SELECT a.user_id, a.username, s.total as count
+            FROM stats_admin_channel s
+            JOIN admins a ON s.admin_id = a.user_id
+            WHERE s.channel_id = ? AND s.total > 0
+            ORDER BY count DESC
+        """, (channel_id,))
+        by_admin = [dict(row) for row in cursor.fetchall()]
+        
+        # Последние загрузки (по индексу channel_id, uploaded_at)
+        cursor.execute("""
+            SELECT title, season, episode, uploaded_at, admin_id
+            FROM upload_stats
+            WHERE channel_id = ?
+            ORDER BY uploaded_at DESC
+            LIMIT 5
+        """, (channel_id,))
+        recent = [dict(row) for row in cursor.fetchall()]
     
     return {
-        'total': total,
+        'total': row['total'] if row else 0,
+        'last_upload': row['last_upload'] if row else None,
         'by_admin': by_admin,
         'recent': recent
     }
 
 def get_all_stats() -> List[Dict]:
     """Получить общую статистику всех админов"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute("""
+    return _fetchall("""
         SELECT 
             a.user_id,
             a.username,
-            COUNT(us.id) as total_uploads,
-            MAX(us.uploaded_at) as last_upload
+            COALESCE(s.total, 0) as total_uploads,
+            s.last_upload
         FROM admins a
-        LEFT JOIN upload_stats us ON a.user_id = us.admin_id
-        GROUP BY a.user_id
+        LEFT JOIN stats_admin s ON a.user_id = s.admin_id
         ORDER BY total_uploads DESC
     """)
-    
-    rows = cursor.fetchall()
-    conn.close()
-    
-    return [dict(row) for row in rows]
+
+def get_daily_stats(days: int = 30) -> List[Dict]:
+    """Количество загрузок по дням (последние days дней с загрузками)"""
+    return _fetchall(
+        "SELECT day, total FROM stats_daily WHERE total > 0 ORDER BY day DESC LIMIT ?",
+        (days,)
+    )
+
+def rebuild_stats() -> bool:
+    """Пересчитать агрегаты stats_* из сырой истории upload_stats"""
+    try:
+        _write(*[(sql, ()) for sql in migrations.REBUILD_STATS])
+        return True
+    except Exception as e:
+        print(f"Error rebuilding stats: {e}")
+        return False
 
 # ================== TEMPLATE FUNCTIONS ==================
 
 def add_template(name: str, template_text: str) -> Optional[int]:
     """Добавить шаблон подписи"""
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
+        template_id = _write((
             "INSERT INTO templates (name, template_text) VALUES (?, ?)",
             (name, template_text)
-        )
-        template_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        ))
+        _cache.invalidate('templates')
         return template_id
     except Exception as e:
         print(f"Error adding template: {e}")
@@ -458,19 +824,16 @@ def add_template(name: str, template_text: str) -> Optional[int]:
 def update_template(template_id: int, name: str = None, template_text: str = None) -> bool:
     """Обновить шаблон"""
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
         if name and template_text:
-            cursor.execute(
+            _write((
                 "UPDATE templates SET name = ?, template_text = ? WHERE id = ?",
                 (name, template_text, template_id)
-            )
+            ))
         elif name:
-            cursor.execute("UPDATE templates SET name = ? WHERE id = ?", (name, template_id))
+            _write(("UPDATE templates SET name = ? WHERE id = ?", (name, template_id)))
         elif template_text:
-            cursor.execute("UPDATE templates SET template_text = ? WHERE id = ?", (template_text, template_id))
-        conn.commit()
-        conn.close()
+            _write(("UPDATE templates SET template_text = ? WHERE id = ?", (template_text, template_id)))
+        _cache.invalidate(('template', template_id), 'templates')
         return True
     except Exception as e:
         print(f"Error updating template: {e}")
@@ -479,11 +842,8 @@ def update_template(template_id: int, name: str = None, template_text: str = Non
 def remove_template(template_id: int) -> bool:
     """Удалить шаблон"""
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM templates WHERE id = ?", (template_id,))
-        conn.commit()
-        conn.close()
+        _write(("DELETE FROM templates WHERE id = ?", (template_id,)))
+        _cache.invalidate(('template', template_id), 'templates')
         return True
     except Exception as e:
         print(f"Error removing template: {e}")
@@ -491,42 +851,27 @@ def remove_template(template_id: int) -> bool:
 
 def get_template(template_id: int) -> Optional[Dict]:
     """Получить шаблон по ID"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM templates WHERE id = ?", (template_id,))
-    row = cursor.fetchone()
-    conn.close()
-    return dict(row) if row else None
+    return _cached(('template', template_id), [('template', template_id)],
+                   lambda: _fetchone("SELECT * FROM templates WHERE id = ?", (template_id,)))
 
 def get_template_by_name(name: str) -> Optional[Dict]:
     """Получить шаблон по имени"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM templates WHERE name = ?", (name,))
-    row = cursor.fetchone()
-    conn.close()
-    return dict(row) if row else None
+    return _cached(('template_by_name', name), ['templates'],
+                   lambda: _fetchone("SELECT * FROM templates WHERE name = ?", (name,)))
 
 def get_all_templates() -> List[Dict]:
     """Получить все шаблоны"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM templates ORDER BY name")
-    rows = cursor.fetchall()
-    conn.close()
-    return [dict(row) for row in rows]
+    return _cached('all_templates', ['templates'],
+                   lambda: _fetchall("SELECT * FROM templates ORDER BY name"))
 
 def assign_template_to_channel(channel_id: str, template_id: int) -> bool:
     """Прикрепить шаблон к каналу"""
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
+        _write((
             "INSERT OR REPLACE INTO channel_templates (channel_id, template_id) VALUES (?, ?)",
             (channel_id, template_id)
-        )
-        conn.commit()
-        conn.close()
+        ))
+        _cache.invalidate(('channel_template', channel_id), 'channel_templates')
         return True
     except Exception as e:
         print(f"Error assigning template to channel: {e}")
@@ -535,11 +880,8 @@ def assign_template_to_channel(channel_id: str, template_id: int) -> bool:
 def unassign_template_from_channel(channel_id: str) -> bool:
     """Открепить шаблон от канала"""
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM channel_templates WHERE channel_id = ?", (channel_id,))
-        conn.commit()
-        conn.close()
+        _write(("DELETE FROM channel_templates WHERE channel_id = ?", (channel_id,)))
+        _cache.invalidate(('channel_template', channel_id), 'channel_templates')
         return True
     except Exception as e:
         print(f"Error unassigning template from channel: {e}")
@@ -547,13 +889,91 @@ def unassign_template_from_channel(channel_id: str) -> bool:
 
 def get_channel_template(channel_id: str) -> Optional[Dict]:
     """Получить шаблон канала"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
+    return _cached(('channel_template', channel_id), [('channel_template', channel_id), 'templates'], lambda: _fetchone("""
         SELECT t.* FROM templates t
         JOIN channel_templates ct ON t.id = ct.template_id
         WHERE ct.channel_id = ?
-    """, (channel_id,))
-    row = cursor.fetchone()
-    conn.close()
-    return dict(row) if row else None
+    """, (channel_id,)))
+
+def get_channels_with_templates() -> List[Dict]:
+    """Все каналы с привязанным шаблоном одним запросом (template_id/template_name - None, если шаблона нет)"""
+    return _cached('channels_templates', ['channel_templates', 'channels', 'templates'], lambda: _fetchall("""
+        SELECT c.*, t.id AS template_id, t.name AS template_name FROM channels c
+        LEFT JOIN channel_templates ct ON ct.channel_id = c.channel_id
+        LEFT JOIN templates t ON t.id = ct.template_id
+        ORDER BY c.added_at
+    """))
+
+# ================== OUTBOX ==================
+
+def enqueue_jobs(jobs: List[Tuple]) -> bool:
+    """Добавить задачи публикации одной транзакцией.
+
+    Каждая задача - кортеж (batch_id, admin_id, chat_id, channel_id, payload)
+    """
+    try:
+        _write(("""
+            INSERT INTO outbox (batch_id, admin_id, chat_id, channel_id, payload)
+            VALUES (?, ?, ?, ?, ?)
+        """, list(jobs)))
+        return True
+    except Exception as e:
+        print(f"Error enqueueing jobs: {e}")
+        return False
+
+def get_pending_jobs() -> List[Dict]:
+    """Неопубликованные задачи по порядку (после перезапуска и прерванные тоже)"""
+    try:
+        _write(("UPDATE outbox SET status = 'pending' WHERE status = 'running'", ()))
+    except Exception as e:
+        print(f"Error requeueing jobs: {e}")
+    return _fetchall("SELECT * FROM outbox WHERE status = 'pending' ORDER BY id")
+
+def get_batch_jobs(batch_id: str) -> List[Dict]:
+    """Задачи одной загрузки"""
+    return _fetchall("SELECT * FROM outbox WHERE batch_id = ? ORDER BY id", (batch_id,))
+
+def start_job(job_id: int) -> bool:
+    """Отметить задачу как выполняемую"""
+    try:
+        _write(("UPDATE outbox SET status = 'running', attempts = attempts + 1 WHERE id = ?", (job_id,)))
+        return True
+    except Exception as e:
+        print(f"Error starting job: {e}")
+        return False
+
+def finish_job(job_id: int, status: str, message_ids: Optional[str] = None, error: Optional[str] = None) -> bool:
+    """Записать результат задачи ('done' или 'failed')"""
+    try:
+        _write(("""
+            UPDATE outbox SET status = ?, message_ids = ?, error = ?, finished_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        """, (status, message_ids, error, job_id)))
+        return True
+    except Exception as e:
+        print(f"Error finishing job: {e}")
+        return False
+
+def get_outbox_stats() -> Dict[str, int]:
+    """Количество задач по статусам"""
+    rows = _fetchall("SELECT status, COUNT(*) as count FROM outbox GROUP BY status")
+    return {row['status']: row['count'] for row in rows}
+
+# ================== USER SESSIONS ==================
+
+def save_user_sessions(rows: List[Tuple[int, str, float]]) -> bool:
+    """Заменить снимок сессий: строки (user_id, payload, touched_at)"""
+    try:
+        _write(
+            ("DELETE FROM user_sessions", ()),
+            ("INSERT INTO user_sessions (user_id, payload, touched_at) VALUES (?, ?, ?)", list(rows)),
+        )
+        return True
+    except Exception as e:
+        print(f"Error saving user sessions: {e}")
+        return False
+
+def load_user_sessions() -> List[Tuple[int, str, float]]:
+    """Снимок сессий, сохранённый при остановке"""
+    rows = _fetchall("SELECT user_id, payload, touched_at FROM user_sessions")
+    return [(row['user_id'], row['payload'], row['touched_at']) for row in rows]
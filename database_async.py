@@ -2,13 +2,46 @@
 Асинхронная версия работы с базой данных
 Использует aiosqlite для неблокирующих операций
 """
+import asyncio
 import aiosqlite
 import os
+import time
+from contextlib import asynccontextmanager
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple, Any
+
+import migrations
+from cache import ProfileCache, QueryCache
 
 DB_FILE = os.getenv("DATABASE_FILE", "bot_database.db")
 
+# Количество читающих соединений в пуле (писатель всегда один)
+DB_POOL_READERS = int(os.getenv("DB_POOL_READERS", 3))
+
+# Режим группового коммита: записи ставятся в очередь отдельной задаче,
+# которая объединяет их в одну транзакцию на окно/пачку
+DB_GROUP_COMMIT = os.getenv("DB_GROUP_COMMIT", "0") == "1"
+DB_GROUP_COMMIT_WINDOW_MS = int(os.getenv("DB_GROUP_COMMIT_WINDOW_MS", 5))
+DB_GROUP_COMMIT_BATCH = int(os.getenv("DB_GROUP_COMMIT_BATCH", 100))
+
+# Через сколько секунд после первого изменения профиля админа сбрасывать пачку в БД
+PROFILE_FLUSH_INTERVAL = float(os.getenv("PROFILE_FLUSH_INTERVAL", 5))
+
+# Сколько секунд живут записи кеша чтений (0 - пока их не сбросит запись в БД)
+DB_CACHE_TTL = float(os.getenv("DB_CACHE_TTL", 300))
+DB_CACHE_MAXSIZE = int(os.getenv("DB_CACHE_MAXSIZE", 4096))
+
+# Не чаще раза в столько секунд проверять изменения БД другими процессами (0 - при каждом чтении)
+DB_CACHE_CHECK_INTERVAL = float(os.getenv("DB_CACHE_CHECK_INTERVAL", 1))
+
+# PRAGMA, которые применяются к каждому соединению пула один раз при открытии
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+)
+
 
 async def get_connection():
     """Получить асинхронное соединение с БД"""
@@ -17,97 +50,428 @@ async def get_connection():
     return conn
 
 
-async def init_db():
-    """Инициализация базы данных"""
-    async with aiosqlite.connect(DB_FILE) as conn:
-        # Таблица администраторов
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS admins (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT,
-                role TEXT NOT NULL DEFAULT 'junior',
-                name TEXT,
-                added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        # Таблица каналов
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS channels (
-                channel_id TEXT PRIMARY KEY,
-                channel_name TEXT NOT NULL,
-                added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        # Таблица шаблонов
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS templates (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL UNIQUE,
-                template_text TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        # Таблица связи каналов и шаблонов
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS channel_templates (
-                channel_id TEXT PRIMARY KEY,
-                template_id INTEGER,
-                assigned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (channel_id) REFERENCES channels(channel_id) ON DELETE CASCADE,
-                FOREIGN KEY (template_id) REFERENCES templates(id) ON DELETE SET NULL
-            )
-        """)
-        
-        # Таблица связи админов и каналов
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS admin_channels (
-                admin_id INTEGER,
-                channel_id TEXT,
-                assigned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                PRIMARY KEY (admin_id, channel_id),
-                FOREIGN KEY (admin_id) REFERENCES admins(user_id) ON DELETE CASCADE,
-                FOREIGN KEY (channel_id) REFERENCES channels(channel_id) ON DELETE CASCADE
-            )
-        """)
-        
-        # Таблица статистики
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS upload_stats (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                admin_id INTEGER,
-                channel_id TEXT,
-                title TEXT,
-                season INTEGER,
-                episode INTEGER,
-                file_id TEXT,
-                message_id TEXT,
-                uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (admin_id) REFERENCES admins(user_id),
-                FOREIGN KEY (channel_id) REFERENCES channels(channel_id)
-            )
-        """)
-        
+# ================== CONNECTION POOL ==================
+
+class ConnectionPool:
+    """Пул постоянных соединений aiosqlite: один писатель и N читателей.
+
+    SQLite допускает только одного писателя, поэтому запись сериализуется
+    через отдельное соединение под замком, а чтения идут параллельно
+    через очередь читающих соединений (WAL не блокирует их записью).
+    """
+
+    def __init__(self, db_file: str, readers: int = DB_POOL_READERS):
+        self.db_file = db_file
+        self.size = max(1, readers)
+        self._readers: Optional[asyncio.Queue] = None
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._writer_lock: Optional[asyncio.Lock] = None
+        self._connections: List[aiosqlite.Connection] = []
+        self.read_checkouts = 0
+        self.write_checkouts = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+
+    async def _connect(self) -> aiosqlite.Connection:
+        conn = await aiosqlite.connect(self.db_file)
+        conn.row_factory = aiosqlite.Row
+        for pragma in CONNECTION_PRAGMAS:
+            await conn.execute(pragma)
+        self._connections.append(conn)
+        return conn
+
+    async def open(self):
+        """Открыть все соединения пула"""
+        self._writer_lock = asyncio.Lock()
+        self._writer = await self._connect()
+        self._readers = asyncio.Queue()
+        for _ in range(self.size):
+            self._readers.put_nowait(await self._connect())
+
+    async def close(self):
+        """Закрыть все соединения пула"""
+        connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                await conn.close()
+            except Exception as e:
+                print(f"Error closing connection: {e}")
+        self._writer = None
+        self._readers = None
+
+    def _record_wait(self, started: float):
+        waited = time.monotonic() - started
+        self.wait_time += waited
+        self.max_wait = max(self.max_wait, waited)
+
+    @asynccontextmanager
+    async def reader(self):
+        """Взять читающее соединение из пула"""
+        started = time.monotonic()
+        conn = await self._readers.get()
+        self._record_wait(started)
+        self.read_checkouts += 1
+        try:
+            yield conn
+        finally:
+            self._readers.put_nowait(conn)
+
+    @asynccontextmanager
+    async def writer(self):
+        """Взять пишущее соединение; при ошибке транзакция откатывается"""
+        started = time.monotonic()
+        async with self._writer_lock:
+            self._record_wait(started)
+            self.write_checkouts += 1
+            try:
+                yield self._writer
+            except BaseException:
+                await self._writer.rollback()
+                raise
+
+    def stats(self) -> Dict:
+        """Счётчики пула: размер, ожидание и количество выдач соединений"""
+        checkouts = self.read_checkouts + self.write_checkouts
+        return {
+            'readers': self.size,
+            'writers': 1,
+            'idle_readers': self._readers.qsize() if self._readers else 0,
+            'read_checkouts': self.read_checkouts,
+            'write_checkouts': self.write_checkouts,
+            'wait_time_total': self.wait_time,
+            'wait_time_max': self.max_wait,
+            'wait_time_avg': self.wait_time / checkouts if checkouts else 0.0,
+        }
+
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock: Optional[asyncio.Lock] = None
+
+
+async def get_pool() -> ConnectionPool:
+    """Получить пул соединений (открывается при первом обращении)"""
+    global _pool, _pool_lock
+    if _pool is not None:
+        return _pool
+    if _pool_lock is None:
+        _pool_lock = asyncio.Lock()
+    async with _pool_lock:
+        if _pool is None:
+            pool = ConnectionPool(DB_FILE)
+            await pool.open()
+            _pool = pool
+    return _pool
+
+
+async def close_db():
+    """Закрыть пул соединений (вызывается при остановке бота)"""
+    global _pool, _pool_lock
+    await flush_admin_profiles()
+    await stop_group_commit()
+    pool, _pool, _pool_lock = _pool, None, None
+    if pool is not None:
+        await pool.close()
+
+
+def get_pool_stats() -> Dict:
+    """Статистика пула соединений"""
+    return _pool.stats() if _pool is not None else {}
+
+
+@asynccontextmanager
+async def _reader():
+    pool = await get_pool()
+    async with pool.reader() as conn:
+        yield conn
+
+
+async def _execute_statements(conn: aiosqlite.Connection, statements) -> Optional[int]:
+    cursor = None
+    for sql, params in statements:
+        if isinstance(params, list):
+            cursor = await conn.executemany(sql, params)
+        else:
+            cursor = await conn.execute(sql, params)
+    return cursor.lastrowid if cursor is not None else None
+
+
+# ================== GROUP COMMIT ==================
+
+class GroupCommitWriter:
+    """Задача-писатель с очередью: пачка запросов коммитится одной транзакцией.
+
+    Каждый запрос выполняется в своём SAVEPOINT, поэтому ошибка одного
+    запроса не откатывает остальные запросы пачки. Future вызывающего
+    разрешается только после COMMIT всей пачки.
+    """
+
+    def __init__(self, pool: ConnectionPool, window_ms: int = DB_GROUP_COMMIT_WINDOW_MS,
+                 batch_size: int = DB_GROUP_COMMIT_BATCH):
+        self.pool = pool
+        self.window = window_ms / 1000
+        self.batch_size = max(1, batch_size)
+        self.batches = 0
+        self.requests = 0
+        self.max_batch = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Дописать очередь и остановить задачу"""
+        self._queue.put_nowait(None)
+        await self._task
+
+    @property
+    def alive(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def submit(self, statements) -> Optional[int]:
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((statements, future))
+        return await future
+
+    def _drain(self, batch: list) -> bool:
+        while len(batch) < self.batch_size and not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is None:
+                return True
+            batch.append(item)
+        return False
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            first = await self._queue.get()
+            if first is None:
+                break
+            batch = [first]
+            stopping = self._drain(batch)
+            if not stopping and len(batch) < self.batch_size:
+                # Ждём окно, чтобы собрать запросы от других обработчиков
+                await asyncio.sleep(self.window)
+                stopping = self._drain(batch)
+            try:
+                await self._commit(batch)
+            except Exception as e:
+                # Например, не удался rollback или соединение: пачка завершается ошибкой,
+                # задача продолжает работу
+                print(f"Error committing write batch: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    async def _commit(self, batch: list):
+        results = []
+        async with self.pool.writer() as conn:
+            if conn.in_transaction:
+                # Транзакция, оставшаяся от пачки с неудачным rollback
+                await conn.rollback()
+            try:
+                await conn.execute("BEGIN IMMEDIATE")
+                for statements, future in batch:
+                    await conn.execute("SAVEPOINT request")
+                    try:
+                        lastrowid = await _execute_statements(conn, statements)
+                        await conn.execute("RELEASE request")
+                        results.append((future, lastrowid, None))
+                    except Exception as e:
+                        await conn.execute("ROLLBACK TO request")
+                        await conn.execute("RELEASE request")
+                        results.append((future, None, e))
+                await conn.commit()
+            except Exception as e:
+                await conn.rollback()
+                results = [(future, None, e) for _, future in batch]
+
+        self.batches += 1
+        self.requests += len(batch)
+        self.max_batch = max(self.max_batch, len(batch))
+        for future, result, error in results:
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def stats(self) -> Dict:
+        return {
+            'batches': self.batches,
+            'requests': self.requests,
+            'max_batch': self.max_batch,
+            'queued': self._queue.qsize() if self._queue else 0,
+        }
+
+
+_group_writer: Optional[GroupCommitWriter] = None
+
+
+async def start_group_commit():
+    """Включить режим группового коммита (одна задача-писатель)"""
+    global _group_writer
+    if _group_writer is None:
+        _group_writer = GroupCommitWriter(await get_pool())
+        _group_writer.start()
+
+
+async def stop_group_commit():
+    """Выключить режим группового коммита, дописав очередь"""
+    global _group_writer
+    writer, _group_writer = _group_writer, None
+    if writer is not None:
+        await writer.stop()
+
+
+def get_write_stats() -> Dict:
+    """Статистика группового коммита"""
+    if _group_writer is None:
+        return {'group_commit': False}
+    return {'group_commit': True, **_group_writer.stats()}
+
+
+async def _write(*statements: Tuple[str, Any]) -> Optional[int]:
+    """Выполнить запросы одной транзакцией на пишущем соединении.
+
+    Каждый запрос - пара (sql, params); если params - список кортежей,
+    запрос выполняется через executemany. Возвращает lastrowid последнего запроса.
+    В режиме группового коммита запросы уходят задаче-писателю.
+    """
+    if _group_writer is not None and _group_writer.alive:
+        return await _group_writer.submit(statements)
+
+    pool = await get_pool()
+    async with pool.writer() as conn:
+        lastrowid = await _execute_statements(conn, statements)
         await conn.commit()
+        return lastrowid
+
+
+async def _fetchone(query: str, params: tuple = ()) -> Optional[Dict]:
+    async with _reader() as conn:
+        async with conn.execute(query, params) as cursor:
+            row = await cursor.fetchone()
+            return dict(row) if row else None
+
+
+async def _fetchall(query: str, params: tuple = ()) -> List[Dict]:
+    async with _reader() as conn:
+        async with conn.execute(query, params) as cursor:
+            rows = await cursor.fetchall()
+            return [dict(row) for row in rows]
+
+
+# ================== QUERY CACHE ==================
+
+# Небольшие таблицы (админы, каналы, назначения, шаблоны) читаются почти
+# в каждом обработчике, поэтому их чтения кешируются в процессе
+_cache = QueryCache(ttl=DB_CACHE_TTL, maxsize=DB_CACHE_MAXSIZE)
+
+# Последние известные версии таблиц из table_versions и data_version каждого соединения
+_seen_versions: Dict[str, int] = {}
+_data_versions: Dict[int, int] = {}
+_last_cache_check = 0.0
+
+
+async def _revalidate_cache():
+    """Сбросить кеш таблиц, изменённых другими соединениями (процессами).
+
+    PRAGMA data_version меняется, только если в БД закоммитило другое
+    соединение; лишь тогда читаем крошечную таблицу table_versions.
+    """
+    global _last_cache_check
+    now = time.monotonic()
+    if now - _last_cache_check < DB_CACHE_CHECK_INTERVAL:
+        return
+    _last_cache_check = now
+
+    try:
+        async with _reader() as conn:
+            async with conn.execute("PRAGMA data_version") as cursor:
+                data_version = (await cursor.fetchone())[0]
+            if _data_versions.get(id(conn)) == data_version:
+                return
+            _data_versions[id(conn)] = data_version
+            async with conn.execute("SELECT table_name, version FROM table_versions") as cursor:
+                versions = {row['table_name']: row['version'] for row in await cursor.fetchall()}
+    except aiosqlite.Error as e:
+        print(f"Error checking data version: {e}")
+        _cache.clear()
+        return
+
+    changed = [table for table, version in versions.items()
+               if _seen_versions.get(table, version) != version]
+    _seen_versions.update(versions)
+    if changed:
+        _cache.invalidate_tables(*changed)
+
+
+async def _cached(key, tags, load):
+    """Вернуть значение из кеша или загрузить его через await load() и закешировать"""
+    await _revalidate_cache()
+    found, value = _cache.get(key)
+    if found:
+        return value
+    token = _cache.token()
+    value = await load()
+    _cache.set(key, value, tags, token)
+    return value
+
+
+def get_cache_stats() -> Dict:
+    """Счётчики кеша чтений (попадания, промахи, размер)"""
+    return _cache.stats()
+
+
+async def _apply_migrations(conn: aiosqlite.Connection):
+    """Довести схему до migrations.SCHEMA_VERSION (по одной транзакции на миграцию)"""
+    async with conn.execute("PRAGMA user_version") as cursor:
+        if (await cursor.fetchone())[0] >= migrations.SCHEMA_VERSION:
+            return
+
+    await conn.execute("BEGIN IMMEDIATE")
+    # Перечитываем версию под блокировкой: другой процесс мог мигрировать раньше
+    async with conn.execute("PRAGMA user_version") as cursor:
+        version = (await cursor.fetchone())[0]
+    for target, steps in migrations.pending(version):
+        for step in steps:
+            if isinstance(step, migrations.AddColumn):
+                async with conn.execute(f"PRAGMA table_info({step.table})") as cursor:
+                    columns = [row['name'] for row in await cursor.fetchall()]
+                if step.column not in columns:
+                    await conn.execute(step.sql)
+            else:
+                await conn.execute(step)
+        await conn.execute(f"PRAGMA user_version = {target}")
+    await conn.commit()
+
+
+async def init_db():
+    """Инициализация базы данных (и пула соединений)"""
+    pool = await get_pool()
+    async with pool.writer() as conn:
+        await _apply_migrations(conn)
+
+    if DB_GROUP_COMMIT:
+        await start_group_commit()
 
 
 # ================== ADMIN FUNCTIONS ==================
 
 async def add_admin(user_id: int, username: Optional[str] = None, role: str = 'junior', name: Optional[str] = None) -> bool:
     """Добавить или обновить администратора"""
+    _profiles.forget(user_id)
     try:
-        async with aiosqlite.connect(DB_FILE) as conn:
-            await conn.execute(
-                "INSERT OR IGNORE INTO admins (user_id, username, role, name) VALUES (?, ?, ?, ?)",
-                (user_id, username, role, name)
-            )
-            await conn.execute(
-                "UPDATE admins SET username = COALESCE(?, username), role = COALESCE(?, role), name = COALESCE(?, name) WHERE user_id = ?",
-                (username, role, name, user_id)
-            )
-            await conn.commit()
+        await _write(
+            ("INSERT OR IGNORE INTO admins (user_id, username, role, name) VALUES (?, ?, ?, ?)",
+             (user_id, username, role, name)),
+            ("UPDATE admins SET username = COALESCE(?, username), role = COALESCE(?, role), name = COALESCE(?, name) WHERE user_id = ?",
+             (username, role, name, user_id)),
+        )
+        _cache.invalidate(('admin', user_id), 'admins')
         return True
     except Exception as e:
         print(f"Error adding admin: {e}")
@@ -116,38 +480,103 @@ async def add_admin(user_id: int, username: Optional[str] = None, role: str = 'j
 
 async def remove_admin(user_id: int) -> bool:
     """Удалить администратора"""
+    _profiles.forget(user_id)
     try:
-        async with aiosqlite.connect(DB_FILE) as conn:
-            await conn.execute("DELETE FROM admins WHERE user_id = ?", (user_id,))
-            await conn.commit()
+        # foreign_keys выключены - связи удаляются в той же транзакции
+        await _write(
+            ("DELETE FROM admin_channels WHERE admin_id = ?", (user_id,)),
+            ("DELETE FROM admins WHERE user_id = ?", (user_id,)),
+        )
+        _cache.invalidate(('admin', user_id), 'admins', ('admin_channels', user_id))
         return True
     except Exception as e:
         print(f"Error removing admin: {e}")
         return False
 
 
+async def set_default_channel(user_id: int, channel_id: Optional[str]) -> bool:
+    """Запомнить канал по умолчанию для загрузки одним сообщением"""
+    try:
+        await _write(("UPDATE admins SET default_channel_id = ? WHERE user_id = ?", (channel_id, user_id)))
+        _cache.invalidate(('admin', user_id), 'admins')
+        return True
+    except Exception as e:
+        print(f"Error setting default channel: {e}")
+        return False
+
+
 async def get_admin(user_id: int) -> Optional[Dict]:
     """Получить информацию об админе"""
-    async with aiosqlite.connect(DB_FILE) as conn:
-        conn.row_factory = aiosqlite.Row
-        async with conn.execute("SELECT * FROM admins WHERE user_id = ?", (user_id,)) as cursor:
-            row = await cursor.fetchone()
-            return dict(row) if row else None
+    return await _cached(('admin', user_id), [('admin', user_id)],
+                         lambda: _fetchone("SELECT * FROM admins WHERE user_id = ?", (user_id,)))
 
 
 async def get_all_admins() -> List[Dict]:
     """Получить список всех админов"""
-    async with aiosqlite.connect(DB_FILE) as conn:
-        conn.row_factory = aiosqlite.Row
-        async with conn.execute("SELECT * FROM admins ORDER BY added_at") as cursor:
-            rows = await cursor.fetchall()
-            return [dict(row) for row in rows]
+    return await _cached('all_admins', ['admins'],
+                         lambda: _fetchall("SELECT * FROM admins ORDER BY added_at"))
+
+
+async def _admin_exists(user_id: int) -> bool:
+    return await _fetchone("SELECT 1 FROM admins WHERE user_id = ?", (user_id,)) is not None
 
 
 async def is_admin(user_id: int) -> bool:
-    """Проверить, является ли пользователь админом"""
-    admin = await get_admin(user_id)
-    return admin is not None
+    """Проверить, является ли пользователь админом (кешируются и положительные, и отрицательные ответы)"""
+    return await _cached(('is_admin', user_id), [('admin', user_id)], lambda: _admin_exists(user_id))
+
+
+# ================== ADMIN PROFILES ==================
+
+_profiles = ProfileCache()
+_profile_task: Optional[asyncio.Task] = None
+
+
+async def _flush_profiles_later():
+    global _profile_task
+    # Окно накопления: все изменения за интервал уходят одной пачкой
+    await asyncio.sleep(PROFILE_FLUSH_INTERVAL)
+    _profile_task = None
+    await flush_admin_profiles()
+
+
+async def touch_admin_profile(user_id: int, username: Optional[str] = None, name: Optional[str] = None):
+    """Обновить username/имя админа.
+
+    В БД ничего не пишется, если профиль не изменился; изменения
+    сбрасываются пачкой в фоне через PROFILE_FLUSH_INTERVAL секунд.
+    """
+    global _profile_task
+    if not _profiles.observe(user_id, username, name):
+        return
+    if _profile_task is None:
+        _profile_task = asyncio.create_task(_flush_profiles_later())
+
+
+async def flush_admin_profiles() -> int:
+    """Записать накопленные изменения профилей одной транзакцией"""
+    global _profile_task
+    if _profile_task is not None and _profile_task is not asyncio.current_task():
+        _profile_task.cancel()
+        _profile_task = None
+
+    profiles = _profiles.drain()
+    if not profiles:
+        return 0
+    try:
+        await _write(
+            ("INSERT OR IGNORE INTO admins (user_id, username, name) VALUES (?, ?, ?)",
+             [(user_id, username, name) for user_id, (username, name) in profiles.items()]),
+            ("UPDATE admins SET username = COALESCE(?, username), name = COALESCE(?, name) WHERE user_id = ?",
+             [(username, name, user_id) for user_id, (username, name) in profiles.items()]),
+        )
+    except Exception as e:
+        print(f"Error flushing admin profiles: {e}")
+        # Забываем профили, чтобы следующее сообщение снова их записало
+        _profiles.forget(*profiles)
+        return 0
+    _cache.invalidate('admins', *[('admin', user_id) for user_id in profiles])
+    return len(profiles)
 
 
 # ================== CHANNEL FUNCTIONS ==================
@@ -155,12 +584,11 @@ async def is_admin(user_id: int) -> bool:
 async def add_channel(channel_id: str, channel_name: str) -> bool:
     """Добавить канал"""
     try:
-        async with aiosqlite.connect(DB_FILE) as conn:
-            await conn.execute(
-                "INSERT OR REPLACE INTO channels (channel_id, channel_name) VALUES (?, ?)",
-                (channel_id, channel_name)
-            )
-            await conn.commit()
+        await _write((
+            "INSERT OR REPLACE INTO channels (channel_id, channel_name) VALUES (?, ?)",
+            (channel_id, channel_name)
+        ))
+        _cache.invalidate(('channel', channel_id), 'channels')
         return True
     except Exception as e:
         print(f"Error adding channel: {e}")
@@ -170,9 +598,14 @@ async def add_channel(channel_id: str, channel_name: str) -> bool:
 async def remove_channel(channel_id: str) -> bool:
     """Удалить канал"""
     try:
-        async with aiosqlite.connect(DB_FILE) as conn:
-            await conn.execute("DELETE FROM channels WHERE channel_id = ?", (channel_id,))
-            await conn.commit()
+        # foreign_keys выключены - связи удаляются в той же транзакции
+        await _write(
+            ("DELETE FROM admin_channels WHERE channel_id = ?", (channel_id,)),
+            ("DELETE FROM channel_templates WHERE channel_id = ?", (channel_id,)),
+            ("DELETE FROM channels WHERE channel_id = ?", (channel_id,)),
+        )
+        _cache.invalidate(('channel', channel_id), 'channels', ('channel_admins', channel_id),
+                          ('channel_template', channel_id), 'channel_templates')
         return True
     except Exception as e:
         print(f"Error removing channel: {e}")
@@ -181,20 +614,14 @@ async def remove_channel(channel_id: str) -> bool:
 
 async def get_channel(channel_id: str) -> Optional[Dict]:
     """Получить информацию о канале"""
-    async with aiosqlite.connect(DB_FILE) as conn:
-        conn.row_factory = aiosqlite.Row
-        async with conn.execute("SELECT * FROM channels WHERE channel_id = ?", (channel_id,)) as cursor:
-            row = await cursor.fetchone()
-            return dict(row) if row else None
+    return await _cached(('channel', channel_id), [('channel', channel_id)],
+                         lambda: _fetchone("SELECT * FROM channels WHERE channel_id = ?", (channel_id,)))
 
 
 async def get_all_channels() -> List[Dict]:
     """Получить список всех каналов"""
-    async with aiosqlite.connect(DB_FILE) as conn:
-        conn.row_factory = aiosqlite.Row
-        async with conn.execute("SELECT * FROM channels ORDER BY added_at") as cursor:
-            rows = await cursor.fetchall()
-            return [dict(row) for row in rows]
+    return await _cached('all_channels', ['channels'],
+                         lambda: _fetchall("SELECT * FROM channels ORDER BY added_at"))
 
 
 # ================== ADMIN-CHANNEL ASSIGNMENT ==================
@@ -202,12 +629,11 @@ async def get_all_channels() -> List[Dict]:
 async def assign_admin_to_channel(admin_id: int, channel_id: str) -> bool:
     """Назначить админа на канал"""
     try:
-        async with aiosqlite.connect(DB_FILE) as conn:
-            await conn.execute(
-                "INSERT OR IGNORE INTO admin_channels (admin_id, channel_id) VALUES (?, ?)",
-                (admin_id, channel_id)
-            )
-            await conn.commit()
+        await _write((
+            "INSERT OR IGNORE INTO admin_channels (admin_id, channel_id) VALUES (?, ?)",
+            (admin_id, channel_id)
+        ))
+        _cache.invalidate(('admin_channels', admin_id), ('channel_admins', channel_id))
         return True
     except Exception as e:
         print(f"Error assigning admin to channel: {e}")
@@ -217,12 +643,11 @@ async def assign_admin_to_channel(admin_id: int, channel_id: str) -> bool:
 async def unassign_admin_from_channel(admin_id: int, channel_id: str) -> bool:
     """Убрать админа с канала"""
     try:
-        async with aiosqlite.connect(DB_FILE) as conn:
-            await conn.execute(
-                "DELETE FROM admin_channels WHERE admin_id = ? AND channel_id = ?",
-                (admin_id, channel_id)
-            )
-            await conn.commit()
+        await _write((
+            "DELETE FROM admin_channels WHERE admin_id = ? AND channel_id = ?",
+            (admin_id, channel_id)
+        ))
+        _cache.invalidate(('admin_channels', admin_id), ('channel_admins', channel_id))
         return True
     except Exception as e:
         print(f"Error unassigning admin from channel: {e}")
@@ -231,16 +656,21 @@ async def unassign_admin_from_channel(admin_id: int, channel_id: str) -> bool:
 
 async def get_admin_channels(admin_id: int) -> List[Dict]:
     """Получить список каналов админа"""
-    async with aiosqlite.connect(DB_FILE) as conn:
-        conn.row_factory = aiosqlite.Row
-        async with conn.execute("""
-            SELECT c.* FROM channels c
-            JOIN admin_channels ac ON c.channel_id = ac.channel_id
-            WHERE ac.admin_id = ?
-            ORDER BY c.channel_name
-        """, (admin_id,)) as cursor:
-            rows = await cursor.fetchall()
-            return [dict(row) for row in rows]
+    return await _cached(('admin_channels', admin_id), [('admin_channels', admin_id), 'channels'], lambda: _fetchall("""
+        SELECT c.* FROM channels c
+        JOIN admin_channels ac ON c.channel_id = ac.channel_id
+        WHERE ac.admin_id = ?
+        ORDER BY c.channel_name
+    """, (admin_id,)))
+
+
+async def get_channels_with_admin_flags(admin_id: int) -> List[Dict]:
+    """Все каналы одним запросом; assigned - прикреплён ли канал к админу"""
+    return await _cached(('channels_admin_flags', admin_id), [('admin_channels', admin_id), 'channels'], lambda: _fetchall("""
+        SELECT c.*, ac.admin_id IS NOT NULL AS assigned FROM channels c
+        LEFT JOIN admin_channels ac ON ac.channel_id = c.channel_id AND ac.admin_id = ?
+        ORDER BY c.added_at
+    """, (admin_id,)))
 
 
 # ================== STATISTICS ==================
@@ -249,63 +679,91 @@ async def log_upload(admin_id: int, channel_id: str, title: str, season: int, ep
                     file_id: Optional[str] = None, message_id: Optional[str] = None) -> bool:
     """Записать загрузку в статистику"""
     try:
-        async with aiosqlite.connect(DB_FILE) as conn:
-            await conn.execute("""
-                INSERT INTO upload_stats (admin_id, channel_id, title, season, episode, file_id, message_id)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            """, (admin_id, channel_id, title, season, episode, file_id, message_id))
-            await conn.commit()
+        await _write(("""
+            INSERT INTO upload_stats (admin_id, channel_id, title, season, episode, file_id, message_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (admin_id, channel_id, title, season, episode, file_id, message_id)))
         return True
     except Exception as e:
         print(f"Error logging upload: {e}")
         return False
 
 
+async def log_uploads(uploads: List[Tuple]) -> bool:
+    """Записать несколько загрузок одной транзакцией.
+
+    Каждая загрузка - кортеж (admin_id, channel_id, title, season, episode, file_id, message_id)
+    """
+    if not uploads:
+        return True
+    try:
+        await _write(("""
+            INSERT INTO upload_stats (admin_id, channel_id, title, season, episode, file_id, message_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, list(uploads)))
+        return True
+    except Exception as e:
+        print(f"Error logging uploads: {e}")
+        return False
+
+
 async def get_admin_stats(admin_id: int) -> Dict:
-    """Получить статистику админа"""
-    async with aiosqlite.connect(DB_FILE) as conn:
-        conn.row_factory = aiosqlite.Row
-        
+    """Получить статистику админа (из агрегатов stats_*)"""
+    async with _reader() as conn:
         # Общее количество
         async with conn.execute(
-            "SELECT COUNT(*) as total FROM upload_stats WHERE admin_id = ?",
+            "SELECT total, last_upload FROM stats_admin WHERE admin_id = ?",
             (admin_id,)
         ) as cursor:
-            total = (await cursor.fetchone())['total']
+            row = await cursor.fetchone()
         
         # По каналам
         async with conn.execute("""
-            SELECT c.channel_name, COUNT(*) as count
-            FROM upload_stats us
-            JOIN channels c ON us.channel_id = c.channel_id
-            WHERE us.admin_id = ?
-            GROUP BY c.channel_id
+            SELECT c.channel_name, s.total as count
+            FROM stats_admin_channel s
+            JOIN channels c ON s.channel_id = c.channel_id
+            WHERE s.admin_id = ? AND s.total > 0
             ORDER BY count DESC
         """, (admin_id,)) as cursor:
             by_channel = [dict(row) for row in await cursor.fetchall()]
         
         return {
-            'total': total,
+            'total': row['total'] if row else 0,
+            'last_upload': row['last_upload'] if row else None,
             'by_channel': by_channel
         }
 
 
 async def get_all_stats() -> List[Dict]:
     """Получить общую статистику всех админов"""
-    async with aiosqlite.connect(DB_FILE) as conn:
-        conn.row_factory = aiosqlite.Row
-        async with conn.execute("""
-            SELECT 
-                a.user_id,
-                a.username,
-                COUNT(us.id) as total_uploads
-            FROM admins a
-            LEFT JOIN upload_stats us ON a.user_id = us.admin_id
-            GROUP BY a.user_id
-            ORDER BY total_uploads DESC
-        """) as cursor:
-            rows = await cursor.fetchall()
-            return [dict(row) for row in rows]
+    return await _fetchall("""
+        SELECT 
+            a.user_id,
+            a.username,
+            COALESCE(s.total, 0) as total_uploads,
+            s.last_upload
+        FROM admins a
+        LEFT JOIN stats_admin s ON a.user_id = s.admin_id
+        ORDER BY total_uploads DESC
+    """)
+
+
+async def get_daily_stats(days: int = 30) -> List[Dict]:
+    """Количество загрузок по дням (последние days дней с загрузками)"""
+    return await _fetchall(
+        "SELECT day, total FROM stats_daily WHERE total > 0 ORDER BY day DESC LIMIT ?",
+        (days,)
+    )
+
+
+async def rebuild_stats() -> bool:
+    """Пересчитать агрегаты stats_* из сырой истории upload_stats"""
+    try:
+        await _write(*[(sql, ()) for sql in migrations.REBUILD_STATS])
+        return True
+    except Exception as e:
+        print(f"Error rebuilding stats: {e}")
+        return False
 
 
 # ================== TEMPLATE FUNCTIONS ==================
@@ -313,14 +771,12 @@ async def get_all_stats() -> List[Dict]:
 async def add_template(name: str, template_text: str) -> Optional[int]:
     """Добавить шаблон"""
     try:
-        async with aiosqlite.connect(DB_FILE) as conn:
-            cursor = await conn.execute(
-                "INSERT INTO templates (name, template_text) VALUES (?, ?)",
-                (name, template_text)
-            )
-            template_id = cursor.lastrowid
-            await conn.commit()
-            return template_id
+        template_id = await _write((
+            "INSERT INTO templates (name, template_text) VALUES (?, ?)",
+            (name, template_text)
+        ))
+        _cache.invalidate('templates')
+        return template_id
     except Exception as e:
         print(f"Error adding template: {e}")
         return None
@@ -329,17 +785,16 @@ async def add_template(name: str, template_text: str) -> Optional[int]:
 async def update_template(template_id: int, name: str = None, template_text: str = None) -> bool:
     """Обновить шаблон"""
     try:
-        async with aiosqlite.connect(DB_FILE) as conn:
-            if name and template_text:
-                await conn.execute(
-                    "UPDATE templates SET name = ?, template_text = ? WHERE id = ?",
-                    (name, template_text, template_id)
-                )
-            elif name:
-                await conn.execute("UPDATE templates SET name = ? WHERE id = ?", (name, template_id))
-            elif template_text:
-                await conn.execute("UPDATE templates SET template_text = ? WHERE id = ?", (template_text, template_id))
-            await conn.commit()
+        if name and template_text:
+            await _write((
+                "UPDATE templates SET name = ?, template_text = ? WHERE id = ?",
+                (name, template_text, template_id)
+            ))
+        elif name:
+            await _write(("UPDATE templates SET name = ? WHERE id = ?", (name, template_id)))
+        elif template_text:
+            await _write(("UPDATE templates SET template_text = ? WHERE id = ?", (template_text, template_id)))
+        _cache.invalidate(('template', template_id), 'templates')
         return True
     except Exception as e:
         print(f"Error updating template: {e}")
@@ -349,9 +804,8 @@ async def update_template(template_id: int, name: str = None, template_text: str
 async def remove_template(template_id: int) -> bool:
     """Удалить шаблон"""
     try:
-        async with aiosqlite.connect(DB_FILE) as conn:
-            await conn.execute("DELETE FROM templates WHERE id = ?", (template_id,))
-            await conn.commit()
+        await _write(("DELETE FROM templates WHERE id = ?", (template_id,)))
+        _cache.invalidate(('template', template_id), 'templates')
         return True
     except Exception as e:
         print(f"Error removing template: {e}")
@@ -360,40 +814,30 @@ async def remove_template(template_id: int) -> bool:
 
 async def get_template(template_id: int) -> Optional[Dict]:
     """Получить шаблон по ID"""
-    async with aiosqlite.connect(DB_FILE) as conn:
-        conn.row_factory = aiosqlite.Row
-        async with conn.execute("SELECT * FROM templates WHERE id = ?", (template_id,)) as cursor:
-            row = await cursor.fetchone()
-            return dict(row) if row else None
+    return await _cached(('template', template_id), [('template', template_id)],
+                         lambda: _fetchone("SELECT * FROM templates WHERE id = ?", (template_id,)))
 
 
 async def get_template_by_name(name: str) -> Optional[Dict]:
     """Получить шаблон по имени"""
-    async with aiosqlite.connect(DB_FILE) as conn:
-        conn.row_factory = aiosqlite.Row
-        async with conn.execute("SELECT * FROM templates WHERE name = ?", (name,)) as cursor:
-            row = await cursor.fetchone()
-            return dict(row) if row else None
+    return await _cached(('template_by_name', name), ['templates'],
+                         lambda: _fetchone("SELECT * FROM templates WHERE name = ?", (name,)))
 
 
 async def get_all_templates() -> List[Dict]:
     """Получить все шаблоны"""
-    async with aiosqlite.connect(DB_FILE) as conn:
-        conn.row_factory = aiosqlite.Row
-        async with conn.execute("SELECT * FROM templates ORDER BY name") as cursor:
-            rows = await cursor.fetchall()
-            return [dict(row) for row in rows]
+    return await _cached('all_templates', ['templates'],
+                         lambda: _fetchall("SELECT * FROM templates ORDER BY name"))
 
 
 async def assign_template_to_channel(channel_id: str, template_id: int) -> bool:
     """Прикрепить шаблон к каналу"""
     try:
-        async with aiosqlite.connect(DB_FILE) as conn:
-            await conn.execute(
-                "INSERT OR REPLACE INTO channel_templates (channel_id, template_id) VALUES (?, ?)",
-                (channel_id, template_id)
-            )
-            await conn.commit()
+        await _write((
+            "INSERT OR REPLACE INTO channel_templates (channel_id, template_id) VALUES (?, ?)",
+            (channel_id, template_id)
+        ))
+        _cache.invalidate(('channel_template', channel_id), 'channel_templates')
         return True
     except Exception as e:
         print(f"Error assigning template to channel: {e}")
@@ -403,9 +847,8 @@ async def assign_template_to_channel(channel_id: str, template_id: int) -> bool:
 async def unassign_template_from_channel(channel_id: str) -> bool:
     """Открепить шаблон от канала"""
     try:
-        async with aiosqlite.connect(DB_FILE) as conn:
-            await conn.execute("DELETE FROM channel_templates WHERE channel_id = ?", (channel_id,))
-            await conn.commit()
+        await _write(("DELETE FROM channel_templates WHERE channel_id = ?", (channel_id,)))
+        _cache.invalidate(('channel_template', channel_id), 'channel_templates')
         return True
     except Exception as e:
         print(f"Error unassigning template from channel: {e}")
@@ -414,12 +857,104 @@ async def unassign_template_from_channel(channel_id: str) -> bool:
 
 async def get_channel_template(channel_id: str) -> Optional[Dict]:
     """Получить шаблон канала"""
-    async with aiosqlite.connect(DB_FILE) as conn:
-        conn.row_factory = aiosqlite.Row
-        async with conn.execute("""
-            SELECT t.* FROM templates t
-            JOIN channel_templates ct ON t.id = ct.template_id
-            WHERE ct.channel_id = ?
-        """, (channel_id,)) as cursor:
-            row = await cursor.fetchone()
-            return dict(row) if row else None
+    return await _cached(('channel_template', channel_id), [('channel_template', channel_id), 'templates'], lambda: _fetchone("""
+        SELECT t.* FROM templates t
+        JOIN channel_templates ct ON t.id = ct.template_id
+        WHERE ct.channel_id = ?
+    """, (channel_id,)))
+
+
+async def get_channels_with_templates() -> List[Dict]:
+    """Все каналы с привязанным шаблоном одним запросом (template_id/template_name - None, если шаблона нет)"""
+    return await _cached('channels_templates', ['channel_templates', 'channels', 'templates'], lambda: _fetchall("""
+        SELECT c.*, t.id AS template_id, t.name AS template_name FROM channels c
+        LEFT JOIN channel_templates ct ON ct.channel_id = c.channel_id
+        LEFT JOIN templates t ON t.id = ct.template_id
+        ORDER BY c.added_at
+    """))
+
+
+# ================== OUTBOX ==================
+
+async def enqueue_jobs(jobs: List[Tuple]) -> bool:
+    """Добавить задачи публикации одной транзакцией.
+
+    Каждая задача - кортеж (batch_id, admin_id, chat_id, channel_id, payload)
+    """
+    try:
+        await _write(("""
+            INSERT INTO outbox (batch_id, admin_id, chat_id, channel_id, payload)
+            VALUES (?, ?, ?, ?, ?)
+        """, list(jobs)))
+        return True
+    except Exception as e:
+        print(f"Error enqueueing jobs: {e}")
+        return False
+
+
+async def get_pending_jobs() -> List[Dict]:
+    """Неопубликованные задачи по порядку (после перезапуска и прерванные тоже)"""
+    try:
+        await _write(("UPDATE outbox SET status = 'pending' WHERE status = 'running'", ()))
+    except Exception as e:
+        print(f"Error requeueing jobs: {e}")
+    return await _fetchall("SELECT * FROM outbox WHERE status = 'pending' ORDER BY id")
+
+
+async def get_batch_jobs(batch_id: str) -> List[Dict]:
+    """Задачи одной загрузки"""
+    return await _fetchall("SELECT * FROM outbox WHERE batch_id = ? ORDER BY id", (batch_id,))
+
+
+async def start_job(job_id: int) -> bool:
+    """Отметить задачу как выполняемую"""
+    try:
+        await _write(("UPDATE outbox SET status = 'running', attempts = attempts + 1 WHERE id = ?", (job_id,)))
+        return True
+    except Exception as e:
+        print(f"Error starting job: {e}")
+        return False
+
+
+async def finish_job(job_id: int, status: str, message_ids: Optional[str] = None, error: Optional[str] = None) -> bool:
+    """Записать результат задачи ('done' или 'failed')"""
+    try:
+        await _write(("""
+            UPDATE outbox SET status = ?, message_ids = ?, error = ?, finished_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        """, (status, message_ids, error, job_id)))
+        return True
+    except Exception as e:
+        print(f"Error finishing job: {e}")
+        return False
+
+
+async def get_outbox_stats() -> Dict[str, int]:
+    """Количество задач по статусам"""
+    rows = await _fetchall("SELECT status, COUNT(*) as count FROM outbox GROUP BY status")
+    return {row['status']: row['count'] for row in rows}
+
+
+# ================== FSM STATES ==================
+
+async def get_fsm_record(key: str) -> Optional[Dict]:
+    """Сохранённое состояние FSM (state, data в JSON, updated_at)"""
+    return await _fetchone("SELECT state, data, updated_at FROM fsm_states WHERE key = ?", (key,))
+
+
+async def save_fsm_records(saved: List[Tuple], deleted: List[Tuple], expired_before: float = 0) -> bool:
+    """Записать пачку состояний FSM одной транзакцией.
+
+    saved - кортежи (key, state, data, updated_at), deleted - кортежи (key,);
+    заодно удаляются состояния, не менявшиеся с expired_before (0 - не удалять)
+    """
+    try:
+        await _write(
+            ("INSERT OR REPLACE INTO fsm_states (key, state, data, updated_at) VALUES (?, ?, ?, ?)", list(saved)),
+            ("DELETE FROM fsm_states WHERE key = ?", list(deleted)),
+            ("DELETE FROM fsm_states WHERE updated_at < ?", (expired_before,)),
+        )
+        return True
+    except Exception as e:
+        print(f"Error saving FSM states: {e}")
+        return False
@@ -8,7 +8,7 @@ from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton
 
 import database_async as db
 from main_async import (
-    AdminStates, is_super_admin, is_admin_check, SUPER_ADMIN_IDS,
+    AdminStates, is_super_admin, SUPER_ADMIN_IDS,
     escape_markdown, main_menu_keyboard, back_and_home_keyboard
 )
 import logging
@@ -39,6 +39,22 @@ def admin_actions_keyboard() -> ReplyKeyboardMarkup:
     )
 
 
+def attach_channels_keyboard(channels: list) -> ReplyKeyboardMarkup:
+    """Каналы для прикрепления к админу (из get_channels_with_admin_flags): ✅ - прикреплен"""
+    buttons = []
+    for ch in channels:
+        if ch['assigned']:
+            buttons.append([KeyboardButton(text=f"✅ {ch['channel_name']}")])
+        else:
+            buttons.append([KeyboardButton(text=f"⬜ {ch['channel_name']}")])
+    
+    buttons.append([
+        KeyboardButton(text="🔙 К каналам админа"),
+        KeyboardButton(text="🏠 Главное меню")
+    ])
+    return ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True)
+
+
 def admin_channels_keyboard() -> ReplyKeyboardMarkup:
     """Меню управления каналами админа"""
     return ReplyKeyboardMarkup(
@@ -287,33 +303,16 @@ async def btn_attach_channel(message: Message, state: FSMContext):
         await state.clear()
         return
     
-    # Получаем все каналы и каналы админа
-    all_channels = await db.get_all_channels()
-    admin_channels = await db.get_admin_channels(admin_id)
+    # Все каналы с отметкой, прикреплены ли они к админу, - одним запросом
+    all_channels = await db.get_channels_with_admin_flags(admin_id)
     
     if not all_channels:
         await message.answer("❌ Нет доступных каналов")
         return
     
-    # ID прикрепленных каналов
-    attached_ids = {ch['channel_id'] for ch in admin_channels}
-    
     await state.set_state(AdminStates.attaching_channel)
     
-    # Создаем клавиатуру с каналами
-    buttons = []
-    for ch in all_channels:
-        if ch['channel_id'] in attached_ids:
-            buttons.append([KeyboardButton(text=f"✅ {ch['channel_name']}")])
-        else:
-            buttons.append([KeyboardButton(text=f"⬜ {ch['channel_name']}")])
-    
-    buttons.append([
-        KeyboardButton(text="🔙 К каналам админа"),
-        KeyboardButton(text="🏠 Главное меню")
-    ])
-    
-    keyboard = ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True)
+    keyboard = attach_channels_keyboard(all_channels)
     
     await message.answer(
         "📺 *Прикрепление каналов*\n\n"
@@ -359,22 +358,7 @@ async def process_attach_channel(message: Message, state: FSMContext):
     
     if success:
         # Обновляем клавиатуру
-        admin_channels = await db.get_admin_channels(admin_id)
-        attached_ids = {ch['channel_id'] for ch in admin_channels}
-        
-        buttons = []
-        for ch in all_channels:
-            if ch['channel_id'] in attached_ids:
-                buttons.append([KeyboardButton(text=f"✅ {ch['channel_name']}")])
-            else:
-                buttons.append([KeyboardButton(text=f"⬜ {ch['channel_name']}")])
-        
-        buttons.append([
-            KeyboardButton(text="🔙 К каналам админа"),
-            KeyboardButton(text="🏠 Главное меню")
-        ])
-        
-        keyboard = ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True)
+        keyboard = attach_channels_keyboard(await db.get_channels_with_admin_flags(admin_id))
         
         await message.answer(
             f"✅ Канал *{channel_name}* {action}",
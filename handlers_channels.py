@@ -8,7 +8,7 @@ from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton
 
 import database_async as db
 from main_async import (
-    ChannelStates, is_super_admin, is_admin_check,
+    ChannelStates, is_super_admin,
     escape_markdown, bot, back_and_home_keyboard, main_menu_keyboard
 )
 from utils import parse_channel_id
@@ -6,9 +6,10 @@ from aiogram.filters import StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton
 
+import captions
 import database_async as db
 from main_async import (
-    TemplateStates, is_super_admin, is_admin_check,
+    TemplateStates, is_super_admin,
     escape_markdown, main_menu_keyboard
 )
 import logging
@@ -28,6 +29,22 @@ def templates_menu_keyboard() -> ReplyKeyboardMarkup:
     )
 
 
+def template_channels_keyboard(channels: list, template_id: int) -> ReplyKeyboardMarkup:
+    """Каналы для прикрепления шаблона (из get_channels_with_templates): ✅ - уже с этим шаблоном"""
+    buttons = []
+    for ch in channels:
+        if ch['template_id'] == template_id:
+            buttons.append([KeyboardButton(text=f"✅ {ch['channel_name']}")])
+        else:
+            buttons.append([KeyboardButton(text=f"📺 {ch['channel_name']}")])
+    
+    buttons.append([
+        KeyboardButton(text="🔙 К шаблонам"),
+        KeyboardButton(text="🏠 Главное меню")
+    ])
+    return ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True)
+
+
 def template_actions_keyboard() -> ReplyKeyboardMarkup:
     """Меню действий с шаблоном"""
     return ReplyKeyboardMarkup(
@@ -112,10 +129,7 @@ async def process_template_name(message: Message, state: FSMContext):
         f"📝 Название: *{template_name}*\n\n"
         f"Теперь отправьте текст шаблона.\n\n"
         f"Доступные переменные:\n"
-        f"• `{{title}}` - название\n"
-        f"• `{{season}}` - сезон\n"
-        f"• `{{episode}}` - серия\n"
-        f"• `{{tag}}` - тег\n\n"
+        f"{captions.VARIABLES_HELP}\n\n"
         f"Пример:\n"
         f"`🎬 {{title}}`\n"
         f"`📺 Сезон {{season}}, Серия {{episode}}`\n"
@@ -131,6 +145,15 @@ async def process_template_text(message: Message, state: FSMContext):
     template_name = state_data.get('template_name')
     template_text = message.text
     
+    # Проверяем шаблон до сохранения (переменные, секции, длина подписи)
+    error = captions.validate_template(template_text)
+    if error:
+        await message.answer(
+            f"❌ Ошибка в шаблоне: {error}\n\n"
+            f"Исправьте текст и отправьте снова."
+        )
+        return
+    
     # Добавляем шаблон
     template_id = await db.add_template(template_name, template_text)
     
@@ -228,7 +251,8 @@ async def btn_view_template(message: Message, state: FSMContext):
     await message.answer(
         f"📝 *{template['name']}*\n\n"
         f"Текст шаблона:\n"
-        f"```\n{template['template_text']}\n```",
+        f"```\n{template['template_text']}\n```\n\n"
+        f"{escape_markdown(captions.legacy_warning(template['template_text']))}",
         parse_mode="Markdown"
     )
 
@@ -310,8 +334,8 @@ async def process_select_template_for_channel(message: Message, state: FSMContex
     
     await state.update_data(selected_template_id=template['id'])
     
-    # Получаем все каналы
-    channels = await db.get_all_channels()
+    # Все каналы вместе с их шаблонами - одним запросом
+    channels = await db.get_channels_with_templates()
     
     if not channels:
         await message.answer("❌ Нет каналов")
@@ -320,22 +344,7 @@ async def process_select_template_for_channel(message: Message, state: FSMContex
     
     await state.set_state(TemplateStates.assigning_template_to_channel)
     
-    # Создаем клавиатуру с каналами
-    buttons = []
-    for ch in channels:
-        # Проверяем, прикреплен ли уже шаблон к этому каналу
-        ch_template = await db.get_channel_template(ch['channel_id'])
-        if ch_template and ch_template['id'] == template['id']:
-            buttons.append([KeyboardButton(text=f"✅ {ch['channel_name']}")])
-        else:
-            buttons.append([KeyboardButton(text=f"📺 {ch['channel_name']}")])
-    
-    buttons.append([
-        KeyboardButton(text="🔙 К шаблонам"),
-        KeyboardButton(text="🏠 Главное меню")
-    ])
-    
-    keyboard = ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True)
+    keyboard = template_channels_keyboard(channels, template['id'])
     
     await message.answer(
         f"📝 Шаблон: *{template['name']}*\n\n"
@@ -356,7 +365,7 @@ async def process_assign_template_to_channel(message: Message, state: FSMContext
     channel_name = message.text[2:].strip()  # Убираем "✅ " или "📺 "
     
     # Ищем канал
-    channels = await db.get_all_channels()
+    channels = await db.get_channels_with_templates()
     selected_channel = None
     
     for ch in channels:
@@ -376,20 +385,7 @@ async def process_assign_template_to_channel(message: Message, state: FSMContext
         logging.info(f"Template '{template['name']}' assigned to channel '{channel_name}'")
         
         # Обновляем клавиатуру
-        buttons = []
-        for ch in channels:
-            ch_template = await db.get_channel_template(ch['channel_id'])
-            if ch_template and ch_template['id'] == template_id:
-                buttons.append([KeyboardButton(text=f"✅ {ch['channel_name']}")])
-            else:
-                buttons.append([KeyboardButton(text=f"📺 {ch['channel_name']}")])
-        
-        buttons.append([
-            KeyboardButton(text="🔙 К шаблонам"),
-            KeyboardButton(text="🏠 Главное меню")
-        ])
-        
-        keyboard = ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True)
+        keyboard = template_channels_keyboard(await db.get_channels_with_templates(), template_id)
         
         await message.answer(
             f"✅ Шаблон прикреплен к каналу *{channel_name}*",
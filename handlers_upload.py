@@ -1,44 +1,83 @@
 """
 Обработчики загрузки контента для асинхронного бота
 """
+import asyncio
+import os
+from typing import Dict, List, Optional, Tuple
+
 from aiogram import Router, F
 from aiogram.filters import StateFilter
 from aiogram.fsm.context import FSMContext
-from aiogram.types import Message, ContentType
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+from aiogram.types import Message, ContentType, InputMediaDocument, InputMediaVideo
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
 
+import captions
 import database_async as db
+import outbox_async
+import retry
 from main_async import (
-    UploadStates, is_super_admin, is_admin_check, 
-    parse_input, escape_markdown, bot
+    UploadStates, parse_input, escape_markdown, bot
 )
+from middlewares import AdminContext, KeyedLocks, user_locks
 import logging
 
 router = Router()
 
+# Альбом (send_media_group) - не больше 10 файлов
+MEDIA_GROUP_LIMIT = 10
+
+# Сколько секунд ждать следующих файлов диапазона, прежде чем опубликовать собранные
+ALBUM_COLLECT_DELAY = float(os.getenv("ALBUM_COLLECT_DELAY", 1.5))
+
+# Через сколько секунд без новых файлов закрывать сессию загрузки
+UPLOAD_SESSION_TIMEOUT = float(os.getenv("UPLOAD_SESSION_TIMEOUT", 600))
+
+BTN_SELECT_ALL = "☑️ Все каналы"
+BTN_DONE = "✔️ Готово"
+
 
-def channels_select_keyboard(channels: list) -> ReplyKeyboardMarkup:
-    """Клавиатура выбора канала"""
+def channels_select_keyboard(channels: list, selected=()) -> ReplyKeyboardMarkup:
+    """Клавиатура выбора каналов (отмеченные - с ✅)"""
     buttons = []
     for ch in channels:
-        buttons.append([KeyboardButton(text=f"📺 {ch['channel_name']}")])
+        mark = "✅" if ch['channel_id'] in selected else "📺"
+        buttons.append([KeyboardButton(text=f"{mark} {ch['channel_name']}")])
+    buttons.append([KeyboardButton(text=BTN_SELECT_ALL), KeyboardButton(text=f"{BTN_DONE} ({len(selected)})")])
     buttons.append([KeyboardButton(text="🏠 Главное меню")])
     
     return ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True)
 
 
+def video_prompt(data: dict) -> str:
+    """Что отправить дальше: один файл или файлы всех серий диапазона"""
+    if data.get('is_range'):
+        return (
+            f"Теперь отправьте файлы серий {data['episode_start']}-{data['episode_end']} по порядку "
+            "(можно альбомом, до 10 за раз)."
+        )
+    return (
+        f"Теперь отправьте видео или документ серии {data['episode']}.\n"
+        "Следующие файлы получат номера по порядку."
+    )
+
+
+def publish_error_text(error) -> str:
+    """Короткое описание ошибки публикации (исключение или текст из очереди) для сводки"""
+    error_msg = str(error)
+    if "bot was blocked" in error_msg.lower():
+        return "бот заблокирован или не имеет прав на публикацию"
+    if "chat not found" in error_msg.lower():
+        return "канал не найден, возможно, бот был удален из канала"
+    return error_msg
+
+
 @router.message(F.text.in_(["📤 Загрузить", "📤 Загрузить контент"]))
-async def btn_upload(message: Message, state: FSMContext):
+async def btn_upload(message: Message, state: FSMContext, admin: AdminContext):
     """Начало загрузки контента"""
-    user_id = message.from_user.id
-    
-    if not await is_admin_check(user_id):
-        return
-    
     # Проверка доступа к каналам
-    if not is_super_admin(user_id):
-        channels = await db.get_admin_channels(user_id)
-        if not channels:
+    if not admin.is_super:
+        if not admin.channels:
             await message.answer(
                 "❌ *Нет доступных каналов*\n\n"
                 "Вы не назначены ни на один канал.\n"
@@ -68,10 +107,8 @@ async def btn_upload(message: Message, state: FSMContext):
 
 
 @router.message(UploadStates.waiting_info, F.text)
-async def process_upload_info(message: Message, state: FSMContext):
+async def process_upload_info(message: Message, state: FSMContext, admin: AdminContext):
     """Обработка информации о видео"""
-    user_id = message.from_user.id
-    
     data = parse_input(message.text)
     if not data:
         await message.answer(
@@ -86,14 +123,11 @@ async def process_upload_info(message: Message, state: FSMContext):
         )
         return
     
-    # Сохраняем данные
-    await state.update_data(data=data)
+    # Сохраняем данные (словарём: update_data(data=...) разложил бы их по ключам состояния)
+    await state.update_data({"data": data})
     
-    # Получаем доступные каналы
-    if is_super_admin(user_id):
-        channels = await db.get_all_channels()
-    else:
-        channels = await db.get_admin_channels(user_id)
+    # Доступные каналы уже определены в AdminAuthMiddleware
+    channels = admin.channels
     
     if not channels:
         await message.answer("❌ Нет доступных каналов")
@@ -102,42 +136,37 @@ async def process_upload_info(message: Message, state: FSMContext):
     
     # Если канал один - автоматически выбираем
     if len(channels) == 1:
-        await state.update_data(channel_id=channels[0]['channel_id'])
+        await state.update_data(channel_ids=[channels[0]['channel_id']])
         await state.set_state(UploadStates.waiting_video)
+        touch_session(message.from_user.id, state)
         
         await message.answer(
             f"✅ Информация принята!\n"
             f"📺 Канал: *{channels[0]['channel_name']}*\n\n"
-            "Теперь отправьте видео или документ.",
+            f"{video_prompt(data)}",
             parse_mode="Markdown"
         )
     else:
-        # Показываем выбор каналов
+        # Показываем выбор каналов (можно отметить несколько)
+        await state.update_data(channel_ids=[])
         await state.set_state(UploadStates.selecting_channel)
         keyboard = channels_select_keyboard(channels)
         
         await message.answer(
             "✅ Информация принята!\n\n"
-            "Выберите канал для публикации:",
+            "Отметьте каналы для публикации и нажмите «✔️ Готово»:",
             reply_markup=keyboard
         )
 
 
-@router.message(UploadStates.selecting_channel, F.text.startswith("📺 "))
-async def process_channel_selection(message: Message, state: FSMContext):
-    """Обработка выбора канала"""
-    user_id = message.from_user.id
-    channel_name = message.text[2:].strip()  # Убираем "📺 "
-    
-    # Получаем доступные каналы
-    if is_super_admin(user_id):
-        channels = await db.get_all_channels()
-    else:
-        channels = await db.get_admin_channels(user_id)
+@router.message(UploadStates.selecting_channel, F.text.startswith(("📺 ", "✅ ")))
+async def process_channel_selection(message: Message, state: FSMContext, admin: AdminContext):
+    """Отметить/снять канал"""
+    channel_name = message.text[2:].strip()  # Убираем "📺 " / "✅ "
     
     # Ищем выбранный канал
     selected_channel = None
-    for ch in channels:
+    for ch in admin.channels:
         if ch['channel_name'] == channel_name:
             selected_channel = ch
             break
@@ -146,140 +175,364 @@ async def process_channel_selection(message: Message, state: FSMContext):
         await message.answer("❌ Канал не найден")
         return
     
-    await state.update_data(channel_id=selected_channel['channel_id'])
-    await state.set_state(UploadStates.waiting_video)
+    state_data = await state.get_data()
+    channel_ids = state_data.get('channel_ids', [])
+    if selected_channel['channel_id'] in channel_ids:
+        channel_ids.remove(selected_channel['channel_id'])
+        text = f"➖ {selected_channel['channel_name']}"
+    else:
+        channel_ids.append(selected_channel['channel_id'])
+        text = f"➕ {selected_channel['channel_name']}"
+    await state.update_data(channel_ids=channel_ids)
+    
+    await message.answer(text, reply_markup=channels_select_keyboard(admin.channels, channel_ids))
+
+
+@router.message(UploadStates.selecting_channel, F.text == BTN_SELECT_ALL)
+async def process_select_all_channels(message: Message, state: FSMContext, admin: AdminContext):
+    """Отметить все доступные каналы (или снять, если уже отмечены)"""
+    state_data = await state.get_data()
+    all_ids = [ch['channel_id'] for ch in admin.channels]
+    channel_ids = [] if set(state_data.get('channel_ids', [])) == set(all_ids) else all_ids
+    await state.update_data(channel_ids=channel_ids)
     
     await message.answer(
-        f"✅ Канал выбран: *{selected_channel['channel_name']}*\n\n"
-        "Теперь отправьте видео или документ.",
-        parse_mode="Markdown"
+        f"Отмечено каналов: {len(channel_ids)}",
+        reply_markup=channels_select_keyboard(admin.channels, channel_ids)
     )
 
 
-@router.message(UploadStates.waiting_video, F.content_type.in_([ContentType.VIDEO, ContentType.DOCUMENT]))
-async def process_video_upload(message: Message, state: FSMContext):
-    """Обработка загрузки видео"""
-    user_id = message.from_user.id
-    
-    # Получаем данные из состояния
+@router.message(UploadStates.selecting_channel, F.text.startswith(BTN_DONE))
+async def process_channels_done(message: Message, state: FSMContext, admin: AdminContext):
+    """Завершить выбор каналов"""
     state_data = await state.get_data()
-    data = state_data.get('data')
-    channel_id = state_data.get('channel_id')
+    channel_ids = state_data.get('channel_ids', [])
     
-    if not data or not channel_id:
-        await message.answer("❌ Ошибка: данные не найдены. Начните заново.")
-        await state.clear()
+    if not channel_ids:
+        await message.answer("❗ Отметьте хотя бы один канал")
         return
     
-    # Получаем информацию о канале
-    channel = await db.get_channel(channel_id)
-    if not channel:
-        await message.answer("❌ Канал не найден")
-        await state.clear()
-        return
+    await state.set_state(UploadStates.waiting_video)
+    touch_session(message.from_user.id, state)
     
-    # Формируем подпись
-    template = await db.get_channel_template(channel_id)
+    # Один канал запоминаем для загрузки одним сообщением (видео с подписью)
+    if len(channel_ids) == 1:
+        await db.set_default_channel(message.from_user.id, channel_ids[0])
     
-    if template:
-        # Используем шаблон
-        caption = template['template_text']
-        caption = caption.replace('{title}', data['title'])
-        caption = caption.replace('{season}', str(data['season']))
-        
-        if data.get('is_range'):
-            episode_str = f"{data['episode_start']}-{data['episode_end']}"
-        else:
-            episode_str = str(data['episode'])
-        caption = caption.replace('{episode}', episode_str)
-        caption = caption.replace('{tag}', data['tag'])
-    else:
-        # Стандартный формат
-        if data.get('is_range'):
-            episode_text = f"📺 Серии {data['episode_start']}-{data['episode_end']}"
-        else:
-            episode_text = f"📺 Серия {data['episode']}"
-        
-        caption = (
-            f"🎬 {data['title']}\n\n"
-            f"📺 Сезон {data['season']}\n"
-            f"{episode_text}\n\n"
-            f"{data['tag']}\n\n"
-            "Наш канал: https://t.me/+XaaureBEZzMwNDk6\n"
-            "Наш чат: https://t.me/Anume2D"
+    names = [ch['channel_name'] for ch in admin.channels if ch['channel_id'] in channel_ids]
+    await message.answer(
+        f"✅ Каналы выбраны: *{', '.join(names)}*\n\n"
+        f"{video_prompt(state_data['data'])}",
+        parse_mode="Markdown",
+        reply_markup=ReplyKeyboardMarkup(
+            keyboard=[[KeyboardButton(text="🏠 Главное меню")]],
+            resize_keyboard=True
         )
+    )
+
+
+def message_file(message: Message) -> Tuple[str, str]:
+    """(тип, file_id) видео или документа из сообщения"""
+    if message.content_type == ContentType.VIDEO:
+        return ContentType.VIDEO, message.video.file_id
+    return ContentType.DOCUMENT, message.document.file_id
+
+
+def media_chunks(items: list) -> list:
+    """Разбить файлы на альбомы: до 10 файлов, видео и документы не смешиваются"""
+    chunks = []
+    for item in items:
+        if chunks and len(chunks[-1]) < MEDIA_GROUP_LIMIT and chunks[-1][0][0] == item[0]:
+            chunks[-1].append(item)
+        else:
+            chunks.append([item])
+    return chunks
+
+
+async def send_to_channel(channel_id: str, items: list) -> Tuple[list, Optional[Exception]]:
+    """Опубликовать файлы (по file_id) в один канал.
+
+    items - список (тип, file_id, данные серии); несколько файлов уходят
+    альбомами через send_media_group (по 10). Повтор - только после 429 и ошибок
+    соединения (retry.py): после таймаута пост мог выйти, повтор его продублировал бы. Возвращает ([(item, message_id)], ошибка или None).
+    """
+    # Подпись по шаблону канала (компилируется один раз и кешируется)
+    template = await db.get_channel_template(channel_id)
+    
+    async def send_chunk(chunk):
+        if len(chunk) == 1:
+            content_type, file_id, data = chunk[0]
+            caption = captions.render_caption(channel_id, template, data)
+            if content_type == ContentType.VIDEO:
+                return [await bot.send_video(channel_id, file_id, caption=caption)]
+            return [await bot.send_document(channel_id, file_id, caption=caption)]
+        media_class = InputMediaVideo if chunk[0][0] == ContentType.VIDEO else InputMediaDocument
+        return await bot.send_media_group(channel_id, [
+            media_class(media=file_id, caption=captions.render_caption(channel_id, template, data))
+            for _, file_id, data in chunk
+        ])
     
+    published = []
     try:
-        # Отправляем в канал
-        sent = None
-        sent_file_id = None
-        
-        if message.content_type == ContentType.VIDEO:
-            sent_file_id = message.video.file_id
-            sent = await bot.send_video(channel_id, sent_file_id, caption=caption)
+        for chunk in media_chunks(items):
+            sent = await retry.call_async(channel_id, lambda: send_chunk(chunk))
+            published.extend((item, str(m.message_id)) for item, m in zip(chunk, sent))
+        return published, None
+    except Exception as e:
+        logging.error(f"Error publishing to channel {channel_id}: {e}")
+        return published, e
+
+
+async def run_publish_job(job: dict) -> Tuple[List[str], Optional[Exception]]:
+    """Выполнить задачу очереди: опубликовать в канал и записать статистику (по строке на серию)"""
+    channel_id = job['channel_id']
+    items = [tuple(item) for item in job['payload']['items']]
+    published, error = await send_to_channel(channel_id, items)
+    
+    await db.log_uploads([
+        (job['admin_id'], channel_id, item_data['title'], int(item_data['season']),
+         int(captions.first_episode(item_data)), file_id, message_id)
+        for (content_type, file_id, item_data), message_id in published
+    ])
+    
+    if published:
+        data = job['payload']['data']
+        logging.info(
+            f"Published | {data['title']} | S{data['season']} {captions.episode_label(data)} | "
+            f"files={len(published)} | Channel: {channel_id} | Admin: {job['admin_id']} | "
+            f"job={job['id']} | msg_ids={','.join(message_id for _, message_id in published)}"
+        )
+    return [message_id for _, message_id in published], error
+
+
+async def report_batch(jobs: List[dict]):
+    """Одна сводка по всем каналам загрузки, когда все её задачи завершены"""
+    data = jobs[0]['payload']['data']
+    succeeded = 0
+    lines = []
+    for job in jobs:
+        channel = await db.get_channel(job['channel_id'])
+        channel_name = channel['channel_name'] if channel else job['channel_id']
+        total = len(job['payload']['items'])
+        published = len(job['message_ids'])
+        if job['status'] == 'done':
+            succeeded += 1
+            count = f" ({published} файлов)" if total > 1 else ""
+            lines.append(f"✅ {channel_name}{count}")
         else:
-            sent_file_id = message.document.file_id
-            sent = await bot.send_document(channel_id, sent_file_id, caption=caption)
-        
-        message_id = str(sent.message_id) if sent else None
+            partial = f" (опубликовано {published} из {total})" if published else ""
+            lines.append(f"❌ {channel_name}{partial}: `{publish_error_text(job['error'])}`")
+    
+    title = "✅ *Успешно опубликовано!*" if succeeded == len(jobs) else (
+        f"⚠️ *Опубликовано в {succeeded} из {len(jobs)} каналов*" if succeeded
+        else "❌ *Ошибка публикации*"
+    )
+    await bot.send_message(
+        jobs[0]['chat_id'],
+        f"{title}\n\n"
+        f"🎬 {data['title']}\n"
+        f"📺 Сезон {data['season']}, {captions.episode_label(data)}\n"
+        f"🧾 Задача `{jobs[0]['batch_id']}`\n\n"
+        + "\n".join(lines),
+        parse_mode="Markdown"
+    )
+
+
+async def publish_and_report(message: Message, admin: AdminContext, channel_ids: list, items: list,
+                             data: dict, footer: str = "") -> bool:
+    """Поставить публикацию в очередь и сразу ответить номером задачи (сводка придёт после публикации)"""
+    # Только каналы, на которые у админа есть права
+    channel_ids = [ch['channel_id'] for ch in admin.channels if ch['channel_id'] in channel_ids]
+    if not channel_ids:
+        await message.answer("❌ Канал не найден")
+        return False
+    
+    batch_id = await outbox_async.enqueue(admin.user_id, message.chat.id, channel_ids, items, data)
+    if batch_id is None:
+        await message.answer("❌ Не удалось поставить публикацию в очередь. Попробуйте ещё раз.")
+        return False
+    
+    await message.answer(
+        f"📥 {captions.episode_label(data)} в очереди на публикацию (каналов: {len(channel_ids)}).\n"
+        f"🧾 Задача `{batch_id}` - пришлю сводку, когда всё будет опубликовано."
+        + (f"\n\n{footer}" if footer else ""),
+        parse_mode="Markdown"
+    )
+    return True
+
+
+# ================== UPLOAD SESSION ==================
+
+# После ввода "Название Сезон Серия(и)" состояние waiting_video остаётся открытым:
+# каждый следующий файл получает следующий номер серии. Сессия закрывается
+# после последней серии диапазона или через UPLOAD_SESSION_TIMEOUT без файлов.
+# Файлы диапазона копятся, пока идут подряд (части альбома приходят
+# отдельными сообщениями), и публикуются альбомами.
+_album_buffers: Dict[int, List[Message]] = {}
+_album_tasks: Dict[int, asyncio.Task] = {}
+# Замок сессии: публикации одного пользователя идут по очереди
+_session_locks = KeyedLocks()
+_session_timeouts: Dict[int, asyncio.Task] = {}
+
+
+def touch_session(user_id: int, state: FSMContext):
+    """Продлить сессию загрузки (закроется через UPLOAD_SESSION_TIMEOUT без новых файлов)"""
+    task = _session_timeouts.pop(user_id, None)
+    if task is not None:
+        task.cancel()
+    # Таймер хранит только хранилище и ключ: FSMContext и сообщение не живут до его срабатывания
+    _session_timeouts[user_id] = asyncio.create_task(_expire_session_later(state.storage, state.key))
+
+
+async def _expire_session_later(storage: BaseStorage, key: StorageKey):
+    await asyncio.sleep(UPLOAD_SESSION_TIMEOUT)
+    async with user_locks.hold(key.user_id):
+        if _session_timeouts.get(key.user_id) is asyncio.current_task():
+            del _session_timeouts[key.user_id]
+        state = FSMContext(storage=storage, key=key)
+        if await state.get_state() != UploadStates.waiting_video.state:
+            return
+        async with _session_locks.hold(key.user_id):
+            await state.clear()
+    await bot.send_message(key.chat_id, "⌛ Сессия загрузки закрыта: файлов не было слишком долго.")
+
+
+def end_session(user_id: int):
+    """Закрыть сессию загрузки: снять таймер, отложенную публикацию и накопленные файлы"""
+    for tasks in (_session_timeouts, _album_tasks):
+        task = tasks.pop(user_id, None)
+        # Сессию может закрыть сама отложенная публикация
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+    _album_buffers.pop(user_id, None)
+
+
+async def _flush_album_later(user_id: int, state: FSMContext, admin: AdminContext):
+    await asyncio.sleep(ALBUM_COLLECT_DELAY)
+    # Фоновая задача идёт вне UpdateConcurrencyMiddleware: ждём, пока закончится
+    # текущий апдейт пользователя, чтобы не гоняться с ним за состояние FSM
+    async with user_locks.hold(user_id):
+        if _album_tasks.get(user_id) is asyncio.current_task():
+            del _album_tasks[user_id]
+        await publish_next(user_id, state, admin)
+
+
+async def publish_next(user_id: int, state: FSMContext, admin: AdminContext):
+    """Сопоставить накопленные файлы следующим сериям по порядку и опубликовать"""
+    messages = _album_buffers.pop(user_id, [])
+    if not messages:
+        return
+    
+    async with _session_locks.hold(user_id):
+        state_data = await state.get_data()
+        data = state_data.get('data')
+        if not data or await state.get_state() != UploadStates.waiting_video.state:
+            return
+        first = captions.first_episode(data, state_data.get('next_episode'))
+        # Для одной серии сессия открыта, пока не истечёт таймаут
+        last = data['episode_end'] if data.get('is_range') else None
         
-        # Логируем в статистику
-        episode_for_log = data.get('episode') or data.get('episode_start', 0)
+        messages.sort(key=lambda m: m.message_id)
+        extra = []
+        if last is not None:
+            extra = messages[last - first + 1:]
+            messages = messages[:last - first + 1]
         
-        await db.log_upload(
-            user_id,
-            channel_id,
-            data['title'],
-            int(data['season']),
-            int(episode_for_log),
-            file_id=sent_file_id,
-            message_id=message_id
-        )
+        items = [
+            (*message_file(m), captions.episode_data(data, first + i))
+            for i, m in enumerate(messages)
+        ]
+        chunk_data = dict(data, episode_start=first, episode_end=first + len(items) - 1,
+                          is_range=len(items) > 1, episode=first)
         
-        # Формируем строку для логирования
-        if data.get('is_range'):
-            episode_log = f"S{data['season']}E{data['episode_start']}-{data['episode_end']}"
+        # Одно сообщение на раунд: номер задачи и что отправлять дальше
+        next_episode = first + len(items)
+        finished = last is not None and next_episode > last
+        if finished:
+            footer = f"⚠️ Лишних файлов: {len(extra)} - все серии диапазона уже получены" if extra else ""
+        elif last is not None:
+            footer = f"Осталось серий: {last - next_episode + 1} (следующая - {next_episode})."
         else:
-            episode_log = f"S{data['season']}E{data['episode']}"
+            footer = f"Следующий файл - серия {next_episode}. Закончить - «🏠 Главное меню»."
         
-        logging.info(
-            f"Published | {data['title']} | {episode_log} | "
-            f"Channel: {channel['channel_name']} | Admin: {user_id} | msg_id={message_id}"
-        )
+        queued = await publish_and_report(messages[0], admin, state_data['channel_ids'], items, chunk_data, footer)
+        if finished or not queued:
+            end_session(user_id)
+            await state.clear()
+            return
         
+        await state.update_data(next_episode=next_episode)
+        touch_session(user_id, state)
+
+
+@router.message(UploadStates.waiting_video, F.content_type.in_([ContentType.VIDEO, ContentType.DOCUMENT]))
+async def process_video_upload(message: Message, state: FSMContext, admin: AdminContext):
+    """Файл сессии загрузки: следующая серия, публикация во все выбранные каналы"""
+    # Получаем данные из состояния
+    state_data = await state.get_data()
+    data = state_data.get('data')
+    channel_ids = state_data.get('channel_ids')
+    
+    if not data or not channel_ids:
+        await message.answer("❌ Ошибка: данные не найдены. Начните заново.")
+        await state.clear()
+        return
+    
+    user_id = message.from_user.id
+    _album_buffers.setdefault(user_id, []).append(message)
+    
+    # Одна серия: публикуем сразу (по порядку - под замком сессии)
+    if not data.get('is_range'):
+        await publish_next(user_id, state, admin)
+        return
+    
+    # Диапазон: копим файлы (альбом или несколько сообщений подряд) и публикуем альбомами
+    task = _album_tasks.pop(user_id, None)
+    if task is not None:
+        task.cancel()
+    
+    # Сколько серий осталось - по состоянию под замком сессии (его могла сдвинуть публикация)
+    async with _session_locks.hold(user_id):
+        state_data = await state.get_data()
+        remaining = data['episode_end'] - captions.first_episode(data, state_data.get('next_episode')) + 1
+        flush_now = len(_album_buffers.get(user_id, [])) >= min(MEDIA_GROUP_LIMIT, remaining)
+    if flush_now:
+        await publish_next(user_id, state, admin)
+    else:
+        _album_tasks[user_id] = asyncio.create_task(_flush_album_later(user_id, state, admin))
+
+
+# ================== ONE-SHOT UPLOAD ==================
+
+def one_shot_channel(admin: AdminContext):
+    """Канал для загрузки одним сообщением: единственный или запомненный (None - не определить)"""
+    if len(admin.channels) == 1:
+        return admin.channels[0]['channel_id']
+    default = (admin.record or {}).get('default_channel_id')
+    return default if default and admin.can_post_to(default) else None
+
+
+@router.message(StateFilter(None), F.content_type.in_([ContentType.VIDEO, ContentType.DOCUMENT]), F.caption)
+async def process_captioned_video(message: Message, admin: AdminContext):
+    """Загрузка одним сообщением: "Название Сезон Серия" в подписи к видео"""
+    data = parse_input(message.caption)
+    if not data:
         await message.answer(
-            f"✅ *Успешно опубликовано!*\n\n"
-            f"📺 Канал: {channel['channel_name']}\n"
-            f"🎬 {data['title']}\n"
-            f"📺 Сезон {data['season']}, {episode_text}",
+            "❗ Подпись не распознана. Для загрузки одним сообщением укажите в подписи:\n"
+            "`Название Сезон Серия`",
             parse_mode="Markdown"
         )
-        
-        # Очищаем состояние
-        await state.clear()
-        
-    except Exception as e:
-        error_msg = str(e)
-        logging.error(f"Error publishing to channel {channel_id}: {error_msg}")
-        
-        if "bot was blocked" in error_msg.lower():
-            await message.answer(
-                "❌ *Ошибка публикации*\n\n"
-                "Бот заблокирован в канале или не имеет прав на публикацию.\n"
-                "Проверьте права бота в настройках канала.",
-                parse_mode="Markdown"
-            )
-        elif "chat not found" in error_msg.lower():
-            await message.answer(
-                "❌ *Ошибка публикации*\n\n"
-                "Канал не найден. Возможно, бот был удален из канала.",
-                parse_mode="Markdown"
-            )
-        else:
-            await message.answer(
-                f"❌ *Ошибка публикации*\n\n"
-                f"Детали: `{error_msg}`",
-                parse_mode="Markdown"
-            )
-        
-        await state.clear()
+        return
+    if data['is_range']:
+        await message.answer("❗ Диапазон серий загружается через «📤 Загрузить»")
+        return
+    
+    channel_id = one_shot_channel(admin)
+    if channel_id is None:
+        await message.answer(
+            "❗ Не знаю, в какой канал публиковать.\n"
+            "Загрузите серию через «📤 Загрузить» и выберите один канал - он запомнится."
+        )
+        return
+    
+    await publish_and_report(message, admin, [channel_id], [(*message_file(message), data)], data)
@@ -1,9 +1,19 @@
 import os
+import itertools
 import logging
+import json
+import threading
+import requests
 import telebot
-from telebot import types
+from telebot import apihelper, types
 from dotenv import load_dotenv
+import captions
 import database as db
+import outbox
+import ratelimit
+import retry
+import sessions
+import workers
 import keyboards as kb
 import time
 import socket
@@ -32,9 +42,46 @@ logging.info("🚀 Bot starting...")
 
 # ================== BOT ==================
 bot = telebot.TeleBot(BOT_TOKEN)
+# Апдейты одного пользователя - в одном потоке по очереди: сессия без замков
+bot.worker_pool.close()
+bot.worker_pool = workers.UserWorkerPool(bot)
+
+
+# Свои HTTP-сессии (keep-alive) на поток: requests.Session не потокобезопасна,
+# а запросы идут из потоков UserWorkerPool и воркеров outbox
+_http = threading.local()
+
+
+def http_session() -> requests.Session:
+    """HTTP-сессия текущего потока для запросов к Bot API"""
+    session = getattr(_http, 'session', None)
+    if session is None:
+        session = _http.session = requests.Session()
+    return session
+
+
+def limited_request(method, url, **kwargs):
+    """Отправка запроса telebot через общий лимитер (ответы админам - вперёд публикаций)"""
+    params = kwargs.get('params') or {}
+    # Альбом - столько сообщений, сколько файлов; у editMessageMedia media - один объект
+    media = json.loads(params['media']) if isinstance(params.get('media'), str) else None
+    amount = (len(media) or 1) if isinstance(media, list) else 1
+    ratelimit.limiter.acquire_sync(url.rsplit('/', 1)[-1], params.get('chat_id'), amount)
+    return http_session().request(method, url, **kwargs)
+
+
+apihelper.CUSTOM_REQUEST_SENDER = limited_request
 
 ADMINS_FILE = "admins.json"
-user_data = {}
+user_sessions = sessions.SessionStore()
+
+# Проверки доступа идут на каждый апдейт, поэтому логируется только каждая N-я
+ADMIN_CHECK_LOG_SAMPLE = max(1, int(os.getenv("ADMIN_CHECK_LOG_SAMPLE", "100")))
+_admin_checks = itertools.count(1)
+
+# Сессия загрузки: файлы после "Название Сезон Серия" получают серии по порядку,
+# пока не кончится диапазон или не пройдёт UPLOAD_SESSION_TIMEOUT секунд без файлов
+UPLOAD_SESSION_TIMEOUT = float(os.getenv("UPLOAD_SESSION_TIMEOUT", "600"))
 
 # ================== DATABASE INIT ==================
 db.init_db()
@@ -48,13 +95,16 @@ for admin_id in SUPER_ADMIN_IDS:
 
 # ================== HELPER FUNCTIONS ==================
 def is_admin(user_id):
-    """Проверка, является ли пользователь админом"""
-    if user_id in SUPER_ADMIN_IDS:
-        logging.info(f"Admin check | user={user_id} | SUPER_ADMIN=True")
-        return True
+    """Проверка, является ли пользователь админом.
+
+    Ответ БД (в т.ч. отрицательный) кешируется в database.py и сбрасывается
+    add_admin/remove_admin; в лог пишется только каждая N-я проверка (DEBUG).
+    """
+    result = user_id in SUPER_ADMIN_IDS or db.is_admin(user_id)
     
-    result = db.is_admin(user_id)
-    logging.info(f"Admin check | user={user_id} | result={result}")
+    checks = next(_admin_checks)
+    if checks % ADMIN_CHECK_LOG_SAMPLE == 0:
+        logging.debug(f"Admin check | user={user_id} | result={result} | checks={checks} | cache={db.get_cache_stats()}")
     return result
 
 def is_super_admin(user_id):
@@ -63,19 +113,30 @@ def is_super_admin(user_id):
 
 def get_user_state(user_id):
     """Получить состояние пользователя"""
-    if user_id not in user_data:
-        user_data[user_id] = {
-            'state': None,
-            'data': {},
-            'channel_id': None,
-            'temp': {}
-        }
-    return user_data[user_id]
+    return user_sessions.get(user_id)
 
 def clear_user_state(user_id):
     """Очистить состояние пользователя"""
-    if user_id in user_data:
-        del user_data[user_id]
+    user_sessions.clear(user_id)
+
+def start_upload_session(state):
+    """Перевести пользователя в ожидание файлов (сессия закроется по таймауту)"""
+    state['state'] = 'waiting_video'
+    state['session_expires'] = time.time() + UPLOAD_SESSION_TIMEOUT
+
+def upload_prompt(data):
+    """Что отправить дальше: файл первой серии, следующие пронумеруются сами"""
+    if not data:
+        return "Теперь отправьте видео или документ."
+    if data.get('is_range'):
+        return (
+            f"Теперь отправьте файлы серий {data['episode_start']}-{data['episode_end']} "
+            "по одному, по порядку."
+        )
+    return (
+        f"Теперь отправьте видео или документ серии {data['episode']}.\n"
+        "Следующие файлы получат номера по порядку."
+    )
 
 
 def escape_markdown(text: str) -> str:
@@ -500,14 +561,15 @@ def callback_handler(call):
             channel_id = data.split(":")[2]
             state = get_user_state(user_id)
             state['channel_id'] = channel_id
-            state['state'] = 'waiting_video'  # ✅ ИСПРАВЛЕНО: обновляем состояние
+            start_upload_session(state)
+            db.set_default_channel(user_id, channel_id)
             
             channel = db.get_channel(channel_id)
             bot.answer_callback_query(call.id, f"✅ Выбран: {channel['channel_name']}")
             
             bot.edit_message_text(
                 f"✅ Канал выбран: *{channel['channel_name']}*\n\n"
-                "Теперь отправьте видео или документ.",
+                f"{upload_prompt(state['data'])}",
                 call.message.chat.id,
                 call.message.message_id,
                 parse_mode="Markdown"
@@ -535,16 +597,15 @@ def handle_text(message):
     if not is_admin(user_id):
         return
     
-    # Обновляем username админа при каждом сообщении
+    # Обновляем username админа (в БД пишется только при изменении, пачкой в фоне)
     try:
-        username = message.from_user.username
-        if not username:
-            first_name = message.from_user.first_name or ""
-            last_name = message.from_user.last_name or ""
-            username = f"{first_name} {last_name}".strip() or None
+        first_name = message.from_user.first_name or ""
+        last_name = message.from_user.last_name or ""
+        full_name = f"{first_name} {last_name}".strip() or None
+        username = message.from_user.username or full_name
         
         if username:
-            db.add_admin(user_id, username=username)  # Обновит существующего
+            db.touch_admin_profile(user_id, username=username, name=full_name)
     except Exception as e:
         logging.warning(f"Could not update username for {user_id}: {e}")
     
@@ -822,12 +883,14 @@ def handle_text(message):
             
             # Сохраняем выбранный канал
             state['channel_id'] = selected_channel['channel_id']
-            state['state'] = 'waiting_video'
+            start_upload_session(state)
+            # Запоминаем для загрузки одним сообщением (видео с подписью)
+            db.set_default_channel(user_id, selected_channel['channel_id'])
             
             bot.send_message(
                 message.chat.id,
                 f"✅ Канал выбран: *{channel_name}*\n\n"
-                "Теперь отправьте видео или документ.",
+                f"{upload_prompt(state['data'])}",
                 parse_mode="Markdown",
                 reply_markup=kb.back_menu_reply()
             )
@@ -853,8 +916,8 @@ def handle_text(message):
         state['selected_template_name'] = template_name
         
         if state.get('state') == 'selecting_template_for_channel':
-            # Показываем список каналов
-            channels = db.get_all_channels()
+            # Показываем список каналов (вместе с их шаблонами - одним запросом)
+            channels = db.get_channels_with_templates()
             if not channels:
                 bot.reply_to(message, "❌ Нет каналов")
                 return
@@ -862,12 +925,9 @@ def handle_text(message):
             state['state'] = 'assigning_template_to_channel'
             
             # Находим канал, к которому уже прикреплен этот шаблон
-            assigned_channel_id = None
-            for ch in channels:
-                ch_template = db.get_channel_template(ch['channel_id'])
-                if ch_template and ch_template['id'] == template['id']:
-                    assigned_channel_id = ch['channel_id']
-                    break
+            assigned_channel_id = next(
+                (ch['channel_id'] for ch in channels if ch['template_id'] == template['id']), None
+            )
             
             markup = kb.channels_for_template_reply(channels, assigned_channel_id)
             bot.send_message(
@@ -1106,9 +1166,8 @@ def handle_text(message):
         
         state['state'] = 'attaching_channel'
         
-        all_channels = db.get_all_channels()
-        attached_channels = db.get_admin_channels(admin_id)
-        attached_ids = {ch['channel_id'] for ch in attached_channels}
+        all_channels = db.get_channels_with_admin_flags(admin_id)
+        attached_ids = {ch['channel_id'] for ch in all_channels if ch['assigned']}
         
         if not all_channels:
             bot.reply_to(message, "❌ Нет доступных каналов. Сначала добавьте каналы.")
@@ -1176,7 +1235,7 @@ def handle_text(message):
             channel_name = text[2:].strip()  # Убираем "✅ " или "⬜ "
             
             # Находим канал по имени
-            all_channels = db.get_all_channels()
+            all_channels = db.get_channels_with_admin_flags(admin_id)
             selected_channel = None
             for ch in all_channels:
                 if ch['channel_name'] == channel_name:
@@ -1188,11 +1247,9 @@ def handle_text(message):
                 return
             
             channel_id = selected_channel['channel_id']
-            attached_channels = db.get_admin_channels(admin_id)
-            attached_ids = {ch['channel_id'] for ch in attached_channels}
             
             # Переключаем состояние прикрепления
-            if channel_id in attached_ids:
+            if selected_channel['assigned']:
                 # Открепить
                 db.unassign_admin_from_channel(admin_id, channel_id)
                 action = "откреплен"
@@ -1202,8 +1259,8 @@ def handle_text(message):
                 action = "прикреплен"
             
             # Обновляем клавиатуру
-            attached_channels = db.get_admin_channels(admin_id)
-            attached_ids = {ch['channel_id'] for ch in attached_channels}
+            all_channels = db.get_channels_with_admin_flags(admin_id)
+            attached_ids = {ch['channel_id'] for ch in all_channels if ch['assigned']}
             markup = kb.channels_list_for_attach_reply(all_channels, attached_ids)
             
             bot.send_message(
@@ -1365,11 +1422,9 @@ def handle_text(message):
         
         response = f"📝 *{escape_markdown(template['name'])}*\n\n"
         response += f"*Текст шаблона:*\n\n{escape_markdown(template['template_text'])}\n\n"
+        response += escape_markdown(captions.legacy_warning(template['template_text']))
         response += "_Переменные:_\n"
-        response += "`{title}` - название\n"
-        response += "`{season}` - сезон\n"
-        response += "`{episode}` - серия\n"
-        response += "`{tag}` - тег"
+        response += captions.VARIABLES_HELP
         
         bot.reply_to(message, response, parse_mode="Markdown")
         return
@@ -1392,10 +1447,7 @@ def handle_text(message):
             "✏️ *Редактирование шаблона*\n\n"
             "Отправьте новый текст шаблона.\n\n"
             "Доступные переменные:\n"
-            "`{title}` - название\n"
-            "`{season}` - сезон\n"
-            "`{episode}` - серия\n"
-            "`{tag}` - тег",
+            f"{captions.VARIABLES_HELP}",
             parse_mode="Markdown",
             reply_markup=kb.back_menu_reply()
         )
@@ -1717,10 +1769,7 @@ def handle_text(message):
             f"📝 Название: *{escape_markdown(template_name)}*\n\n"
             "Теперь отправьте текст шаблона.\n\n"
             "Доступные переменные:\n"
-            "`{title}` - название\n"
-            "`{season}` - сезон\n"
-            "`{episode}` - серия\n"
-            "`{tag}` - тег\n\n"
+            f"{captions.VARIABLES_HELP}\n\n"
             "Пример:\n"
             "```\n"
             "🎬 {title}\n"
@@ -1740,6 +1789,11 @@ def handle_text(message):
         template_name = state['temp'].get('template_name')
         template_text = message.text
         
+        error = captions.validate_template(template_text)
+        if error:
+            bot.reply_to(message, f"❌ Ошибка в шаблоне: {error}\n\nИсправьте текст и отправьте снова.")
+            return
+        
         if db.add_template(template_name, template_text):
             bot.send_message(
                 message.chat.id,
@@ -1763,6 +1817,11 @@ def handle_text(message):
         template_id = state.get('selected_template_id')
         new_text = message.text
         
+        error = captions.validate_template(new_text)
+        if error:
+            bot.reply_to(message, f"❌ Ошибка в шаблоне: {error}\n\nИсправьте текст и отправьте снова.")
+            return
+        
         if db.update_template(template_id, template_text=new_text):
             bot.reply_to(message, "✅ Шаблон обновлен!")
             logging.info(f"Template {template_id} updated")
@@ -1795,7 +1854,7 @@ def handle_text(message):
         template_name = state.get('selected_template_name')
         
         # Находим канал
-        channels = db.get_all_channels()
+        channels = db.get_channels_with_templates()
         selected_channel = None
         for ch in channels:
             if ch['channel_name'] == channel_name:
@@ -1808,10 +1867,8 @@ def handle_text(message):
         
         channel_id = selected_channel['channel_id']
         
-        # Проверяем, прикреплен ли уже шаблон к этому каналу
-        current_template = db.get_channel_template(channel_id)
-        
-        if current_template and current_template['id'] == template_id:
+        # Прикреплен ли уже этот шаблон к каналу
+        if selected_channel['template_id'] == template_id:
             # Открепляем
             db.unassign_template_from_channel(channel_id)
             bot.send_message(
@@ -1829,12 +1886,10 @@ def handle_text(message):
             )
         
         # Обновляем список каналов
-        assigned_channel_id = None
-        for ch in channels:
-            ch_template = db.get_channel_template(ch['channel_id'])
-            if ch_template and ch_template['id'] == template_id:
-                assigned_channel_id = ch['channel_id']
-                break
+        channels = db.get_channels_with_templates()
+        assigned_channel_id = next(
+            (ch['channel_id'] for ch in channels if ch['template_id'] == template_id), None
+        )
         
         markup = kb.channels_for_template_reply(channels, assigned_channel_id)
         bot.send_message(
@@ -1876,12 +1931,12 @@ def handle_text(message):
         # Если канал один - автоматически выбрать
         if len(channels) == 1:
             state['channel_id'] = channels[0]['channel_id']
-            state['state'] = 'waiting_video'
+            start_upload_session(state)
             bot.reply_to(
                 message,
                 f"✅ Информация принята!\n"
                 f"📺 Канал: *{channels[0]['channel_name']}*\n\n"
-                "Теперь отправьте видео или документ.",
+                f"{upload_prompt(data)}",
                 parse_mode="Markdown"
             )
         else:
@@ -1908,13 +1963,70 @@ def handle_video(message):
     if not is_admin(user_id):
         return
 
+    # Файлы одного админа обрабатывает один поток по очереди (workers.py):
+    # каждый получает следующую серию
+    publish_session_file(message, user_id)
+
+def start_one_shot_upload(message, user_id, state):
+    """Заполнить состояние из подписи к видео; False - публиковать нельзя (админу уже ответили)"""
+    data = parse_input(message.caption)
+    if not data:
+        bot.reply_to(
+            message,
+            "❗ Подпись не распознана. Для загрузки одним сообщением укажите в подписи:\n"
+            "`Название Сезон Серия`",
+            parse_mode="Markdown"
+        )
+        return False
+    if data['is_range']:
+        bot.reply_to(message, "❗ Диапазон серий загружается через «📤 Загрузить»")
+        return False
+    
+    # Канал: единственный доступный или запомненный при последней загрузке
+    channels = db.get_admin_channels(user_id) if not is_super_admin(user_id) else db.get_all_channels()
+    if len(channels) == 1:
+        channel_id = channels[0]['channel_id']
+    else:
+        admin = db.get_admin(user_id) or {}
+        channel_id = admin.get('default_channel_id')
+        if not any(ch['channel_id'] == channel_id for ch in channels):
+            bot.reply_to(
+                message,
+                "❗ Не знаю, в какой канал публиковать.\n"
+                "Загрузите серию через «📤 Загрузить» и выберите канал - он запомнится."
+            )
+            return False
+    
+    state['data'] = data
+    state['channel_id'] = channel_id
+    state['state'] = 'waiting_video'
+    state['one_shot'] = True
+    return True
+
+def publish_session_file(message, user_id):
+    """Опубликовать очередной файл сессии загрузки как следующую серию"""
     state = get_user_state(user_id)
     
+    # Без начатой загрузки: видео с подписью "Название Сезон Серия" публикуется сразу
+    if state.get('state') is None and message.caption:
+        if not start_one_shot_upload(message, user_id, state):
+            return
+    
     # Проверка состояния
     if state.get('state') not in ['waiting_video', 'selecting_channel']:
         bot.reply_to(message, "❗ Сначала начните процесс загрузки через меню")
         return
     
+    # Сессия закрывается, если файлов не было дольше UPLOAD_SESSION_TIMEOUT
+    if time.time() > state.get('session_expires', float('inf')):
+        clear_user_state(user_id)
+        bot.reply_to(
+            message,
+            "⌛ Сессия загрузки закрыта: файлов не было слишком долго.\n"
+            "Начните загрузку заново через меню."
+        )
+        return
+    
     # Если канал еще не выбран
     if not state.get('channel_id'):
         channels = db.get_admin_channels(user_id) if not is_super_admin(user_id) else db.get_all_channels()
@@ -1958,152 +2070,149 @@ def handle_video(message):
     #     clear_user_state(user_id)
     #     return
     
-    # Формирование подписи
-    # Проверяем, есть ли шаблон для этого канала
-    template = db.get_channel_template(channel_id)
+    # Номер серии этого файла: первая серия, затем по порядку
+    episode = captions.first_episode(data, state.get('next_episode'))
+    last_episode = data['episode_end'] if data.get('is_range') else None
+    episode_info = captions.episode_data(data, episode)
+    
+    if message.content_type == 'video':
+        item = ('video', message.video.file_id, episode_info)
+    else:
+        item = ('document', message.document.file_id, episode_info)
+    
+    # Публикуют воркеры очереди; админу сразу - номер задачи, итог придёт отдельно
+    batch_id = outbox.enqueue(user_id, message.chat.id, [channel_id], [item], episode_info)
+    if batch_id is None:
+        bot.reply_to(message, "❌ Не удалось поставить публикацию в очередь. Попробуйте ещё раз.")
+        clear_user_state(user_id)
+        return
     
+    queued = f"📥 Серия {episode} в очереди на публикацию (задача `{batch_id}`)."
+    if state.get('one_shot'):
+        clear_user_state(user_id)
+        bot.reply_to(message, queued, parse_mode="Markdown")
+        return
+    
+    next_episode = episode + 1
+    if last_episode is not None and next_episode > last_episode:
+        clear_user_state(user_id)
+        bot.reply_to(message, f"{queued}\n\n✅ Все серии диапазона получены.", parse_mode="Markdown")
+        return
+    
+    # Сессия продолжается: следующий файл - следующая серия
+    state['next_episode'] = next_episode
+    start_upload_session(state)
+    if last_episode is not None:
+        left = f"Осталось серий: {last_episode - next_episode + 1}. "
+    else:
+        left = ""
+    bot.reply_to(
+        message,
+        f"{queued}\n\n{left}Следующий файл - серия {next_episode}.\n"
+        "Закончить - «🏠 Главное меню».",
+        parse_mode="Markdown"
+    )
+
+
+def run_publish_job(job):
+    """Выполнить задачу очереди: опубликовать файлы в канал и записать статистику"""
+    channel_id = job['channel_id']
+    # Подпись по шаблону канала (компилируется один раз и кешируется)
+    template = db.get_channel_template(channel_id)
     if template:
-        # Используем шаблон
-        caption = template['template_text']
-        
-        # Заменяем переменные
-        caption = caption.replace('{title}', data['title'])
-        caption = caption.replace('{season}', str(data['season']))
-        
-        # Для серии - если диапазон, показываем диапазон
-        if data.get('is_range'):
-            episode_str = f"{data['episode_start']}-{data['episode_end']}"
-        else:
-            episode_str = str(data['episode'])
-        caption = caption.replace('{episode}', episode_str)
-        caption = caption.replace('{tag}', data['tag'])
-        
         logging.info(f"Using template '{template['name']}' for channel {channel_id}")
     else:
-        # Используем стандартный формат
-        if data.get('is_range'):
-            episode_text = f"📺 Серии {data['episode_start']}-{data['episode_end']}"
-        else:
-            episode_text = f"📺 Серия {data['episode']}"
-            
-        caption = (
-            f"🎬 {data['title']}\n\n"
-            f"📺 Сезон {data['season']}\n"
-            f"{episode_text}\n\n"
-            f"{data['tag']}\n\n"
-            "Наш канал: https://t.me/+XaaureBEZzMwNDk6\n"
-            "Наш чат: https://t.me/Anume2D"
-        )
         logging.info(f"Using default caption format for channel {channel_id}")
-
+    
+    message_ids = []
+    uploads = []
+    error = None
     try:
-        # Отправка в канал
-        sent = None
-        sent_file_id = None
-        if message.content_type == 'video':
-            sent_file_id = message.video.file_id
-            sent = bot.send_video(channel_id, sent_file_id, caption=caption)
-        else:
-            sent_file_id = message.document.file_id
-            sent = bot.send_document(channel_id, sent_file_id, caption=caption)
-        
-        # Получить id сообщения в канале (если доступно)
-        message_id = str(getattr(sent, 'message_id', None)) if sent else None
-
-        # Логирование в статистику
-        # Если диапазон - логируем среднюю серию или начальную
-        episode_for_log = data.get('episode') or data.get('episode_start', 0)
-        
-        db.log_upload(
-            user_id,
-            channel_id,
-            data['title'],
-            int(data['season']),
-            int(episode_for_log),
-            file_id=sent_file_id,
-            message_id=message_id
-        )
-        
-        channel = db.get_channel(channel_id)
-        
-        # Формируем строку для логирования
-        if data.get('is_range'):
-            episode_log = f"S{data['season']}E{data['episode_start']}-{data['episode_end']}"
-        else:
-            episode_log = f"S{data['season']}E{data['episode']}"
-            
-        logging.info(
-            f"Published | {data['title']} | {episode_log} | "
-            f"Channel: {channel['channel_name']} | Admin: {user_id} | msg_id={message_id}"
-        )
-        
-        bot.reply_to(
-            message,
-            f"🎉 Серия опубликована в канал *{channel['channel_name']}*!",
-            parse_mode="Markdown"
-        )
-        
+        for content_type, file_id, data in job['payload']['items']:
+            caption = captions.render_caption(channel_id, template, data)
+            
+            def send():
+                if content_type == 'video':
+                    return bot.send_video(channel_id, file_id, caption=caption)
+                return bot.send_document(channel_id, file_id, caption=caption)
+            
+            # 429 ждёт retry_after, ошибка соединения - повтор с задержкой; таймаут и 5xx не повторяются (пост мог выйти)
+            sent = retry.call_sync(channel_id, send)
+            
+            # Получить id сообщения в канале (если доступно)
+            message_id = str(getattr(sent, 'message_id', None)) if sent else None
+            message_ids.append(message_id)
+            uploads.append((job['admin_id'], channel_id, data['title'], int(data['season']),
+                            int(data['episode']), file_id, message_id))
+            logging.info(
+                f"Published | {data['title']} | S{data['season']}E{data['episode']} | "
+                f"Channel: {channel_id} | Admin: {job['admin_id']} | job={job['id']} | msg_id={message_id}"
+            )
     except Exception as e:
-        error_message = str(e)
         logging.error(f"Error publishing video: {e}")
-        
-        # Определяем тип ошибки и даем понятное объяснение
-        if "chat not found" in error_message.lower():
-            channel = db.get_channel(channel_id)
-            channel_name = channel['channel_name'] if channel else channel_id
-            
-            bot.reply_to(
-                message,
-                f"❌ *Ошибка публикации*\n\n"
-                f"Канал не найден: *{channel_name}*\n"
-                f"ID канала: `{channel_id}`\n\n"
-                f"*Возможные причины:*\n"
-                f"1️⃣ Бот не добавлен в канал\n"
-                f"2️⃣ ID канала указан неверно\n"
-                f"3️⃣ Канал был удален\n\n"
-                f"*Решение:*\n"
-                f"• Добавьте бота в канал как администратора\n"
-                f"• Дайте боту права на публикацию сообщений\n"
-                f"• Проверьте правильность ID канала",
-                parse_mode="Markdown"
-            )
-        elif "bot was kicked" in error_message.lower() or "forbidden" in error_message.lower():
-            channel = db.get_channel(channel_id)
-            channel_name = channel['channel_name'] if channel else channel_id
-            
-            bot.reply_to(
-                message,
-                f"❌ *Ошибка публикации*\n\n"
-                f"Бот заблокирован в канале: *{channel_name}*\n\n"
-                f"*Решение:*\n"
-                f"• Разблокируйте бота в канале\n"
-                f"• Добавьте бота обратно как администратора",
-                parse_mode="Markdown"
-            )
-        elif "not enough rights" in error_message.lower():
-            channel = db.get_channel(channel_id)
-            channel_name = channel['channel_name'] if channel else channel_id
-            
-            bot.reply_to(
-                message,
-                f"❌ *Ошибка публикации*\n\n"
-                f"Недостаточно прав в канале: *{channel_name}*\n\n"
-                f"*Решение:*\n"
-                f"• Дайте боту права администратора\n"
-                f"• Включите право 'Публикация сообщений'",
-                parse_mode="Markdown"
-            )
+        error = e
+    
+    # Статистика по всем опубликованным файлам задачи - одной транзакцией
+    db.log_uploads(uploads)
+    return message_ids, error
+
+
+def report_batch(jobs):
+    """Сообщить админу итог загрузки: успех или понятное описание ошибки"""
+    for job in jobs:
+        data = job['payload']['data']
+        channel = db.get_channel(job['channel_id'])
+        channel_name = channel['channel_name'] if channel else job['channel_id']
+        if job['status'] == 'done':
+            text = f"🎉 Серия {data['episode']} опубликована в канал *{channel_name}*!"
         else:
-            # Общая ошибка
-            bot.reply_to(
-                message, 
-                f"❌ *Ошибка при публикации*\n\n"
-                f"Детали: `{error_message}`\n\n"
-                f"Обратитесь к администратору.",
-                parse_mode="Markdown"
+            text = f"Серия {data['episode']}, задача `{job['batch_id']}`\n\n" + publish_error_message(
+                job['error'] or "", job['channel_id'], channel_name
             )
-    
-    clear_user_state(user_id)
+        try:
+            bot.send_message(job['chat_id'], text, parse_mode="Markdown")
+        except Exception as e:
+            logging.error(f"Error reporting job {job['id']}: {e}")
+
+
+def publish_error_message(error_message, channel_id, channel_name):
+    """Определяем тип ошибки публикации и даем понятное объяснение"""
+    if "chat not found" in error_message.lower():
+        return (
+            f"❌ *Ошибка публикации*\n\n"
+            f"Канал не найден: *{channel_name}*\n"
+            f"ID канала: `{channel_id}`\n\n"
+            f"*Возможные причины:*\n"
+            f"1️⃣ Бот не добавлен в канал\n"
+            f"2️⃣ ID канала указан неверно\n"
+            f"3️⃣ Канал был удален\n\n"
+            f"*Решение:*\n"
+            f"• Добавьте бота в канал как администратора\n"
+            f"• Дайте боту права на публикацию сообщений\n"
+            f"• Проверьте правильность ID канала"
+        )
+    if "bot was kicked" in error_message.lower() or "forbidden" in error_message.lower():
+        return (
+            f"❌ *Ошибка публикации*\n\n"
+            f"Бот заблокирован в канале: *{channel_name}*\n\n"
+            f"*Решение:*\n"
+            f"• Разблокируйте бота в канале\n"
+            f"• Добавьте бота обратно как администратора"
+        )
+    if "not enough rights" in error_message.lower():
+        return (
+            f"❌ *Ошибка публикации*\n\n"
+            f"Недостаточно прав в канале: *{channel_name}*\n\n"
+            f"*Решение:*\n"
+            f"• Дайте боту права администратора\n"
+            f"• Включите право 'Публикация сообщений'"
+        )
+    # Общая ошибка
+    return (
+        f"❌ *Ошибка при публикации*\n\n"
+        f"Детали: `{error_message}`\n\n"
+        f"Обратитесь к администратору."
+    )
 
 
 # ========== TEXT COMMANDS (admin utilities) ==========
@@ -2195,6 +2304,19 @@ def cmd_stats(message):
     bot.reply_to(message, text, parse_mode="Markdown")
 
 
+@bot.message_handler(commands=['rebuild_stats'])
+def cmd_rebuild_stats(message):
+    user_id = message.from_user.id
+    if not is_super_admin(user_id):
+        bot.reply_to(message, "⛔ Только для супер-админа")
+        return
+
+    if db.rebuild_stats():
+        bot.reply_to(message, "✅ Статистика пересчитана из истории загрузок")
+    else:
+        bot.reply_to(message, "❌ Ошибка при пересчёте статистики")
+
+
 @bot.message_handler(commands=['my_channels'])
 def cmd_my_channels(message):
     user_id = message.from_user.id
@@ -2236,6 +2358,12 @@ if __name__ == '__main__':
     print("🤖 Бот запускается...")
     logging.info("Bot starting...")
     
+    if sessions.SESSION_SNAPSHOT:
+        user_sessions.restore(db.load_user_sessions())
+    
+    # Очередь публикаций: воркеры и незавершённые задачи с прошлого запуска
+    outbox.start_outbox(run_publish_job, report_batch)
+    
     retry_count = 0
     max_retries = 5
     
@@ -2279,3 +2407,16 @@ if __name__ == '__main__':
             time.sleep(10)
             print("🔄 Попытка перезапуска...")
             retry_count = 0  # Сбрасываем счетчик для критических ошибок
+    
+    bot.worker_pool.close()
+    logging.info(f"Update workers: {bot.worker_pool.get_stats()}")
+    if sessions.SESSION_SNAPSHOT:
+        db.save_user_sessions(user_sessions.snapshot())
+    logging.info(f"User sessions: {user_sessions.get_stats()}")
+    outbox.stop_outbox()
+    logging.info(f"Outbox stats: {outbox.get_outbox_stats()} | jobs: {db.get_outbox_stats()}")
+    logging.info(f"Send retries by channel: {retry.get_retry_stats()}")
+    logging.info(f"Outbound rate limiter: {ratelimit.limiter.get_stats()}")
+    
+    # Закрываем постоянные соединения с БД
+    db.close_connections()
@@ -11,11 +11,16 @@ from aiogram import Bot, Dispatcher, Router, F
 from aiogram.filters import Command, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
 from dotenv import load_dotenv
 
 import database_async as db
+import ratelimit
+import storage_async
+from common_async import is_super_admin
+from middlewares import (
+    AdminAuthMiddleware, AdminContext, RateLimitRequestMiddleware, UpdateConcurrencyMiddleware, user_locks
+)
 from utils import parse_title_input, generate_tag, parse_channel_id
 
 # Загрузка переменных окружения
@@ -30,6 +35,9 @@ SUPER_ADMIN_IDS = [int(x.strip()) for x in raw_super_admins.split(",") if x.stri
 
 MAX_FILE_SIZE_MB = int(os.getenv("MAX_FILE_SIZE_MB", 100))
 
+# Сколько апдейтов обрабатывается одновременно (остальные ждут в очереди)
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", 50))
+
 # Настройка логирования
 logging.basicConfig(
     level=logging.INFO,
@@ -42,7 +50,10 @@ logging.basicConfig(
 
 # Инициализация бота и диспетчера
 bot = Bot(token=BOT_TOKEN)
-storage = MemoryStorage()
+# Все запросы бота - через общий лимитер (ответы админам - вперёд публикаций)
+bot.session.middleware(RateLimitRequestMiddleware(ratelimit.limiter))
+# Состояния FSM - в БД (перезапуск не обрывает начатые диалоги) или в памяти с лимитами
+storage = storage_async.create_storage()
 dp = Dispatcher(storage=storage)
 router = Router()
 
@@ -86,18 +97,6 @@ class TemplateStates(StatesGroup):
 
 # ================== HELPER FUNCTIONS ==================
 
-def is_super_admin(user_id: int) -> bool:
-    """Проверка супер-админа"""
-    return user_id in SUPER_ADMIN_IDS
-
-
-async def is_admin_check(user_id: int) -> bool:
-    """Проверка админа (async)"""
-    if is_super_admin(user_id):
-        return True
-    return await db.is_admin(user_id)
-
-
 def escape_markdown(text: str) -> str:
     """Экранирование специальных символов для Markdown"""
     special_chars = ['_', '*', '[', ']', '(', ')', '~', '`', '>', '#', '+', '-', '=', '|', '{', '}', '.', '!']
@@ -183,32 +182,31 @@ def back_and_home_keyboard() -> ReplyKeyboardMarkup:
     )
 
 
+async def leave_state(state: FSMContext, user_id: int):
+    """Сбросить состояние FSM и закрыть сессию загрузки, если она была (таймер, альбом)"""
+    # handlers_upload импортирует main_async, поэтому импорт здесь
+    from handlers_upload import end_session
+    end_session(user_id)
+    await state.clear()
+
+
 # ================== HANDLERS ==================
 
 @router.message(Command("start", "menu"))
-async def cmd_start(message: Message, state: FSMContext):
-    """Обработчик команды /start"""
+async def cmd_start(message: Message, state: FSMContext, admin: AdminContext):
+    """Обработчик команды /start (не-админам отвечает AdminAuthMiddleware)"""
     user_id = message.from_user.id
     logging.info(f"📱 /start from {user_id}")
     
-    # Проверка админа
-    if not await is_admin_check(user_id):
-        await message.answer(
-            "⛔ У тебя нет доступа к этому боту.\n"
-            "Свяжись с главным админом."
-        )
-        return
-    
-    # Обновляем username
+    # Обновляем username (в БД пишется только при изменении, пачкой в фоне)
     username = message.from_user.username or message.from_user.full_name
-    await db.add_admin(user_id, username=username)
+    await db.touch_admin_profile(user_id, username=username, name=message.from_user.full_name)
     
     # Очищаем состояние
-    await state.clear()
+    await leave_state(state, user_id)
     
     # Отправляем главное меню
-    is_super = is_super_admin(user_id)
-    keyboard = main_menu_keyboard(is_super)
+    keyboard = main_menu_keyboard(admin.is_super)
     
     await message.answer(
         "🎬 *Бот загрузки аниме*\n\n"
@@ -219,17 +217,11 @@ async def cmd_start(message: Message, state: FSMContext):
 
 
 @router.message(F.text.in_(["🔙 НАЗАД"]))
-async def btn_back(message: Message, state: FSMContext):
+async def btn_back(message: Message, state: FSMContext, admin: AdminContext):
     """Кнопка назад"""
-    user_id = message.from_user.id
-    
-    if not await is_admin_check(user_id):
-        return
-    
-    await state.clear()
+    await leave_state(state, message.from_user.id)
     
-    is_super = is_super_admin(user_id)
-    keyboard = main_menu_keyboard(is_super)
+    keyboard = main_menu_keyboard(admin.is_super)
     
     await message.answer(
         "🔙 Возврат назад",
@@ -238,17 +230,11 @@ async def btn_back(message: Message, state: FSMContext):
 
 
 @router.message(F.text.in_(["🏠 Главное меню", "🔙 Главное меню"]))
-async def btn_home(message: Message, state: FSMContext):
+async def btn_home(message: Message, state: FSMContext, admin: AdminContext):
     """Кнопка в главное меню"""
-    user_id = message.from_user.id
-    
-    if not await is_admin_check(user_id):
-        return
-    
-    await state.clear()
+    await leave_state(state, message.from_user.id)
     
-    is_super = is_super_admin(user_id)
-    keyboard = main_menu_keyboard(is_super)
+    keyboard = main_menu_keyboard(admin.is_super)
     
     await message.answer(
         "🎬 *Бот загрузки аниме*\n\n"
@@ -259,11 +245,9 @@ async def btn_home(message: Message, state: FSMContext):
 
 
 @router.message(F.text == "📊 Статистика")
-async def btn_statistics(message: Message):
+async def btn_statistics(message: Message, admin: AdminContext):
     """Показать статистику (только супер-админ)"""
-    user_id = message.from_user.id
-    
-    if not is_super_admin(user_id):
+    if not admin.is_super:
         await message.answer("⛔ Только для супер-админа")
         return
     
@@ -282,15 +266,23 @@ async def btn_statistics(message: Message):
     await message.answer(response, parse_mode="Markdown")
 
 
+@router.message(Command("rebuild_stats"))
+async def cmd_rebuild_stats(message: Message, admin: AdminContext):
+    """Пересчитать агрегаты статистики из истории загрузок (только супер-админ)"""
+    if not admin.is_super:
+        await message.answer("⛔ Только для супер-админа")
+        return
+    
+    if await db.rebuild_stats():
+        await message.answer("✅ Статистика пересчитана из истории загрузок")
+    else:
+        await message.answer("❌ Ошибка при пересчёте статистики")
+
+
 @router.message(F.text == "📊 Моя статистика")
 async def btn_my_statistics(message: Message):
     """Показать мою статистику"""
-    user_id = message.from_user.id
-    
-    if not await is_admin_check(user_id):
-        return
-    
-    stats = await db.get_admin_stats(user_id)
+    stats = await db.get_admin_stats(message.from_user.id)
     response = f"📊 *Моя статистика*\n\n"
     response += f"Всего загрузок: *{stats['total']}*\n\n"
     
@@ -303,14 +295,9 @@ async def btn_my_statistics(message: Message):
 
 
 @router.message(F.text == "📺 Мои каналы")
-async def btn_my_channels(message: Message):
+async def btn_my_channels(message: Message, admin: AdminContext):
     """Показать мои каналы"""
-    user_id = message.from_user.id
-    
-    if not await is_admin_check(user_id):
-        return
-    
-    channels = await db.get_admin_channels(user_id)
+    channels = admin.channels
     response = "📺 *Мои каналы*\n\n"
     
     if not channels:
@@ -337,6 +324,14 @@ async def main():
             await db.add_admin(admin_id, username="Super Admin")
             logging.info(f"SUPER_ADMIN {admin_id} added to database")
     
+    # Проверка доступа один раз на апдейт, до фильтров роутеров
+    # Апдейты одного пользователя - по очереди, всего одновременно не больше UPDATE_CONCURRENCY
+    concurrency_middleware = UpdateConcurrencyMiddleware(UPDATE_CONCURRENCY, user_locks)
+    dp.update.outer_middleware(concurrency_middleware)
+    
+    auth_middleware = AdminAuthMiddleware()
+    dp.update.outer_middleware(auth_middleware)
+    
     # Импортируем и регистрируем все роутеры
     from handlers_upload import router as upload_router
     from handlers_channels import router as channels_router
@@ -350,6 +345,12 @@ async def main():
     dp.include_router(admins_router)  # Управление админами
     dp.include_router(templates_router)  # Управление шаблонами
     
+    # Очередь публикаций: воркеры и незавершённые задачи с прошлого запуска
+    import outbox_async
+    import retry
+    from handlers_upload import run_publish_job, report_batch
+    await outbox_async.start_outbox(run_publish_job, report_batch)
+    
     # Запуск бота
     logging.info("🤖 Асинхронный бот запускается...")
     print("✅ Асинхронный бот запущен и готов к работе!")
@@ -361,9 +362,27 @@ async def main():
     print("  ✅ Управление шаблонами")
     
     try:
-        await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+        # WEBHOOK_URL задан - вебхук (aiohttp), иначе long polling
+        import webhook_async
+        if webhook_async.WEBHOOK_URL:
+            await webhook_async.run_webhook(dp, bot, allowed_updates=dp.resolve_used_update_types())
+        else:
+            # Иначе getUpdates вернёт 409, если остался вебхук прошлого запуска
+            await bot.delete_webhook()
+            await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
     finally:
+        await outbox_async.stop_outbox()
         await bot.session.close()
+        logging.info(f"Outbox stats: {outbox_async.get_outbox_stats()} | jobs: {await db.get_outbox_stats()}")
+        logging.info(f"Send retries by channel: {retry.get_retry_stats()}")
+        logging.info(f"Outbound rate limiter: {ratelimit.limiter.get_stats()}")
+        logging.info(f"DB pool stats: {db.get_pool_stats()}")
+        logging.info(f"DB cache stats: {db.get_cache_stats()}")
+        logging.info(f"Dropped non-admin updates: {auth_middleware.dropped}")
+        logging.info(f"Update concurrency: {concurrency_middleware.get_stats()}")
+        await storage.close()
+        logging.info(f"FSM storage: {storage.get_stats()}")
+        await db.close_db()
 
 
 if __name__ == "__main__":
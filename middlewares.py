@@ -0,0 +1,197 @@
+"""
+Middleware для асинхронного бота (aiogram 3.x)
+"""
+import asyncio
+import contextlib
+import logging
+from typing import Any, Awaitable, Callable, Dict, FrozenSet, Hashable, List, NamedTuple, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import Response, TelegramMethod
+from aiogram.types import TelegramObject, Update
+
+import database_async as db
+from common_async import is_super_admin
+from ratelimit import OutboundLimiter
+
+
+class AdminContext(NamedTuple):
+    """Кто прислал апдейт: запись админа, роль и доступные каналы"""
+    user_id: int
+    record: Optional[Dict]
+    role: str
+    is_super: bool
+    channels: List[Dict]
+    channel_ids: FrozenSet[str]
+
+    def can_post_to(self, channel_id: str) -> bool:
+        return channel_id in self.channel_ids
+
+
+async def resolve_admin(user_id: int) -> Optional[AdminContext]:
+    """Собрать AdminContext (None - не админ). Чтения идут через кеш database_async"""
+    is_super = is_super_admin(user_id)
+    record = await db.get_admin(user_id)
+    if record is None and not is_super:
+        return None
+
+    if is_super:
+        channels = await db.get_all_channels()
+        role = 'main'
+    else:
+        channels = await db.get_admin_channels(user_id)
+        role = record.get('role') or 'junior'
+
+    return AdminContext(
+        user_id=user_id,
+        record=record,
+        role=role,
+        is_super=is_super,
+        channels=channels,
+        channel_ids=frozenset(ch['channel_id'] for ch in channels),
+    )
+
+
+class AdminAuthMiddleware(BaseMiddleware):
+    """Внешний middleware апдейтов: проверяет доступ один раз на апдейт.
+
+    Апдейты не-админов отбрасываются до фильтров роутеров, а админам
+    в данные обработчика кладётся `admin: AdminContext`.
+    """
+
+    def __init__(self):
+        self.dropped = 0
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get('event_from_user')
+        admin = await resolve_admin(user.id) if user else None
+
+        if admin is None:
+            self.dropped += 1
+            await self._deny(event)
+            return None
+
+        data['admin'] = admin
+        return await handler(event, data)
+
+    @staticmethod
+    async def _deny(event: TelegramObject):
+        """Ответить на /start не-админа, остальное молча игнорировать"""
+        message = event.message if isinstance(event, Update) else None
+        if message is None or not message.text or not message.text.startswith(("/start", "/menu")):
+            return
+        logging.info(f"⛔ Access denied for {message.from_user.id}")
+        await message.answer(
+            "⛔ У тебя нет доступа к этому боту.\n"
+            "Свяжись с главным админом."
+        )
+
+
+class KeyedLocks:
+    """asyncio.Lock на ключ; замок удаляется, когда его никто не держит и не ждёт"""
+
+    def __init__(self):
+        self._locks: Dict[Hashable, List] = {}  # ключ -> [замок, сколько апдейтов держат/ждут]
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+    @contextlib.asynccontextmanager
+    async def hold(self, key: Hashable):
+        entry = self._locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+
+# Замки пользователей: их держит UpdateConcurrencyMiddleware на время апдейта,
+# и их же берут фоновые задачи, меняющие FSM пользователя (например, публикация альбома)
+user_locks = KeyedLocks()
+
+
+class UpdateConcurrencyMiddleware(BaseMiddleware):
+    """Внешний middleware апдейтов: по одному апдейту на пользователя, всего не больше max_in_flight.
+
+    Апдейты одного пользователя обрабатываются строго по очереди (FSM не
+    гоняется между обработчиками), разных пользователей - параллельно.
+    Ожидающие замок пользователя не занимают общий слот.
+    """
+
+    def __init__(self, max_in_flight: int, locks: Optional[KeyedLocks] = None):
+        self._locks = locks if locks is not None else KeyedLocks()
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+        self.max_in_flight = max_in_flight
+        self.waiting = 0
+        self.in_flight = 0
+        self.max_waiting = 0
+        self.processed = 0
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get('event_from_user')
+        # Апдейты без пользователя (посты каналов) друг друга не ждут
+        user_lock = self._locks.hold(user.id) if user else contextlib.nullcontext()
+        self.waiting += 1
+        self.max_waiting = max(self.max_waiting, self.waiting)
+        started = False
+        try:
+            async with user_lock, self._semaphore:
+                self.waiting -= 1
+                started = True
+                self.in_flight += 1
+                try:
+                    return await handler(event, data)
+                finally:
+                    self.in_flight -= 1
+                    self.processed += 1
+        finally:
+            # Отменён, не дождавшись очереди
+            if not started:
+                self.waiting -= 1
+
+    def get_stats(self) -> Dict[str, int]:
+        """Глубина очереди и обработка: ждут, выполняются, максимум ожидающих, обработано"""
+        return {
+            'waiting': self.waiting,
+            'in_flight': self.in_flight,
+            'max_waiting': self.max_waiting,
+            'processed': self.processed,
+            'users': len(self._locks),
+        }
+
+
+class RateLimitRequestMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: каждый исходящий запрос проходит общий лимитер.
+
+    Альбом (send_media_group) считается как столько сообщений, сколько в нём файлов;
+    у edit_message_media media - один файл, это одно сообщение.
+    """
+
+    def __init__(self, limiter: OutboundLimiter):
+        self.limiter = limiter
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType,
+        bot,
+        method: TelegramMethod,
+    ) -> Response:
+        media = getattr(method, 'media', None)
+        amount = (len(media) or 1) if isinstance(media, list) else 1
+        await self.limiter.acquire(method.__api_method__, getattr(method, 'chat_id', None), amount)
+        return await make_request(bot, method)
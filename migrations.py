@@ -0,0 +1,283 @@
+"""
+Версионированные миграции схемы БД
+Общие для database.py и database_async.py; текущая версия хранится в PRAGMA user_version
+"""
+from typing import List, NamedTuple, Tuple, Union
+
+
+class AddColumn(NamedTuple):
+    """Добавить колонку, если её ещё нет (для баз, созданных до миграций)"""
+    table: str
+    column: str
+    definition: str
+
+    @property
+    def sql(self) -> str:
+        return f"ALTER TABLE {self.table} ADD COLUMN {self.column} {self.definition}"
+
+
+Step = Union[str, AddColumn]
+
+
+# Таблицы, изменения которых отслеживаются в table_versions (их читает кеш запросов)
+VERSIONED_TABLES = ('admins', 'channels', 'admin_channels', 'templates', 'channel_templates')
+
+
+# Пересчёт агрегатов статистики из сырой истории upload_stats
+REBUILD_STATS: List[str] = [
+    "DELETE FROM stats_admin",
+    "DELETE FROM stats_channel",
+    "DELETE FROM stats_admin_channel",
+    "DELETE FROM stats_daily",
+    """
+    INSERT INTO stats_admin (admin_id, total, last_upload)
+    SELECT admin_id, COUNT(*), MAX(uploaded_at) FROM upload_stats GROUP BY admin_id
+    """,
+    """
+    INSERT INTO stats_channel (channel_id, total, last_upload)
+    SELECT channel_id, COUNT(*), MAX(uploaded_at) FROM upload_stats GROUP BY channel_id
+    """,
+    """
+    INSERT INTO stats_admin_channel (admin_id, channel_id, total)
+    SELECT admin_id, channel_id, COUNT(*) FROM upload_stats GROUP BY admin_id, channel_id
+    """,
+    """
+    INSERT INTO stats_daily (day, total)
+    SELECT date(uploaded_at), COUNT(*) FROM upload_stats GROUP BY date(uploaded_at)
+    """,
+]
+
+
+MIGRATIONS: List[Tuple[int, List[Step]]] = [
+    # 1: базовая схема
+    (1, [
+        """
+        CREATE TABLE IF NOT EXISTS admins (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            role TEXT NOT NULL DEFAULT 'junior',
+            name TEXT,
+            added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS channels (
+            channel_id TEXT PRIMARY KEY,
+            channel_name TEXT NOT NULL,
+            added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS templates (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE,
+            template_text TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        # Один канал - один шаблон
+        """
+        CREATE TABLE IF NOT EXISTS channel_templates (
+            channel_id TEXT PRIMARY KEY,
+            template_id INTEGER,
+            assigned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (channel_id) REFERENCES channels(channel_id) ON DELETE CASCADE,
+            FOREIGN KEY (template_id) REFERENCES templates(id) ON DELETE SET NULL
+        )
+        """,
+        # Админы и каналы (many-to-many)
+        """
+        CREATE TABLE IF NOT EXISTS admin_channels (
+            admin_id INTEGER,
+            channel_id TEXT,
+            assigned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (admin_id, channel_id),
+            FOREIGN KEY (admin_id) REFERENCES admins(user_id) ON DELETE CASCADE,
+            FOREIGN KEY (channel_id) REFERENCES channels(channel_id) ON DELETE CASCADE
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS upload_stats (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            admin_id INTEGER,
+            channel_id TEXT,
+            title TEXT,
+            season INTEGER,
+            episode INTEGER,
+            file_id TEXT,
+            message_id TEXT,
+            uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (admin_id) REFERENCES admins(user_id),
+            FOREIGN KEY (channel_id) REFERENCES channels(channel_id)
+        )
+        """,
+    ]),
+
+    # 2: колонки, которых не было в старых базах
+    (2, [
+        AddColumn("admins", "role", "TEXT NOT NULL DEFAULT 'junior'"),
+        AddColumn("admins", "name", "TEXT"),
+        AddColumn("upload_stats", "file_id", "TEXT"),
+        AddColumn("upload_stats", "message_id", "TEXT"),
+    ]),
+
+    # 3: индексы для статистики и поиска серий
+    (3, [
+        "CREATE INDEX IF NOT EXISTS idx_upload_stats_admin ON upload_stats (admin_id, uploaded_at)",
+        "CREATE INDEX IF NOT EXISTS idx_upload_stats_channel ON upload_stats (channel_id, uploaded_at)",
+        "CREATE INDEX IF NOT EXISTS idx_upload_stats_episode ON upload_stats (title, season, episode)",
+    ]),
+
+    # 4: агрегаты статистики, которые триггеры обновляют в той же транзакции, что и upload_stats
+    (4, [
+        """
+        CREATE TABLE IF NOT EXISTS stats_admin (
+            admin_id INTEGER PRIMARY KEY,
+            total INTEGER NOT NULL DEFAULT 0,
+            last_upload TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS stats_channel (
+            channel_id TEXT PRIMARY KEY,
+            total INTEGER NOT NULL DEFAULT 0,
+            last_upload TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS stats_admin_channel (
+            admin_id INTEGER,
+            channel_id TEXT,
+            total INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (admin_id, channel_id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS stats_daily (
+            day TEXT PRIMARY KEY,
+            total INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_upload_stats_insert AFTER INSERT ON upload_stats
+        BEGIN
+            INSERT OR IGNORE INTO stats_admin (admin_id) VALUES (NEW.admin_id);
+            UPDATE stats_admin
+            SET total = total + 1, last_upload = MAX(COALESCE(last_upload, NEW.uploaded_at), NEW.uploaded_at)
+            WHERE admin_id = NEW.admin_id;
+
+            INSERT OR IGNORE INTO stats_channel (channel_id) VALUES (NEW.channel_id);
+            UPDATE stats_channel
+            SET total = total + 1, last_upload = MAX(COALESCE(last_upload, NEW.uploaded_at), NEW.uploaded_at)
+            WHERE channel_id = NEW.channel_id;
+
+            INSERT OR IGNORE INTO stats_admin_channel (admin_id, channel_id) VALUES (NEW.admin_id, NEW.channel_id);
+            UPDATE stats_admin_channel SET total = total + 1
+            WHERE admin_id = NEW.admin_id AND channel_id = NEW.channel_id;
+
+            INSERT OR IGNORE INTO stats_daily (day) VALUES (date(NEW.uploaded_at));
+            UPDATE stats_daily SET total = total + 1 WHERE day = date(NEW.uploaded_at);
+        END
+        """,
+        # last_upload после удаления берём по индексам (admin_id, uploaded_at) / (channel_id, uploaded_at)
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_upload_stats_delete AFTER DELETE ON upload_stats
+        BEGIN
+            UPDATE stats_admin
+            SET total = total - 1,
+                last_upload = (SELECT MAX(uploaded_at) FROM upload_stats WHERE admin_id = OLD.admin_id)
+            WHERE admin_id = OLD.admin_id;
+
+            UPDATE stats_channel
+            SET total = total - 1,
+                last_upload = (SELECT MAX(uploaded_at) FROM upload_stats WHERE channel_id = OLD.channel_id)
+            WHERE channel_id = OLD.channel_id;
+
+            UPDATE stats_admin_channel SET total = total - 1
+            WHERE admin_id = OLD.admin_id AND channel_id = OLD.channel_id;
+
+            UPDATE stats_daily SET total = total - 1 WHERE day = date(OLD.uploaded_at);
+        END
+        """,
+        *REBUILD_STATS,
+    ]),
+
+    # 5: счётчики версий таблиц для согласования кешей между процессами
+    (5, [
+        """
+        CREATE TABLE IF NOT EXISTS table_versions (
+            table_name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+        *[f"INSERT OR IGNORE INTO table_versions (table_name) VALUES ('{table}')" for table in VERSIONED_TABLES],
+        *[
+            f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_{op.lower()}_version AFTER {op} ON {table}
+            BEGIN
+                UPDATE table_versions SET version = version + 1 WHERE table_name = '{table}';
+            END
+            """
+            for table in VERSIONED_TABLES
+            for op in ('INSERT', 'UPDATE', 'DELETE')
+        ],
+    ]),
+
+    # 6: канал по умолчанию для загрузки одним сообщением (видео с подписью)
+    (6, [
+        AddColumn("admins", "default_channel_id", "TEXT"),
+    ]),
+
+    # 7: очередь публикаций (задача - файлы для одного канала; batch_id объединяет каналы одной загрузки)
+    (7, [
+        """
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            batch_id TEXT NOT NULL,
+            admin_id INTEGER NOT NULL,
+            chat_id INTEGER NOT NULL,
+            channel_id TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            message_ids TEXT,
+            error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_outbox_status ON outbox(status, id)",
+        "CREATE INDEX IF NOT EXISTS idx_outbox_batch ON outbox(batch_id)",
+    ]),
+
+    # 8: снимок сессий пользователей синхронного бота (sessions.py)
+    (8, [
+        """
+        CREATE TABLE IF NOT EXISTS user_sessions (
+            user_id INTEGER PRIMARY KEY,
+            payload TEXT NOT NULL,
+            touched_at REAL NOT NULL
+        )
+        """,
+    ]),
+
+    # 9: состояния FSM асинхронного бота (storage_async.py)
+    (9, [
+        """
+        CREATE TABLE IF NOT EXISTS fsm_states (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT NOT NULL,
+            updated_at REAL NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_fsm_states_updated ON fsm_states(updated_at)",
+    ]),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def pending(version: int) -> List[Tuple[int, List[Step]]]:
+    """Миграции, которые нужно применить к базе с указанной версией"""
+    return [(target, steps) for target, steps in MIGRATIONS if target > version]
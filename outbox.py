@@ -0,0 +1,158 @@
+"""
+Очередь публикаций для синхронного бота
+
+Задача - публикация файлов одной загрузки в один канал. Задачи сначала
+записываются в таблицу outbox, затем их разбирают потоки-воркеры; задачи
+одного канала всегда достаются одному воркеру, поэтому серии выходят по
+порядку, а потоки telebot не ждут Bot API. Запросы воркеров проходят общий
+лимитер (ratelimit.py) с низким приоритетом. Незавершённые задачи после
+перезапуска публикуются заново.
+"""
+import json
+import logging
+import os
+import queue
+import threading
+import uuid
+import zlib
+from typing import Callable, Dict, List, Optional, Tuple
+
+import database as db
+import ratelimit
+
+# Сколько каналов публикуются одновременно (потоков-воркеров)
+PUBLISH_CONCURRENCY = int(os.getenv("PUBLISH_CONCURRENCY", "5"))
+
+# задача -> (message_id опубликованных, ошибка или None)
+JobRunner = Callable[[Dict], Tuple[List[str], Optional[Exception]]]
+# Все задачи загрузки завершены: отчитаться админу
+BatchReporter = Callable[[List[Dict]], None]
+
+_queues: List[queue.Queue] = []
+_workers: List[threading.Thread] = []
+_batch_left: Dict[str, int] = {}
+_batch_lock = threading.Lock()
+_run_job: Optional[JobRunner] = None
+_report_batch: Optional[BatchReporter] = None
+_processed = 0
+
+
+def load_job(row: Dict) -> Dict:
+    """Строка outbox с разобранными payload и message_ids"""
+    return dict(
+        row,
+        payload=json.loads(row['payload']),
+        message_ids=json.loads(row['message_ids']) if row.get('message_ids') else [],
+    )
+
+
+def start_outbox(run_job: JobRunner, report_batch: BatchReporter):
+    """Запустить воркеры и вернуть в очередь незавершённые задачи из БД"""
+    global _run_job, _report_batch
+    _run_job, _report_batch = run_job, report_batch
+    
+    _queues[:] = [queue.Queue() for _ in range(max(1, PUBLISH_CONCURRENCY))]
+    _workers[:] = [
+        threading.Thread(target=_worker, args=(q,), name=f"outbox-{i}", daemon=True)
+        for i, q in enumerate(_queues)
+    ]
+    for thread in _workers:
+        thread.start()
+    
+    jobs = db.get_pending_jobs()
+    _dispatch(jobs)
+    if jobs:
+        logging.info(f"Outbox: resumed {len(jobs)} unfinished jobs")
+
+
+def stop_outbox(drain: bool = False):
+    """Остановить воркеры; незавершённые задачи остаются в БД до следующего запуска"""
+    if drain:
+        wait_idle()
+    for q in _queues:
+        q.put(None)
+    for thread in _workers:
+        thread.join()
+    _workers.clear()
+    _queues.clear()
+    with _batch_lock:
+        _batch_left.clear()
+
+
+def wait_idle():
+    """Дождаться, пока воркеры разберут все поставленные задачи"""
+    for q in _queues:
+        q.join()
+
+
+def enqueue(admin_id: int, chat_id: int, channel_ids: List[str], items: list, data: Dict) -> Optional[str]:
+    """Поставить публикацию в очередь (задача на каждый канал); вернуть номер загрузки"""
+    batch_id = uuid.uuid4().hex[:8]
+    payload = json.dumps({'items': items, 'data': data}, ensure_ascii=False)
+    if not db.enqueue_jobs([(batch_id, admin_id, chat_id, channel_id, payload) for channel_id in channel_ids]):
+        return None
+    _dispatch(db.get_batch_jobs(batch_id))
+    return batch_id
+
+
+def _dispatch(rows: List[Dict]):
+    if not _queues:
+        # Воркеры ещё не запущены: задачи уже в БД (pending), start_outbox() их подхватит
+        return
+    with _batch_lock:
+        for row in rows:
+            _batch_left[row['batch_id']] = _batch_left.get(row['batch_id'], 0) + 1
+    for row in rows:
+        # Канал всегда у одного воркера - порядок публикаций в канале сохраняется
+        worker = zlib.crc32(row['channel_id'].encode()) % len(_queues)
+        _queues[worker].put(load_job(row))
+
+
+def _worker(q: queue.Queue):
+    # Запросы воркера - массовые: ответы админам идут вперёд них (ratelimit.py)
+    ratelimit.mark_bulk()
+    while True:
+        job = q.get()
+        try:
+            if job is None:
+                return
+            _process(job)
+        except Exception as e:
+            logging.error(f"Outbox job {job['id']} failed to complete: {e}")
+        finally:
+            q.task_done()
+
+
+def _process(job: Dict):
+    global _processed
+    db.start_job(job['id'])
+    
+    try:
+        message_ids, error = _run_job(job)
+    except Exception as e:
+        message_ids, error = [], e
+    db.finish_job(
+        job['id'], 'failed' if error else 'done',
+        json.dumps(message_ids), str(error) if error else None
+    )
+    
+    batch_id = job['batch_id']
+    with _batch_lock:
+        _processed += 1
+        _batch_left[batch_id] -= 1
+        done = _batch_left[batch_id] == 0
+        if done:
+            del _batch_left[batch_id]
+    if done:
+        _report_batch([load_job(row) for row in db.get_batch_jobs(batch_id)])
+
+
+def get_outbox_stats() -> Dict:
+    """Длина очередей воркеров, незавершённые загрузки и выполненные задачи"""
+    with _batch_lock:
+        batches = len(_batch_left)
+    return {
+        'queued': [q.qsize() for q in _queues],
+        'batches': batches,
+        'processed': _processed,
+    }
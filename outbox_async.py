@@ -0,0 +1,138 @@
+"""
+Очередь публикаций для асинхронного бота
+
+Задача - публикация файлов одной загрузки в один канал. Задачи сначала
+записываются в таблицу outbox, затем их разбирают воркеры; задачи одного
+канала всегда достаются одному воркеру, поэтому серии выходят по порядку.
+Запросы воркеров проходят общий лимитер (ratelimit.py) с низким приоритетом.
+Незавершённые задачи после перезапуска публикуются заново.
+"""
+import asyncio
+import json
+import logging
+import os
+import uuid
+import zlib
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import database_async as db
+import ratelimit
+
+# Сколько каналов публикуются одновременно (воркеров очереди)
+PUBLISH_CONCURRENCY = int(os.getenv("PUBLISH_CONCURRENCY", 5))
+
+# задача -> (message_id опубликованных, ошибка или None)
+JobRunner = Callable[[Dict], Awaitable[Tuple[List[str], Optional[Exception]]]]
+# Все задачи загрузки завершены: отчитаться админу
+BatchReporter = Callable[[List[Dict]], Awaitable[None]]
+
+_queues: List[asyncio.Queue] = []
+_workers: List[asyncio.Task] = []
+_batch_left: Dict[str, int] = {}
+_run_job: Optional[JobRunner] = None
+_report_batch: Optional[BatchReporter] = None
+_processed = 0
+
+
+def load_job(row: Dict) -> Dict:
+    """Строка outbox с разобранными payload и message_ids"""
+    return dict(
+        row,
+        payload=json.loads(row['payload']),
+        message_ids=json.loads(row['message_ids']) if row.get('message_ids') else [],
+    )
+
+
+async def start_outbox(run_job: JobRunner, report_batch: BatchReporter):
+    """Запустить воркеры и вернуть в очередь незавершённые задачи из БД"""
+    global _run_job, _report_batch
+    _run_job, _report_batch = run_job, report_batch
+    
+    _queues[:] = [asyncio.Queue() for _ in range(max(1, PUBLISH_CONCURRENCY))]
+    _workers[:] = [asyncio.create_task(_worker(queue)) for queue in _queues]
+    
+    jobs = await db.get_pending_jobs()
+    _dispatch(jobs)
+    if jobs:
+        logging.info(f"Outbox: resumed {len(jobs)} unfinished jobs")
+
+
+async def stop_outbox(drain: bool = False):
+    """Остановить воркеры; незавершённые задачи остаются в БД до следующего запуска"""
+    if drain:
+        await wait_idle()
+    for task in _workers:
+        task.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
+    _queues.clear()
+    _batch_left.clear()
+
+
+async def wait_idle():
+    """Дождаться, пока воркеры разберут все поставленные задачи"""
+    await asyncio.gather(*(queue.join() for queue in _queues))
+
+
+async def enqueue(admin_id: int, chat_id: int, channel_ids: List[str], items: list, data: Dict) -> Optional[str]:
+    """Поставить публикацию в очередь (задача на каждый канал); вернуть номер загрузки"""
+    batch_id = uuid.uuid4().hex[:8]
+    payload = json.dumps({'items': items, 'data': data}, ensure_ascii=False)
+    if not await db.enqueue_jobs([(batch_id, admin_id, chat_id, channel_id, payload) for channel_id in channel_ids]):
+        return None
+    _dispatch(await db.get_batch_jobs(batch_id))
+    return batch_id
+
+
+def _dispatch(rows: List[Dict]):
+    if not _queues:
+        # Воркеры ещё не запущены: задачи уже в БД (pending), start_outbox() их подхватит
+        return
+    for row in rows:
+        _batch_left[row['batch_id']] = _batch_left.get(row['batch_id'], 0) + 1
+        # Канал всегда у одного воркера - порядок публикаций в канале сохраняется
+        worker = zlib.crc32(row['channel_id'].encode()) % len(_queues)
+        _queues[worker].put_nowait(load_job(row))
+
+
+async def _worker(queue: asyncio.Queue):
+    # Запросы воркера - массовые: ответы админам идут вперёд них (ratelimit.py)
+    ratelimit.mark_bulk()
+    while True:
+        job = await queue.get()
+        try:
+            await _process(job)
+        except Exception as e:
+            logging.error(f"Outbox job {job['id']} failed to complete: {e}")
+        finally:
+            queue.task_done()
+
+
+async def _process(job: Dict):
+    global _processed
+    await db.start_job(job['id'])
+    
+    try:
+        message_ids, error = await _run_job(job)
+    except Exception as e:
+        message_ids, error = [], e
+    await db.finish_job(
+        job['id'], 'failed' if error else 'done',
+        json.dumps(message_ids), str(error) if error else None
+    )
+    _processed += 1
+    
+    batch_id = job['batch_id']
+    _batch_left[batch_id] -= 1
+    if _batch_left[batch_id] == 0:
+        del _batch_left[batch_id]
+        await _report_batch([load_job(row) for row in await db.get_batch_jobs(batch_id)])
+
+
+def get_outbox_stats() -> Dict:
+    """Длина очередей воркеров, незавершённые загрузки и выполненные задачи"""
+    return {
+        'queued': [queue.qsize() for queue in _queues],
+        'batches': len(_batch_left),
+        'processed': _processed,
+    }
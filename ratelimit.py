@@ -0,0 +1,208 @@
+"""
+Ограничение частоты запросов к Bot API (общее для синхронной и асинхронной версий)
+
+Каждый исходящий запрос-сообщение (send*, copy*, forward*, edit*) берёт
+токены из ведра своего чата и общего ведра бота - лимиты Telegram:
+~30 сообщений в секунду всего, ~20 в минуту в группу/канал, ~1 в секунду
+в личный чат. Интерактивные ответы в личку (меню, правка сообщений) ведро
+личного чата не проходят, иначе быстрые нажатия кнопок ждали бы. Массовые публикации (воркеры очереди) оставляют в общем ведре
+запас для ответов админам, поэтому меню отвечает без ожидания рассылки.
+"""
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from collections import Counter
+from typing import Dict, Optional, Union
+
+RATE_GLOBAL_PER_SEC = float(os.getenv("RATE_GLOBAL_PER_SEC", "30"))
+RATE_GROUP_PER_MIN = float(os.getenv("RATE_GROUP_PER_MIN", "20"))
+RATE_PRIVATE_PER_SEC = float(os.getenv("RATE_PRIVATE_PER_SEC", "1"))
+# Сколько токенов общего ведра массовые запросы оставляют интерактивным
+RATE_INTERACTIVE_RESERVE = float(os.getenv("RATE_INTERACTIVE_RESERVE", "5"))
+# Сколько ведер чатов держать, прежде чем удалить простаивающие (полные)
+RATE_MAX_CHATS = int(os.getenv("RATE_MAX_CHATS", "1000"))
+
+# Запросы, которые Telegram считает сообщениями (остальные не ограничиваются)
+LIMITED_METHOD_PREFIXES = ('send', 'copy', 'forward', 'edit')
+
+# Контекст (поток или asyncio-задача) массовой публикации; выставляют воркеры очереди
+_bulk = contextvars.ContextVar('bulk', default=False)
+
+
+def mark_bulk():
+    """Пометить текущий поток/задачу как массовую публикацию (низкий приоритет)"""
+    _bulk.set(True)
+
+
+def is_bulk() -> bool:
+    return _bulk.get()
+
+
+def is_private_chat(chat_id: Union[int, str]) -> bool:
+    """Личный чат - положительный id; группы и каналы - отрицательный id или @username"""
+    key = str(chat_id)
+    return key.lstrip('-').isdigit() and int(key) > 0
+
+
+class TokenBucket:
+    """Ведро токенов: пополняется на rate токенов в секунду, вмещает capacity.
+
+    Токены берутся в долг: reserve() сразу списывает их и возвращает, сколько
+    секунд подождать, - так очередность ожидающих сохраняется без отдельной
+    очереди. Потокобезопасно; в asyncio ожидание не блокирует цикл событий.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount: float = 1) -> float:
+        """Списать токены; вернуть задержку в секундах до их появления"""
+        with self._lock:
+            self._refill()
+            # Запрос больше ведра всё равно должен когда-нибудь пройти
+            self._tokens -= min(amount, self.capacity)
+            return max(0.0, -self._tokens / self.rate)
+
+    def try_take(self, amount: float, headroom: float) -> float:
+        """Взять токены, только если после этого в ведре останется headroom.
+
+        Возвращает 0, если взяли, иначе - через сколько секунд попробовать снова.
+        """
+        with self._lock:
+            self._refill()
+            amount = min(amount, max(1.0, self.capacity - headroom))
+            missing = amount + headroom - self._tokens
+            if missing <= 0:
+                self._tokens -= amount
+                return 0.0
+            return missing / self.rate
+
+    def is_full(self) -> bool:
+        """Ведро полное - оно ничем не отличается от нового и его можно удалить"""
+        with self._lock:
+            self._refill()
+            return self._tokens >= self.capacity
+
+    async def acquire(self, amount: float = 1):
+        delay = self.reserve(amount)
+        if delay:
+            await asyncio.sleep(delay)
+
+    def acquire_sync(self, amount: float = 1):
+        delay = self.reserve(amount)
+        if delay:
+            time.sleep(delay)
+
+
+class OutboundLimiter:
+    """Лимитер исходящих сообщений бота: ведро на чат плюс общее ведро с приоритетом"""
+
+    def __init__(self, global_per_second: float = RATE_GLOBAL_PER_SEC,
+                 group_per_minute: float = RATE_GROUP_PER_MIN,
+                 private_per_second: float = RATE_PRIVATE_PER_SEC,
+                 interactive_reserve: float = RATE_INTERACTIVE_RESERVE,
+                 max_chats: int = RATE_MAX_CHATS):
+        self.global_bucket = TokenBucket(global_per_second, global_per_second)
+        self.group_per_minute = group_per_minute
+        self.private_per_second = private_per_second
+        self.interactive_reserve = min(interactive_reserve, global_per_second - 1)
+        self._chats: Dict[str, TokenBucket] = {}
+        self.max_chats = max_chats
+        self._prune_at = max_chats
+        self._lock = threading.Lock()
+        self._stats = Counter()
+
+    def chat_bucket(self, chat_id: Union[int, str]) -> TokenBucket:
+        key = str(chat_id)
+        with self._lock:
+            bucket = self._chats.get(key)
+            if bucket is None:
+                if is_private_chat(key):
+                    bucket = TokenBucket(self.private_per_second, max(1.0, self.private_per_second * 3))
+                else:
+                    bucket = TokenBucket(self.group_per_minute / 60, self.group_per_minute)
+                if len(self._chats) >= self._prune_at:
+                    self._prune()
+                self._chats[key] = bucket
+            return bucket
+
+    def _prune(self):
+        """Удалить ведра чатов, которые успели наполниться (вызывается под self._lock)"""
+        for key in [key for key, bucket in self._chats.items() if bucket.is_full()]:
+            del self._chats[key]
+            self._stats['pruned'] += 1
+        # Если все ведра заняты, следующая чистка - когда их станет вдвое больше
+        self._prune_at = max(self.max_chats, 2 * len(self._chats))
+
+    def _plan(self, method_name: str, chat_id, amount: float) -> Optional[float]:
+        """Задержка по ведру чата; None - запрос не ограничивается"""
+        if not method_name.startswith(LIMITED_METHOD_PREFIXES):
+            return None
+        bulk = is_bulk()
+        self._stats['bulk' if bulk else 'interactive'] += 1
+        if chat_id is None:
+            return 0.0
+        # Ответы и правка меню в личке идут в темпе нажатий админа - им хватает общего ведра,
+        # ведро личного чата (1 в секунду) держит только рассылки
+        if not bulk and is_private_chat(chat_id):
+            return 0.0
+        return self.chat_bucket(chat_id).reserve(amount)
+
+    def _count_wait(self, delay: float):
+        if delay:
+            self._stats['throttled_bulk' if is_bulk() else 'throttled_interactive'] += 1
+
+    async def acquire(self, method_name: str, chat_id=None, amount: float = 1):
+        """Дождаться права на запрос (asyncio)"""
+        delay = self._plan(method_name, chat_id, amount)
+        if delay is None:
+            return
+        self._count_wait(delay)
+        if delay:
+            await asyncio.sleep(delay)
+        if not is_bulk():
+            await self.global_bucket.acquire(amount)
+            return
+        # Массовые запросы ждут, пока в общем ведре не останется запас для интерактивных
+        while True:
+            delay = self.global_bucket.try_take(amount, self.interactive_reserve)
+            if not delay:
+                return
+            await asyncio.sleep(delay)
+
+    def acquire_sync(self, method_name: str, chat_id=None, amount: float = 1):
+        """Дождаться права на запрос (потоки telebot и воркеры очереди)"""
+        delay = self._plan(method_name, chat_id, amount)
+        if delay is None:
+            return
+        self._count_wait(delay)
+        if delay:
+            time.sleep(delay)
+        if not is_bulk():
+            self.global_bucket.acquire_sync(amount)
+            return
+        while True:
+            delay = self.global_bucket.try_take(amount, self.interactive_reserve)
+            if not delay:
+                return
+            time.sleep(delay)
+
+    def get_stats(self) -> Dict[str, int]:
+        """Запросы и ожидания по приоритетам, количество ведер чатов и удалённых простаивающих"""
+        with self._lock:
+            return dict(self._stats, chats=len(self._chats))
+
+
+# Один лимитер на процесс: через него идут все запросы бота
+limiter = OutboundLimiter()
@@ -0,0 +1,119 @@
+"""
+Повтор запросов к Bot API (общий для синхронной и асинхронной версий)
+
+429 ждёт ровно retry_after из ответа Telegram; 5xx и сетевые ошибки
+повторяются с экспоненциальной задержкой со случайным разбросом;
+остальные ошибки ("chat not found", "not enough rights"...) постоянные -
+повтор не поможет. Отправка сообщения не идемпотентна: после таймаута
+чтения или 5xx пост мог уже выйти, и повтор его продублирует. Поэтому
+такие запросы (idempotent=False, по умолчанию) повторяются только после
+429 и ошибок соединения, когда запрос до Telegram точно не дошёл. Исключения aiogram и pyTelegramBotAPI разбираются по
+атрибутам, поэтому модуль не зависит от библиотеки бота.
+"""
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+SEND_MAX_ATTEMPTS = max(1, int(os.getenv("SEND_MAX_ATTEMPTS", "5")))
+SEND_BACKOFF_BASE = float(os.getenv("SEND_BACKOFF_BASE", "1"))
+SEND_BACKOFF_MAX = float(os.getenv("SEND_BACKOFF_MAX", "60"))
+
+# Ошибки сети и сервера Telegram в aiogram (не наследуют OSError)
+_TRANSIENT_NAMES = {'TelegramNetworkError', 'TelegramServerError', 'RestartingTelegram'}
+# Ошибки установки соединения (aiohttp, requests/urllib3): запрос не отправлен
+_UNSENT_NAMES = {'ClientConnectorError', 'ClientProxyConnectionError', 'ConnectTimeout',
+                 'NewConnectionError', 'ConnectionRefusedError'}
+
+# Повторы по каналам: сколько раз пришлось повторить запрос
+_retries: Counter = Counter()
+_retries_lock = threading.Lock()
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """Сколько секунд просит подождать Telegram (429), иначе None"""
+    seconds = getattr(error, 'retry_after', None)  # aiogram TelegramRetryAfter
+    if seconds is None and getattr(error, 'error_code', None) == 429:  # telebot ApiTelegramException
+        seconds = ((getattr(error, 'result_json', None) or {}).get('parameters') or {}).get('retry_after', 1)
+    return float(seconds) if seconds is not None else None
+
+
+def is_transient(error: Exception) -> bool:
+    """5xx или сеть: повтор может помочь"""
+    code = getattr(error, 'error_code', None)
+    if isinstance(code, int) and code >= 500:
+        return True
+    if type(error).__name__ in _TRANSIENT_NAMES:
+        return True
+    # requests.RequestException наследует OSError
+    return isinstance(error, (OSError, asyncio.TimeoutError))
+
+
+def is_unsent(error: Exception) -> bool:
+    """Ошибка соединения до отправки: Telegram запрос не получил, повтор не создаст дубль"""
+    # aiogram заворачивает ошибку aiohttp в TelegramNetworkError("ClientConnectorError: ...")
+    if type(error).__name__ == 'TelegramNetworkError':
+        return str(getattr(error, 'message', '')).split(':', 1)[0] in _UNSENT_NAMES
+    # requests: ConnectTimeout или ConnectionError(MaxRetryError(reason=NewConnectionError))
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return any(cls.__name__ in _UNSENT_NAMES
+               for cause in (error, reason) for cls in type(cause).__mro__)
+
+
+def retry_delay(error: Exception, attempt: int, idempotent: bool = False) -> Optional[float]:
+    """Задержка перед повтором (attempt - номер неудачной попытки с 1); None - не повторять"""
+    if attempt >= SEND_MAX_ATTEMPTS:
+        return None
+    seconds = retry_after(error)
+    if seconds is not None:
+        return seconds
+    if is_transient(error) if idempotent else is_unsent(error):
+        backoff = min(SEND_BACKOFF_MAX, SEND_BACKOFF_BASE * 2 ** (attempt - 1))
+        return random.uniform(backoff / 2, backoff)
+    return None
+
+
+def _record_retry(chat_id, error: Exception, attempt: int, delay: float):
+    with _retries_lock:
+        _retries[str(chat_id)] += 1
+    logging.warning(f"Retry {attempt}/{SEND_MAX_ATTEMPTS - 1} for {chat_id} in {delay:.1f}s: {error}")
+
+
+async def call_async(chat_id, request: Callable[[], Awaitable[Any]], idempotent: bool = False) -> Any:
+    """Выполнить запрос, повторяя его после 429 и ошибок соединения (идемпотентный - и после 5xx/сети)"""
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            return await request()
+        except Exception as e:
+            delay = retry_delay(e, attempt, idempotent)
+            if delay is None:
+                raise
+            _record_retry(chat_id, e, attempt, delay)
+            await asyncio.sleep(delay)
+
+
+def call_sync(chat_id, request: Callable[[], Any], idempotent: bool = False) -> Any:
+    """Синхронный вариант call_async (потоки telebot и воркеры очереди)"""
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            return request()
+        except Exception as e:
+            delay = retry_delay(e, attempt, idempotent)
+            if delay is None:
+                raise
+            _record_retry(chat_id, e, attempt, delay)
+            time.sleep(delay)
+
+
+def get_retry_stats() -> Dict[str, int]:
+    """Количество повторов по каналам"""
+    with _retries_lock:
+        return dict(_retries)
@@ -0,0 +1,145 @@
+"""
+Состояния пользователей синхронного бота (меню, загрузка, выбранные каналы)
+
+Сессии хранятся в памяти с ограничениями: сессия, к которой не обращались
+SESSION_TTL секунд, удаляется, а при превышении SESSION_MAXSIZE вытесняется
+давно не использованная (LRU). При SESSION_SNAPSHOT=1 сессии сохраняются
+в БД при остановке и восстанавливаются при запуске.
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+SESSION_TTL = float(os.getenv("SESSION_TTL", "86400"))
+SESSION_MAXSIZE = int(os.getenv("SESSION_MAXSIZE", "10000"))
+SESSION_SNAPSHOT = os.getenv("SESSION_SNAPSHOT", "0") == "1"
+
+
+class UserSession:
+    """Состояние одного пользователя; доступ как к словарю: state['state'], state.get('data')"""
+
+    __slots__ = (
+        'state', 'data', 'channel_id', 'temp',
+        'session_expires', 'next_episode', 'one_shot',
+        'selected_admin_id', 'selected_admin_name',
+        'selected_template_id', 'selected_template_name',
+    )
+
+    def __init__(self):
+        self.state = None
+        self.data = {}
+        self.channel_id = None
+        self.temp = {}
+
+    def __getitem__(self, key: str):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __setitem__(self, key: str, value):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __delitem__(self, key: str):
+        try:
+            delattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.__slots__ and hasattr(self, key)
+
+    def get(self, key: str, default=None):
+        return getattr(self, key, default) if key in self.__slots__ else default
+
+    def pop(self, key: str, default=None):
+        value = self.get(key, default)
+        if key in self:
+            delattr(self, key)
+        return value
+
+    def to_dict(self) -> Dict:
+        return {key: getattr(self, key) for key in self.__slots__ if hasattr(self, key)}
+
+    @classmethod
+    def from_dict(cls, values: Dict) -> 'UserSession':
+        session = cls()
+        for key, value in values.items():
+            if key in cls.__slots__:
+                setattr(session, key, value)
+        return session
+
+
+class SessionStore:
+    """Сессии пользователей с TTL простоя и LRU-вытеснением.
+
+    Сессии упорядочены по последнему обращению, поэтому просроченные всегда
+    в начале: get() проверяет только их, а не весь словарь.
+    """
+
+    def __init__(self, ttl: float = SESSION_TTL, maxsize: int = SESSION_MAXSIZE):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.expired = 0
+        self.evicted = 0
+        self._sessions: 'OrderedDict[int, Tuple[UserSession, float]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int) -> UserSession:
+        """Сессия пользователя (новая, если её нет или она просрочена)"""
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            entry = self._sessions.pop(user_id, None)
+            session = entry[0] if entry is not None else UserSession()
+            self._sessions[user_id] = (session, now)
+            while self.maxsize and len(self._sessions) > self.maxsize:
+                self._sessions.popitem(last=False)
+                self.evicted += 1
+        return session
+
+    def clear(self, user_id: int):
+        with self._lock:
+            self._sessions.pop(user_id, None)
+
+    def _expire(self, now: float):
+        if not self.ttl:
+            return
+        while self._sessions:
+            user_id, (_, touched) = next(iter(self._sessions.items()))
+            if touched + self.ttl > now:
+                return
+            del self._sessions[user_id]
+            self.expired += 1
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def snapshot(self) -> List[Tuple[int, str, float]]:
+        """Непросроченные сессии для сохранения: (user_id, JSON, время обращения)"""
+        with self._lock:
+            self._expire(time.time())
+            return [
+                (user_id, json.dumps(session.to_dict(), ensure_ascii=False), touched)
+                for user_id, (session, touched) in self._sessions.items()
+            ]
+
+    def restore(self, rows: List[Tuple[int, str, float]]):
+        """Загрузить сессии из snapshot() (просроченные пропускаются)"""
+        with self._lock:
+            for user_id, payload, touched in sorted(rows, key=lambda row: row[2]):
+                self._sessions[user_id] = (UserSession.from_dict(json.loads(payload)), touched)
+                self._sessions.move_to_end(user_id)
+            self._expire(time.time())
+            while self.maxsize and len(self._sessions) > self.maxsize:
+                self._sessions.popitem(last=False)
+
+    def get_stats(self) -> Dict[str, int]:
+        """Сессий в памяти, удалено по TTL и вытеснено по размеру"""
+        with self._lock:
+            return {'sessions': len(self._sessions), 'expired': self.expired, 'evicted': self.evicted}
@@ -0,0 +1,280 @@
+"""
+Хранилище состояний FSM для асинхронного бота (aiogram)
+
+SQLiteStorage хранит состояния в таблице fsm_states базы бота, поэтому
+перезапуск не обрывает начатую загрузку, редактирование шаблона или выбор
+админа. Чтения идут из кеша в памяти, изменения копятся и записываются
+пачкой раз в FSM_FLUSH_INTERVAL секунд: несколько set_state/update_data
+одного обработчика дают одну запись. Состояния, не менявшиеся FSM_STATE_TTL
+секунд, считаются завершёнными и удаляются. В кеше не больше FSM_CACHE_SIZE
+записей: давно не использованные (уже записанные в БД) вытесняются.
+
+BoundedMemoryStorage - дешёвая замена MemoryStorage (FSM_STORAGE=memory):
+состояния живут только в памяти, но их число ограничено FSM_MAX_KEYS,
+диалоги без обращений дольше FSM_STATE_TTL удаляются, а данные хранятся
+компактной JSON-строкой вместо вложенных словарей.
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Set, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+import database_async as db
+
+FSM_FLUSH_INTERVAL = float(os.getenv("FSM_FLUSH_INTERVAL", "1"))
+FSM_STATE_TTL = float(os.getenv("FSM_STATE_TTL", "86400"))
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "10000"))
+# sqlite - SQLiteStorage, memory - BoundedMemoryStorage
+FSM_STORAGE = os.getenv("FSM_STORAGE", "sqlite")
+FSM_MAX_KEYS = int(os.getenv("FSM_MAX_KEYS", "10000"))
+
+
+def storage_key_id(key: StorageKey) -> str:
+    """Строковый ключ записи: bot:chat:user:thread:destiny"""
+    return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ''}:{key.destiny}"
+
+
+class _Record:
+    __slots__ = ('state', 'data', 'touched')
+
+    def __init__(self, state: Optional[str] = None, data: Optional[Dict[str, Any]] = None, touched: float = 0.0):
+        self.state = state
+        self.data = data if data is not None else {}
+        self.touched = touched
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM-хранилище в SQLite с кешем в памяти и отложенной пакетной записью"""
+
+    def __init__(self, ttl: float = FSM_STATE_TTL, flush_interval: float = FSM_FLUSH_INTERVAL,
+                 cache_size: int = FSM_CACHE_SIZE):
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.cache_size = cache_size
+        self.changes = 0
+        self.written = 0
+        self.flushes = 0
+        self.evicted = 0
+        # Упорядочены по последнему обращению: давно не использованные - в начале
+        self._records: 'OrderedDict[str, _Record]' = OrderedDict()
+        self._dirty: Set[str] = set()
+        # Изменения, которые сейчас записываются: вытеснять их нельзя, иначе чтение из БД их не увидит
+        self._writing: Set[str] = set()
+        self._task: Optional[asyncio.Task] = None
+
+    def _expired(self, record: _Record, now: float) -> bool:
+        return bool(self.ttl) and record.touched + self.ttl < now
+
+    async def _record(self, key: StorageKey) -> _Record:
+        key_id = storage_key_id(key)
+        record = self._records.get(key_id)
+        if record is None:
+            row = await db.get_fsm_record(key_id)
+            loaded = _Record()
+            if row is not None:
+                loaded = _Record(row['state'], json.loads(row['data']), row['updated_at'])
+            # Пока шло чтение, запись могла появиться из другого обработчика
+            record = self._records.setdefault(key_id, loaded)
+        self._records.move_to_end(key_id)
+        if record.touched and self._expired(record, time.time()):
+            record.state, record.data, record.touched = None, {}, 0.0
+        self._trim(keep=key_id)
+        return record
+
+    def _trim(self, keep: Optional[str] = None):
+        """Вытеснить давно не использованные записи сверх cache_size (несохранённые и keep остаются)"""
+        while self.cache_size and len(self._records) > self.cache_size:
+            for key_id in self._records:
+                if key_id not in self._dirty and key_id not in self._writing and key_id != keep:
+                    break
+            else:
+                return
+            del self._records[key_id]
+            self.evicted += 1
+
+    def _changed(self, key: StorageKey, record: _Record):
+        key_id = storage_key_id(key)
+        record.touched = time.time()
+        self._records.move_to_end(key_id)
+        self._dirty.add(key_id)
+        self.changes += 1
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_later())
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = await self._record(key)
+        record.state = state.state if isinstance(state, State) else state
+        self._changed(key, record)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._record(key)).state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        record = await self._record(key)
+        record.data = data.copy()
+        self._changed(key, record)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return (await self._record(key)).data.copy()
+
+    async def _flush_later(self):
+        # Окно накопления: все изменения за интервал уходят одной транзакцией
+        await asyncio.sleep(self.flush_interval)
+        self._task = None
+        await self.flush()
+
+    async def flush(self) -> int:
+        """Записать накопленные изменения и удалить просроченные состояния"""
+        if self._task is not None and self._task is not asyncio.current_task():
+            self._task.cancel()
+            self._task = None
+
+        now = time.time()
+        dirty, self._dirty = self._dirty, set()
+        saved, deleted = [], []
+        for key_id in dirty:
+            record = self._records.get(key_id)
+            if record is None or (record.state is None and not record.data):
+                deleted.append((key_id,))
+            else:
+                saved.append((key_id, record.state, json.dumps(record.data, ensure_ascii=False), record.touched))
+
+        expired_before = now - self.ttl if self.ttl else 0
+        self._writing = dirty
+        try:
+            ok = await db.save_fsm_records(saved, deleted, expired_before)
+        finally:
+            self._writing = set()
+        if not ok:
+            # Не записалось - попробуем со следующей пачкой
+            self._dirty |= dirty
+            return 0
+        self.flushes += 1
+        self.written += len(dirty)
+
+        # Кеш: пустые и просроченные записи больше не нужны
+        stale = [
+            key_id for key_id, record in self._records.items()
+            if key_id not in self._dirty
+            and ((record.state is None and not record.data) or self._expired(record, now))
+        ]
+        for key_id in stale:
+            del self._records[key_id]
+        self._trim()
+        return len(dirty)
+
+    async def close(self) -> None:
+        await self.flush()
+
+    def get_stats(self) -> Dict[str, int]:
+        """Записей в кеше, изменений и сколько из них реально записано в БД"""
+        return {
+            'cached': len(self._records),
+            'pending': len(self._dirty),
+            'changes': self.changes,
+            'written': self.written,
+            'flushes': self.flushes,
+            'evicted': self.evicted,
+        }
+
+
+class BoundedMemoryStorage(BaseStorage):
+    """FSM-хранилище в памяти с ограничением числа ключей, TTL простоя и LRU.
+
+    В отличие от MemoryStorage, пустые записи (state None, нет данных) не
+    хранятся вовсе, поэтому get_state() от случайных пользователей память не занимает.
+    """
+
+    def __init__(self, max_keys: int = FSM_MAX_KEYS, ttl: float = FSM_STATE_TTL):
+        self.max_keys = max_keys
+        self.ttl = ttl
+        self.expired = 0
+        self.evicted = 0
+        # key -> (state, data в JSON, время обращения); упорядочены по обращению
+        self._records: 'OrderedDict[str, Tuple[Optional[str], bytes, float]]' = OrderedDict()
+
+    @staticmethod
+    def _pack(data: Dict[str, Any]) -> bytes:
+        return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode() if data else b''
+
+    @staticmethod
+    def _unpack(payload: bytes) -> Dict[str, Any]:
+        return json.loads(payload) if payload else {}
+
+    def _expire(self, now: float):
+        if not self.ttl:
+            return
+        while self._records:
+            key_id, (_, _, touched) = next(iter(self._records.items()))
+            if touched + self.ttl > now:
+                return
+            del self._records[key_id]
+            self.expired += 1
+
+    def _get(self, key: StorageKey) -> Tuple[Optional[str], bytes]:
+        now = time.time()
+        self._expire(now)
+        key_id = storage_key_id(key)
+        record = self._records.get(key_id)
+        if record is None:
+            return None, b''
+        self._records[key_id] = (record[0], record[1], now)
+        self._records.move_to_end(key_id)
+        return record[0], record[1]
+
+    def _put(self, key: StorageKey, state: Optional[str], payload: bytes):
+        key_id = storage_key_id(key)
+        if state is None and not payload:
+            self._records.pop(key_id, None)
+            return
+        self._records[key_id] = (state, payload, time.time())
+        self._records.move_to_end(key_id)
+        while self.max_keys and len(self._records) > self.max_keys:
+            self._records.popitem(last=False)
+            self.evicted += 1
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        _, payload = self._get(key)
+        self._put(key, state.state if isinstance(state, State) else state, payload)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return self._get(key)[0]
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        state, _ = self._get(key)
+        self._put(key, state, self._pack(data))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return self._unpack(self._get(key)[1])
+
+    async def close(self) -> None:
+        pass
+
+    def resident_size(self) -> int:
+        """Примерный объём памяти записей в байтах (ключи, кортежи, данные)"""
+        size = sys.getsizeof(self._records)
+        for key_id, record in self._records.items():
+            size += sys.getsizeof(key_id) + sys.getsizeof(record) + sys.getsizeof(record[1])
+        return size
+
+    def get_stats(self) -> Dict[str, int]:
+        """Ключей в памяти, удалено по TTL и вытеснено по лимиту, объём в байтах"""
+        return {
+            'keys': len(self._records),
+            'expired': self.expired,
+            'evicted': self.evicted,
+            'resident_bytes': self.resident_size(),
+        }
+
+
+def create_storage() -> BaseStorage:
+    """Хранилище по FSM_STORAGE: sqlite (по умолчанию) или memory"""
+    if FSM_STORAGE == 'memory':
+        return BoundedMemoryStorage()
+    return SQLiteStorage()
@@ -0,0 +1,78 @@
+from datetime import datetime
+
+import pytest
+
+import captions
+from captions import TemplateError, build_context, compile_template, render_caption, validate_template
+
+SINGLE = {'title': 'Боевой континент', 'season': 1, 'episode': 5, 'tag': '#Боевой_континент', 'is_range': False}
+RANGE = {'title': 'Боевой континент', 'season': 1, 'episode_start': 1, 'episode_end': 12,
+         'tag': '#Боевой_континент', 'is_range': True}
+
+
+def test_render_variables_and_padding():
+    template = compile_template("{title} S{season:2}E{episode:2} ({episode_count}) {tag}")
+    assert template.render(build_context(SINGLE)) == "Боевой континент S01E05 (1) #Боевой_континент"
+    assert template.render(build_context(RANGE)) == "Боевой континент S01E01-12 (12) #Боевой_континент"
+
+
+def test_conditional_sections_and_escaped_braces():
+    template = compile_template("{#single}Серия {episode}{/single}{#range}Серии {episode_start}…{episode_end}{/range} {{x}}")
+    assert template.render(build_context(SINGLE)) == "Серия 5 {x}"
+    assert template.render(build_context(RANGE)) == "Серии 1…12 {x}"
+
+
+def test_date_variable():
+    context = build_context(SINGLE, now=datetime(2024, 3, 9))
+    assert compile_template("{date}").render(context) == "09.03.2024"
+
+
+@pytest.mark.parametrize("text", [
+    "{unknown}",
+    "{title:2}",
+    "{#range}без закрытия",
+    "{/single}",
+    "{#other}x{/other}",
+])
+def test_invalid_templates_are_rejected(text):
+    with pytest.raises(TemplateError):
+        compile_template(text)
+    assert validate_template(text)
+
+
+def test_validate_checks_caption_limit():
+    assert validate_template("{title}\n{episode}") is None
+    assert "1024" in validate_template("x" * 1100)
+
+
+def test_render_caption_default_and_per_channel_cache():
+    caption = render_caption('@a', None, RANGE)
+    assert "📺 Серии 1-12" in caption and "Серия " not in caption
+
+    template = {'name': 'T', 'template_text': '{title} {episode}'}
+    assert render_caption('@a', template, SINGLE) == "Боевой континент 5"
+    compiled = captions._compiled['@a'][1]
+    render_caption('@a', template, RANGE)
+    assert captions._compiled['@a'][1] is compiled
+
+    # Текст шаблона изменился - канал перекомпилируется
+    template = {'name': 'T', 'template_text': '{episode:3}'}
+    assert render_caption('@a', template, SINGLE) == "005"
+
+
+def test_legacy_template_renders_unknown_placeholders_verbatim():
+    template = {'name': 'Old', 'template_text': '{title} {episode} {unknown} {#x}'}
+    assert render_caption('@old', template, RANGE) == "Боевой континент 1-12 {unknown} {#x}"
+    assert render_caption('@old', template, SINGLE) == "Боевой континент 5 {unknown} {#x}"
+    # При просмотре админ видит, что шаблон нужно исправить
+    assert "старом формате" in captions.legacy_warning(template['template_text'])
+    assert captions.legacy_warning("{title} {episode:2}") == ""
+
+
+def test_first_episode_accepts_zero():
+    single = {'episode': 0, 'episode_start': None, 'episode_end': None, 'is_range': False}
+    span = {'episode': None, 'episode_start': 0, 'episode_end': 5, 'is_range': True}
+    assert captions.first_episode(single) == 0
+    assert captions.first_episode(span) == 0
+    assert captions.first_episode(span, 0) == 0
+    assert captions.first_episode(span, 3) == 3
@@ -1,8 +1,11 @@
 import os
 import importlib
 import tempfile
+import threading
+import sqlite3
 
 import database as db
+import migrations
 
 
 def test_basic_db_operations(tmp_path):
@@ -34,3 +37,360 @@ def test_basic_db_operations(tmp_path):
     ch_stats = db.get_channel_stats('@testchannel')
     assert ch_stats['total'] == 1
     assert ch_stats['by_admin'][0]['count'] == 1
+
+
+def test_thread_local_connections(tmp_path):
+    os.environ['DATABASE_FILE'] = str(tmp_path / "test_conn.db")
+    importlib.reload(db)
+    db.init_db()
+
+    # Соединение переиспользуется внутри потока
+    conn = db.get_connection()
+    assert db.add_admin(1, username='a')
+    assert db.get_connection() is conn
+
+    # Другой поток получает своё соединение
+    other = []
+    thread = threading.Thread(target=lambda: other.append(db.get_connection()))
+    thread.start()
+    thread.join()
+    assert other[0] is not conn
+
+    # После закрытия соединение открывается заново, данные на месте
+    db.close_connections()
+    assert db.get_connection() is not conn
+    assert db.is_admin(1)
+
+    # Поток, открывший соединение до close_connections(), тоже получает новое
+    opened, closed, results = threading.Event(), threading.Event(), []
+
+    def worker():
+        worker_conn = db.get_connection()
+        opened.set()
+        closed.wait(2)
+        results.append(db.get_connection() is not worker_conn)
+        results.append(db.get_connection().execute("SELECT COUNT(*) FROM admins").fetchone()[0])
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    opened.wait(2)
+    db.close_connections()
+    closed.set()
+    thread.join()
+    assert results == [True, 1]
+
+
+def test_group_commit_writer(tmp_path):
+    os.environ['DATABASE_FILE'] = str(tmp_path / "test_group.db")
+    importlib.reload(db)
+    db.init_db()
+    db.start_group_commit()
+    try:
+        assert db.add_channel('@ch', 'Channel')
+        threads = [
+            threading.Thread(target=db.log_upload, args=(i, '@ch', 'Title', 1, i))
+            for i in range(20)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Ошибка одного запроса не ломает остальные в пачке
+        assert db.add_template('Base', '{title}')
+        assert db.add_template('Base', '{title}') is None
+
+        stats = db.get_write_stats()
+        assert stats['group_commit'] is True
+        assert stats['requests'] == 23
+        assert stats['batches'] <= stats['requests']
+    finally:
+        db.close_connections()
+
+    assert db.get_channel_stats('@ch')['total'] == 20
+    assert db.get_template_by_name('Base') is not None
+
+
+class FlakyConnection:
+    """Соединение, у которого один раз не проходят COMMIT и ROLLBACK"""
+
+    def __init__(self, conn):
+        self.__dict__.update(conn=conn, fail=True)
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+    def __setattr__(self, name, value):
+        setattr(self.conn, name, value)
+
+    def execute(self, sql, *args):
+        if self.fail and sql in ("COMMIT", "ROLLBACK"):
+            if sql == "ROLLBACK":
+                self.__dict__['fail'] = False
+            raise sqlite3.OperationalError(f"{sql} failed")
+        return self.conn.execute(sql, *args)
+
+
+def test_group_commit_survives_failed_rollback(tmp_path, monkeypatch):
+    os.environ['DATABASE_FILE'] = str(tmp_path / "test_group_flaky.db")
+    importlib.reload(db)
+    db.init_db()
+    open_connection = db._open_connection
+    monkeypatch.setattr(db, '_open_connection', lambda: FlakyConnection(open_connection()))
+    db.start_group_commit()
+    try:
+        # COMMIT и ROLLBACK упали - запрос получает ошибку, а не зависает
+        assert not db.add_channel('@lost', 'Lost')
+        assert db.get_write_stats()['group_commit'] is True
+
+        # Писатель жив: следующая запись проходит
+        assert db.add_channel('@ch', 'Channel')
+        assert db.get_channel('@ch')['channel_name'] == 'Channel'
+        assert db.get_channel('@lost') is None
+    finally:
+        db.stop_group_commit()
+        db.close_connections()
+
+
+def test_admin_profile_is_written_only_on_change(tmp_path):
+    os.environ['DATABASE_FILE'] = str(tmp_path / "test_profiles.db")
+    importlib.reload(db)
+    db.init_db()
+    db.add_admin(1, username='old')
+
+    db.touch_admin_profile(1, username='new', name='New Name')
+    db.touch_admin_profile(1, username='new', name='New Name')
+    assert db.get_admin(1)['username'] == 'old'  # ещё не сброшено
+
+    assert db.flush_admin_profiles() == 1
+    assert db.get_admin(1)['username'] == 'new'
+
+    # Повтор того же профиля не создаёт записей
+    db.touch_admin_profile(1, username='new', name='New Name')
+    assert db.flush_admin_profiles() == 0
+
+
+def test_migrations_upgrade_legacy_db(tmp_path):
+    db_path = tmp_path / "legacy.db"
+    legacy = sqlite3.connect(db_path)
+    legacy.execute("CREATE TABLE admins (user_id INTEGER PRIMARY KEY, username TEXT, added_at TIMESTAMP)")
+    legacy.execute("CREATE TABLE upload_stats (id INTEGER PRIMARY KEY AUTOINCREMENT, admin_id INTEGER, "
+                   "channel_id TEXT, title TEXT, season INTEGER, episode INTEGER, uploaded_at TIMESTAMP)")
+    legacy.execute("INSERT INTO admins (user_id, username) VALUES (1, 'old')")
+    legacy.commit()
+    legacy.close()
+
+    os.environ['DATABASE_FILE'] = str(db_path)
+    importlib.reload(db)
+    db.init_db()
+    db.init_db()  # повторный запуск ничего не делает
+
+    conn = db.get_connection()
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == migrations.SCHEMA_VERSION
+    assert db.get_admin(1)['role'] == 'junior'
+    assert db.log_upload(1, '@ch', 'Title', 1, 1, file_id='f')
+
+    plan = conn.execute(
+        "EXPLAIN QUERY PLAN SELECT * FROM upload_stats WHERE admin_id = ? ORDER BY uploaded_at DESC", (1,)
+    ).fetchall()
+    assert any('idx_upload_stats_admin' in row[3] for row in plan)
+
+
+def test_stats_rollups_follow_upload_history():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        os.environ['DATABASE_FILE'] = os.path.join(tmpdir, "rollups.db")
+        importlib.reload(db)
+        db.init_db()
+
+        db.add_admin(1, username='one')
+        db.add_admin(2, username='two')
+        db.add_channel('@a', 'A')
+        db.add_channel('@b', 'B')
+        for episode in range(3):
+            db.log_upload(1, '@a', 'Title', 1, episode)
+        db.log_upload(1, '@b', 'Title', 1, 10)
+        db.log_upload(2, '@b', 'Other', 1, 1)
+
+        stats = {s['user_id']: s for s in db.get_all_stats()}
+        assert stats[1]['total_uploads'] == 4
+        assert stats[2]['total_uploads'] == 1
+        assert stats[1]['last_upload'] is not None
+
+        admin_stats = db.get_admin_stats(1)
+        assert admin_stats['total'] == 4
+        assert [(ch['channel_name'], ch['count']) for ch in admin_stats['by_channel']] == [('A', 3), ('B', 1)]
+        assert db.get_channel_stats('@b')['total'] == 2
+        assert sum(d['total'] for d in db.get_daily_stats()) == 5
+
+        # Ручная правка истории: триггер удаления и пересчёт сходятся
+        conn = db.get_connection()
+        conn.execute("DELETE FROM upload_stats WHERE admin_id = 2")
+        conn.execute("DELETE FROM stats_admin")
+        conn.commit()
+        assert db.get_all_stats()[0]['total_uploads'] == 0
+
+        assert db.rebuild_stats()
+        stats = {s['user_id']: s for s in db.get_all_stats()}
+        assert stats[1]['total_uploads'] == 4
+        assert stats[2]['total_uploads'] == 0
+        assert db.get_channel_stats('@b')['total'] == 1
+
+        db.close_connections()
+
+
+def test_query_cache_hits_and_invalidation():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        os.environ['DATABASE_FILE'] = os.path.join(tmpdir, "cache.db")
+        importlib.reload(db)
+        db.init_db()
+
+        db.add_admin(1, username='one')
+        db.add_channel('@a', 'A')
+        db.assign_admin_to_channel(1, '@a')
+        template_id = db.add_template('T', '{title}')
+        db.assign_template_to_channel('@a', template_id)
+
+        for _ in range(3):
+            assert db.is_admin(1)
+            assert [ch['channel_id'] for ch in db.get_admin_channels(1)] == ['@a']
+            assert db.get_channel_template('@a')['template_text'] == '{title}'
+        stats = db.get_cache_stats()
+        assert stats['misses'] == 3
+        assert stats['hits'] == 6
+
+        # Копии: правка результата не портит кеш
+        db.get_admin(1)['username'] = 'changed'
+        assert db.get_admin(1)['username'] == 'one'
+
+        db.update_template(template_id, template_text='{title} {episode}')
+        assert db.get_channel_template('@a')['template_text'] == '{title} {episode}'
+
+        db.unassign_admin_from_channel(1, '@a')
+        assert db.get_admin_channels(1) == []
+
+        db.add_channel('@a', 'Renamed')
+        assert db.get_channel('@a')['channel_name'] == 'Renamed'
+
+        db.remove_admin(1)
+        assert not db.is_admin(1)
+
+        db.close_connections()
+
+
+def test_cache_sees_changes_from_other_process():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        os.environ['DATABASE_FILE'] = os.path.join(tmpdir, "coherence.db")
+        os.environ['DB_CACHE_CHECK_INTERVAL'] = '0'
+        try:
+            importlib.reload(db)
+            db.init_db()
+            db.add_channel('@a', 'A')
+            db.add_admin(1, username='one')
+            assert db.get_channel('@a')['channel_name'] == 'A'
+            assert db.get_admin(1)['username'] == 'one'
+
+            # Другой процесс: отдельное соединение мимо модуля
+            other = sqlite3.connect(db.DB_FILE)
+            other.execute("UPDATE channels SET channel_name = 'B' WHERE channel_id = '@a'")
+            other.commit()
+
+            misses = db.get_cache_stats()['misses']
+            assert db.get_channel('@a')['channel_name'] == 'B'
+            # Админы не менялись - их запись осталась в кеше
+            assert db.get_admin(1)['username'] == 'one'
+            assert db.get_cache_stats()['misses'] == misses + 1
+
+            # Запись в upload_stats меняет data_version, но не версии кешируемых таблиц
+            other.execute("INSERT INTO upload_stats (admin_id, channel_id) VALUES (1, '@a')")
+            other.commit()
+            other.close()
+            assert db.get_channel('@a')['channel_name'] == 'B'
+            assert db.get_cache_stats()['misses'] == misses + 1
+
+            db.close_connections()
+        finally:
+            del os.environ['DB_CACHE_CHECK_INTERVAL']
+
+
+def test_is_admin_caches_negative_lookups_with_bound():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        os.environ['DATABASE_FILE'] = os.path.join(tmpdir, "is_admin.db")
+        importlib.reload(db)
+        db.init_db()
+        db._cache.maxsize = 10
+
+        assert not db.is_admin(7)
+        assert not db.is_admin(7)
+        assert db.get_cache_stats()['hits'] == 1
+
+        # Отрицательный ответ сбрасывается при добавлении админа
+        db.add_admin(7, username='seven')
+        assert db.is_admin(7)
+        db.remove_admin(7)
+        assert not db.is_admin(7)
+
+        for user_id in range(100, 150):
+            db.is_admin(user_id)
+        stats = db.get_cache_stats()
+        assert stats['entries'] == 10
+        assert stats['evictions'] >= 40
+
+        db.close_connections()
+
+
+def test_bulk_channel_queries_follow_changes(tmp_path):
+    os.environ['DATABASE_FILE'] = str(tmp_path / "bulk.db")
+    importlib.reload(db)
+    db.init_db()
+
+    db.add_admin(1, username='one')
+    db.add_channel('@a', 'A')
+    db.add_channel('@b', 'B')
+    template_id = db.add_template('T', '{title}')
+    db.assign_template_to_channel('@a', template_id)
+    db.assign_admin_to_channel(1, '@b')
+
+    channels = db.get_channels_with_templates()
+    assert [(ch['channel_id'], ch['template_id'], ch['template_name']) for ch in channels] == [
+        ('@a', template_id, 'T'), ('@b', None, None)
+    ]
+    assert [(ch['channel_id'], bool(ch['assigned'])) for ch in db.get_channels_with_admin_flags(1)] == [
+        ('@a', False), ('@b', True)
+    ]
+
+    # Записи сбрасывают кеш bulk-запросов
+    db.unassign_template_from_channel('@a')
+    db.assign_template_to_channel('@b', template_id)
+    assert [ch['template_id'] for ch in db.get_channels_with_templates()] == [None, template_id]
+    db.assign_admin_to_channel(1, '@a')
+    assert all(ch['assigned'] for ch in db.get_channels_with_admin_flags(1))
+    db.close_connections()
+
+
+def test_removing_channel_or_admin_drops_links(tmp_path):
+    os.environ['DATABASE_FILE'] = str(tmp_path / "remove.db")
+    importlib.reload(db)
+    db.init_db()
+
+    db.add_admin(1, username='one')
+    db.add_channel('@a', 'A')
+    db.assign_admin_to_channel(1, '@a')
+    db.assign_template_to_channel('@a', db.add_template('T', '{title}'))
+    assert db.get_channel_template('@a') is not None
+    assert [a['user_id'] for a in db.get_channel_admins('@a')] == [1]
+
+    db.remove_channel('@a')
+    assert db.get_channel_template('@a') is None
+    assert db.get_channel_admins('@a') == []
+    assert db.get_admin_channels(1) == []
+    # Канал с тем же id добавлен заново - старые связи не возвращаются
+    db.add_channel('@a', 'A')
+    assert db.get_channel_template('@a') is None
+    assert db.get_channel_admins('@a') == []
+
+    db.assign_admin_to_channel(1, '@a')
+    assert [ch['channel_id'] for ch in db.get_admin_channels(1)] == ['@a']
+    db.remove_admin(1)
+    assert db.get_admin_channels(1) == []
+    assert db.get_channel_admins('@a') == []
+    db.close_connections()
@@ -0,0 +1,162 @@
+import asyncio
+import os
+import importlib
+import sqlite3
+
+import pytest
+import pytest_asyncio
+
+import database_async as db
+
+
+@pytest_asyncio.fixture
+async def async_db(tmp_path):
+    os.environ['DATABASE_FILE'] = str(tmp_path / "test_async.db")
+    importlib.reload(db)
+    await db.init_db()
+    yield db
+    await db.close_db()
+
+
+@pytest.mark.asyncio
+async def test_basic_async_db_operations(async_db):
+    assert await db.add_admin(12345, username='testadmin')
+    assert await db.add_channel('@testchannel', 'Test Channel')
+    assert await db.assign_admin_to_channel(12345, '@testchannel')
+    assert await db.log_upload(12345, '@testchannel', 'Test Title', 1, 1, file_id='file_1', message_id='msg_1')
+
+    stats = await db.get_admin_stats(12345)
+    assert stats['total'] == 1
+    assert stats['by_channel'][0]['count'] == 1
+
+    channels = await db.get_admin_channels(12345)
+    assert [ch['channel_id'] for ch in channels] == ['@testchannel']
+
+
+@pytest.mark.asyncio
+async def test_pool_reuses_connections(async_db):
+    pool = await db.get_pool()
+    connections = list(pool._connections)
+
+    for _ in range(10):
+        await db.get_all_stats()
+    assert await db.add_template('Base', '{title}')
+
+    assert pool._connections == connections
+    stats = db.get_pool_stats()
+    assert stats['read_checkouts'] >= 10
+    assert stats['write_checkouts'] >= 1
+    assert stats['idle_readers'] == stats['readers']
+
+
+@pytest.mark.asyncio
+async def test_group_commit_batches_writes(async_db):
+    await db.start_group_commit()
+    assert await db.add_channel('@ch', 'Channel')
+
+    results = await asyncio.gather(*(
+        db.log_upload(i, '@ch', 'Title', 1, i) for i in range(20)
+    ))
+    assert all(results)
+
+    stats = db.get_write_stats()
+    assert stats['requests'] == 21
+    assert stats['batches'] < stats['requests']
+
+    await db.stop_group_commit()
+    assert (await db.get_admin_stats(3))['total'] == 1
+
+
+@pytest.mark.asyncio
+async def test_group_commit_survives_failed_rollback(async_db):
+    await db.start_group_commit()
+    conn = (await db.get_pool())._writer
+    commit, rollback = conn.commit, conn.rollback
+
+    async def failing(*args):
+        raise sqlite3.OperationalError("disk I/O error")
+
+    conn.commit = conn.rollback = failing
+    try:
+        # commit и rollback упали - запрос получает ошибку, а не зависает
+        assert not await asyncio.wait_for(db.add_channel('@lost', 'Lost'), 5)
+    finally:
+        conn.commit, conn.rollback = commit, rollback
+
+    # Задача-писатель жива: следующая запись проходит
+    assert db.get_write_stats()['group_commit'] is True
+    assert await asyncio.wait_for(db.add_channel('@ch', 'Channel'), 5)
+    await db.stop_group_commit()
+    assert (await db.get_channel('@ch'))['channel_name'] == 'Channel'
+    assert await db.get_channel('@lost') is None
+
+
+@pytest.mark.asyncio
+async def test_cache_sees_changes_from_other_process(async_db, monkeypatch):
+    monkeypatch.setattr(db, 'DB_CACHE_CHECK_INTERVAL', 0)
+    assert await db.add_channel('@a', 'A')
+    assert (await db.get_channel('@a'))['channel_name'] == 'A'
+
+    other = sqlite3.connect(db.DB_FILE)
+    other.execute("UPDATE channels SET channel_name = 'B' WHERE channel_id = '@a'")
+    other.commit()
+    other.close()
+
+    # Каждое читающее соединение пула замечает изменение по своему data_version
+    for _ in range(db.DB_POOL_READERS):
+        assert (await db.get_channel('@a'))['channel_name'] == 'B'
+
+
+@pytest.mark.asyncio
+async def test_log_uploads_batch(async_db):
+    assert await db.add_channel('@a', 'A')
+    assert await db.add_channel('@b', 'B')
+    assert await db.log_uploads([
+        (1, '@a', 'Title', 1, 5, 'file', '10'),
+        (1, '@b', 'Title', 1, 5, 'file', '20'),
+    ])
+    assert await db.log_uploads([])
+
+    stats = await db.get_admin_stats(1)
+    assert stats['total'] == 2
+    assert sorted(ch['channel_name'] for ch in stats['by_channel']) == ['A', 'B']
+
+
+@pytest.mark.asyncio
+async def test_bulk_channel_queries(async_db):
+    await db.add_admin(1, username='one')
+    await db.add_channel('@a', 'A')
+    await db.add_channel('@b', 'B')
+    template_id = await db.add_template('T', '{title}')
+    await db.assign_template_to_channel('@b', template_id)
+    await db.assign_admin_to_channel(1, '@a')
+
+    channels = await db.get_channels_with_templates()
+    assert [(ch['channel_id'], ch['template_id']) for ch in channels] == [('@a', None), ('@b', template_id)]
+    flags = await db.get_channels_with_admin_flags(1)
+    assert [(ch['channel_id'], bool(ch['assigned'])) for ch in flags] == [('@a', True), ('@b', False)]
+
+    await db.unassign_admin_from_channel(1, '@a')
+    assert not any(ch['assigned'] for ch in await db.get_channels_with_admin_flags(1))
+
+
+@pytest.mark.asyncio
+async def test_removing_channel_or_admin_drops_links(async_db):
+    await db.add_admin(1, username='one')
+    await db.add_channel('@a', 'A')
+    await db.assign_admin_to_channel(1, '@a')
+    await db.assign_template_to_channel('@a', await db.add_template('T', '{title}'))
+    assert await db.get_channel_template('@a') is not None
+    assert [ch['channel_id'] for ch in await db.get_admin_channels(1)] == ['@a']
+
+    await db.remove_channel('@a')
+    assert await db.get_channel_template('@a') is None
+    # Канал с тем же id добавлен заново - старые связи не возвращаются
+    await db.add_channel('@a', 'A')
+    assert await db.get_channel_template('@a') is None
+    assert await db.get_admin_channels(1) == []
+
+    await db.assign_admin_to_channel(1, '@a')
+    assert [ch['channel_id'] for ch in await db.get_admin_channels(1)] == ['@a']
+    await db.remove_admin(1)
+    assert await db.get_admin_channels(1) == []
@@ -0,0 +1,284 @@
+import asyncio
+import json
+import os
+import importlib
+from types import SimpleNamespace
+
+import pytest
+import pytest_asyncio
+
+os.environ.setdefault('BOT_TOKEN', '123456:TEST-token-for-imports-only')
+
+import database_async as db
+import handlers_upload
+import outbox_async
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import ContentType
+from middlewares import resolve_admin
+
+
+class FakeBot:
+    def __init__(self, fail=()):
+        self.calls = []
+        self.reports = []
+        self.fail = set(fail)
+        self._next_id = 100
+
+    def _sent(self):
+        self._next_id += 1
+        return SimpleNamespace(message_id=self._next_id)
+
+    async def send_video(self, chat_id, file_id, caption=None):
+        if chat_id in self.fail:
+            raise Exception("Bad Request: chat not found")
+        self.calls.append(('video', chat_id, [caption]))
+        return self._sent()
+
+    async def send_document(self, chat_id, file_id, caption=None):
+        self.calls.append(('document', chat_id, [caption]))
+        return self._sent()
+
+    async def send_media_group(self, chat_id, media):
+        self.calls.append(('album', chat_id, [m.caption for m in media]))
+        return [self._sent() for _ in media]
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.reports.append(text)
+
+
+class FakeMessage:
+    def __init__(self, user_id, message_id=1, file_id='file'):
+        self.from_user = SimpleNamespace(id=user_id)
+        self.chat = SimpleNamespace(id=user_id)
+        self.message_id = message_id
+        self.content_type = ContentType.VIDEO
+        self.video = SimpleNamespace(file_id=file_id)
+        self.answers = []
+
+    async def answer(self, text, **kwargs):
+        self.answers.append(text)
+
+
+@pytest_asyncio.fixture
+async def upload_env(tmp_path, monkeypatch):
+    os.environ['DATABASE_FILE'] = str(tmp_path / "test_upload.db")
+    importlib.reload(db)
+    await db.init_db()
+    await db.add_admin(1, username='admin')
+    for channel_id in ('@a', '@b', '@c'):
+        await db.add_channel(channel_id, channel_id.upper())
+        await db.assign_admin_to_channel(1, channel_id)
+    await outbox_async.start_outbox(handlers_upload.run_publish_job, handlers_upload.report_batch)
+    yield await resolve_admin(1)
+    await outbox_async.stop_outbox()
+    await db.close_db()
+
+def single(episode):
+    return {'title': 'Title', 'season': 1, 'episode': episode, 'episode_start': None,
+            'episode_end': None, 'tag': '#Title', 'is_range': False}
+
+
+def test_media_chunks_split_by_limit_and_type():
+    items = [(ContentType.VIDEO, f'v{i}', None) for i in range(12)] + [(ContentType.DOCUMENT, 'd', None)]
+    assert [len(chunk) for chunk in handlers_upload.media_chunks(items)] == [10, 2, 1]
+
+
+@pytest.mark.asyncio
+async def test_fan_out_logs_successes_and_reports_once(upload_env, monkeypatch):
+    bot = FakeBot(fail={'@c'})
+    monkeypatch.setattr(handlers_upload, 'bot', bot)
+    message = FakeMessage(1)
+
+    data = single(5)
+    await handlers_upload.publish_and_report(
+        message, upload_env, ['@a', '@b', '@c'], [(ContentType.VIDEO, 'file', data)], data
+    )
+    assert len(message.answers) == 1 and "в очереди" in message.answers[0]
+    await outbox_async.wait_idle()
+
+    assert sorted(call[1] for call in bot.calls) == ['@a', '@b']
+    assert len(bot.reports) == 1
+    assert "2 из 3" in bot.reports[0] and "@C" in bot.reports[0]
+    assert (await db.get_admin_stats(1))['total'] == 2
+
+
+@pytest.mark.asyncio
+async def test_range_files_published_as_album_per_episode(upload_env, monkeypatch):
+    bot = FakeBot()
+    monkeypatch.setattr(handlers_upload, 'bot', bot)
+
+    items = [(ContentType.VIDEO, f'file{i}', single(i)) for i in range(1, 13)]
+    published, error = await handlers_upload.send_to_channel('@a', items)
+
+    assert [call[0] for call in bot.calls] == ['album', 'album']
+    assert len(bot.calls[0][2]) == 10
+    assert "Серия 11" in bot.calls[1][2][0]
+    assert error is None and len(published) == 12
+
+
+@pytest.mark.asyncio
+async def test_range_upload_maps_files_to_episodes_in_order(upload_env, monkeypatch):
+    bot = FakeBot()
+    monkeypatch.setattr(handlers_upload, 'bot', bot)
+    monkeypatch.setattr(handlers_upload, 'ALBUM_COLLECT_DELAY', 0.01)
+    state = FSMContext(storage=MemoryStorage(), key=StorageKey(bot_id=0, chat_id=1, user_id=1))
+    data = dict(single(None), episode=None, episode_start=3, episode_end=5, is_range=True)
+    await state.set_state(handlers_upload.UploadStates.waiting_video)
+    await state.update_data({'data': data, 'channel_ids': ['@a']})
+
+    # Два файла альбомом, затем третий отдельно
+    for message_id in (11, 10):
+        await handlers_upload.process_video_upload(FakeMessage(1, message_id, f'f{message_id}'), state, upload_env)
+    await asyncio.sleep(0.1)
+    assert (await state.get_data())['next_episode'] == 5
+
+    await handlers_upload.process_video_upload(FakeMessage(1, 12, 'f12'), state, upload_env)
+    assert await state.get_state() is None
+    await outbox_async.wait_idle()
+
+    assert [call[0] for call in bot.calls] == ['album', 'video']
+    assert ["Серия 3" in c for c in bot.calls[0][2]] == [True, False]
+    stats = await db.get_admin_stats(1)
+    assert stats['total'] == 3
+    # Сессия закрыта - её замок не остаётся в памяти
+    assert len(handlers_upload._session_locks) == 0
+    handlers_upload.end_session(1)
+
+
+@pytest.mark.asyncio
+async def test_album_flush_waits_for_users_current_update(upload_env, monkeypatch):
+    bot = FakeBot()
+    monkeypatch.setattr(handlers_upload, 'bot', bot)
+    monkeypatch.setattr(handlers_upload, 'ALBUM_COLLECT_DELAY', 0.01)
+    state = FSMContext(storage=MemoryStorage(), key=StorageKey(bot_id=0, chat_id=1, user_id=1))
+    data = dict(single(None), episode=None, episode_start=1, episode_end=3, is_range=True)
+    await state.set_state(handlers_upload.UploadStates.waiting_video)
+    await state.update_data({'data': data, 'channel_ids': ['@a']})
+    await handlers_upload.process_video_upload(FakeMessage(1, 10, 'f10'), state, upload_env)
+
+    # Пока идёт следующий апдейт пользователя (он выходит в меню), альбом не публикуется
+    async with handlers_upload.user_locks.hold(1):
+        await asyncio.sleep(0.05)
+        assert bot.calls == []
+        await state.clear()
+    await asyncio.sleep(0.05)
+    await outbox_async.wait_idle()
+    assert bot.calls == []
+    assert handlers_upload._album_tasks == {}
+
+
+@pytest.mark.asyncio
+async def test_range_starting_at_zero(upload_env, monkeypatch):
+    bot = FakeBot()
+    monkeypatch.setattr(handlers_upload, 'bot', bot)
+    state = FSMContext(storage=MemoryStorage(), key=StorageKey(bot_id=0, chat_id=1, user_id=1))
+    data = handlers_upload.parse_input('Title 1 0-1')
+    assert (data['episode_start'], data['episode_end']) == (0, 1)
+    await state.set_state(handlers_upload.UploadStates.waiting_video)
+    await state.update_data({'data': data, 'channel_ids': ['@a']})
+
+    # Серия 0 - обычный номер: не путается с "нет номера"
+    for message_id in (10, 11):
+        await handlers_upload.process_video_upload(FakeMessage(1, message_id, f'f{message_id}'), state, upload_env)
+    assert await state.get_state() is None
+    await outbox_async.wait_idle()
+
+    assert ["Серия 0" in c for c in bot.calls[0][2]] == [True, False]
+    assert (await db.get_admin_stats(1))['total'] == 2
+    handlers_upload.end_session(1)
+
+
+@pytest.mark.asyncio
+async def test_single_session_numbers_files_sequentially(upload_env, monkeypatch):
+    bot = FakeBot()
+    monkeypatch.setattr(handlers_upload, 'bot', bot)
+    state = FSMContext(storage=MemoryStorage(), key=StorageKey(bot_id=0, chat_id=1, user_id=1))
+    await state.set_state(handlers_upload.UploadStates.waiting_video)
+    await state.update_data({'data': single(7), 'channel_ids': ['@a']})
+
+    messages = [FakeMessage(1, message_id, f'f{message_id}') for message_id in (20, 21, 22)]
+    await asyncio.gather(*(handlers_upload.process_video_upload(m, state, upload_env) for m in messages))
+    await outbox_async.wait_idle()
+
+    assert [c[2][0].count("Серия") for c in bot.calls] == [1, 1, 1]
+    assert ["Серия 7" in bot.calls[0][2][0], "Серия 9" in bot.calls[2][2][0]] == [True, True]
+    assert (await state.get_data())['next_episode'] == 10
+    assert await state.get_state() == handlers_upload.UploadStates.waiting_video.state
+    handlers_upload.end_session(1)
+
+
+@pytest.mark.asyncio
+async def test_upload_session_expires_after_timeout(upload_env, monkeypatch):
+    bot = FakeBot()
+    monkeypatch.setattr(handlers_upload, 'bot', bot)
+    monkeypatch.setattr(handlers_upload, 'UPLOAD_SESSION_TIMEOUT', 0.01)
+    state = FSMContext(storage=MemoryStorage(), key=StorageKey(bot_id=0, chat_id=1, user_id=1))
+    await state.set_state(handlers_upload.UploadStates.waiting_video)
+
+    handlers_upload.touch_session(1, state)
+    await asyncio.sleep(0.05)
+
+    assert await state.get_state() is None
+    assert "закрыта" in bot.reports[0]
+    assert handlers_upload._session_timeouts == {}
+    assert len(handlers_upload._session_locks) == 0
+
+
+@pytest.mark.asyncio
+async def test_leaving_to_main_menu_cancels_session_timer(upload_env, monkeypatch):
+    import main_async
+
+    bot = FakeBot()
+    monkeypatch.setattr(handlers_upload, 'bot', bot)
+    monkeypatch.setattr(handlers_upload, 'UPLOAD_SESSION_TIMEOUT', 0.05)
+    state = FSMContext(storage=MemoryStorage(), key=StorageKey(bot_id=0, chat_id=1, user_id=1))
+    await state.set_state(handlers_upload.UploadStates.waiting_video)
+    handlers_upload.touch_session(1, state)
+    timer = handlers_upload._session_timeouts[1]
+
+    await main_async.leave_state(state, 1)
+    await asyncio.sleep(0.1)
+    assert timer.cancelled()
+    assert handlers_upload._session_timeouts == {} and bot.reports == []
+
+
+@pytest.mark.asyncio
+async def test_captioned_video_published_to_remembered_channel(upload_env, monkeypatch):
+    bot = FakeBot()
+    monkeypatch.setattr(handlers_upload, 'bot', bot)
+    message = FakeMessage(1)
+    message.caption = "Title 1 4"
+
+    # Каналов несколько, канал по умолчанию ещё не выбран
+    await handlers_upload.process_captioned_video(message, upload_env)
+    assert bot.calls == [] and "запомнится" in message.answers[-1]
+
+    await db.set_default_channel(1, '@b')
+    await handlers_upload.process_captioned_video(message, await resolve_admin(1))
+    await outbox_async.wait_idle()
+    assert [call[1] for call in bot.calls] == ['@b']
+    assert "Серия 4" in bot.calls[0][2][0]
+    assert (await db.get_admin_stats(1))['total'] == 1
+
+
+@pytest.mark.asyncio
+async def test_outbox_resumes_unfinished_jobs_after_restart(upload_env, monkeypatch):
+    bot = FakeBot()
+    monkeypatch.setattr(handlers_upload, 'bot', bot)
+    await outbox_async.stop_outbox()
+
+    # Задача, прерванная посреди публикации прошлым запуском
+    payload = json.dumps({'items': [['video', 'file', single(2)]], 'data': single(2)})
+    await db.enqueue_jobs([('b1', 1, 1, '@a', payload)])
+    job = (await db.get_batch_jobs('b1'))[0]
+    await db.start_job(job['id'])
+
+    await outbox_async.start_outbox(handlers_upload.run_publish_job, handlers_upload.report_batch)
+    await outbox_async.wait_idle()
+
+    assert [call[1] for call in bot.calls] == ['@a']
+    assert "Успешно" in bot.reports[0]
+    job = (await db.get_batch_jobs('b1'))[0]
+    assert job['status'] == 'done' and job['attempts'] == 2
@@ -0,0 +1,129 @@
+import asyncio
+import os
+import importlib
+from datetime import datetime
+
+import pytest
+import pytest_asyncio
+from aiogram.types import Chat, Message, Update, User
+
+import database_async as db
+import middlewares
+
+
+@pytest_asyncio.fixture
+async def async_db(tmp_path):
+    os.environ['DATABASE_FILE'] = str(tmp_path / "test_middlewares.db")
+    importlib.reload(db)
+    await db.init_db()
+    yield db
+    await db.close_db()
+
+
+def make_update(user_id: int, text: str) -> Update:
+    user = User(id=user_id, is_bot=False, first_name="Test")
+    message = Message(
+        message_id=1,
+        date=datetime.now(),
+        chat=Chat(id=user_id, type="private"),
+        from_user=user,
+        text=text,
+    )
+    return Update(update_id=1, message=message)
+
+
+@pytest.mark.asyncio
+async def test_auth_middleware_injects_admin_and_drops_others(async_db):
+    await db.add_admin(1, username='junior')
+    await db.add_channel('@a', 'A')
+    await db.add_channel('@b', 'B')
+    await db.assign_admin_to_channel(1, '@a')
+
+    middleware = middlewares.AdminAuthMiddleware()
+    seen = []
+
+    async def handler(event, data):
+        seen.append(data['admin'])
+        return "handled"
+
+    update = make_update(1, "📤 Загрузить")
+    result = await middleware(handler, update, {'event_from_user': update.message.from_user})
+    assert result == "handled"
+    admin = seen[0]
+    assert admin.role == 'junior' and not admin.is_super
+    assert admin.can_post_to('@a') and not admin.can_post_to('@b')
+
+    update = make_update(2, "📤 Загрузить")
+    result = await middleware(handler, update, {'event_from_user': update.message.from_user})
+    assert result is None
+    assert len(seen) == 1
+    assert middleware.dropped == 1
+
+
+@pytest.mark.asyncio
+async def test_rate_limit_middleware_counts_album_files():
+    from aiogram.methods import SendMediaGroup
+    from aiogram.types import InputMediaVideo
+    from ratelimit import OutboundLimiter
+
+    limiter = OutboundLimiter(global_per_second=100, group_per_minute=20)
+    middleware = middlewares.RateLimitRequestMiddleware(limiter)
+    method = SendMediaGroup(chat_id='@channel', media=[InputMediaVideo(media=f'f{i}') for i in range(3)])
+
+    async def make_request(bot, method):
+        return 'sent'
+
+    assert await middleware(make_request, None, method) == 'sent'
+    # Три файла альбома списаны из ведра канала (20 в минуту)
+    bucket = limiter.chat_bucket('@channel')
+    assert bucket.reserve(17) == 0.0 and bucket.reserve(1) > 2
+
+
+@pytest.mark.asyncio
+async def test_rate_limit_middleware_counts_media_edit_as_one_message():
+    from aiogram.methods import EditMessageMedia
+    from aiogram.types import InputMediaVideo
+    from ratelimit import OutboundLimiter
+
+    limiter = OutboundLimiter(global_per_second=100, group_per_minute=20)
+    middleware = middlewares.RateLimitRequestMiddleware(limiter)
+    method = EditMessageMedia(chat_id='@channel', message_id=5, media=InputMediaVideo(media='f'))
+
+    async def make_request(bot, method):
+        return 'edited'
+
+    assert await middleware(make_request, None, method) == 'edited'
+    bucket = limiter.chat_bucket('@channel')
+    assert bucket.reserve(19) == 0.0 and bucket.reserve(1) > 2
+
+
+@pytest.mark.asyncio
+async def test_updates_serialized_per_user_and_bounded_globally():
+    middleware = middlewares.UpdateConcurrencyMiddleware(max_in_flight=2)
+    log = []
+    running = []
+    peak = []
+
+    async def handler(event, data):
+        running.append(event)
+        peak.append(len(running))
+        log.append(('start', event))
+        await asyncio.sleep(0.02)
+        log.append(('end', event))
+        running.remove(event)
+
+    def user(user_id):
+        return {'event_from_user': User(id=user_id, is_bot=False, first_name="Test")}
+
+    updates = [('u1-a', 1), ('u1-b', 1), ('u2', 2), ('u3', 3)]
+    tasks = [asyncio.create_task(middleware(handler, name, user(uid))) for name, uid in updates]
+    await asyncio.sleep(0)
+    assert middleware.get_stats()['waiting'] == 2 and middleware.get_stats()['in_flight'] == 2
+    await asyncio.gather(*tasks)
+
+    # Второй апдейт пользователя 1 начался только после первого
+    assert log.index(('end', 'u1-a')) < log.index(('start', 'u1-b'))
+    assert max(peak) == 2
+    stats = middleware.get_stats()
+    assert stats['processed'] == 4 and stats['waiting'] == 0 and stats['users'] == 0
+    assert stats['max_waiting'] == 2
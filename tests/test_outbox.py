@@ -0,0 +1,69 @@
+import importlib
+import os
+import threading
+import time
+
+import database as db
+import outbox
+
+
+def setup_db(tmp_path):
+    os.environ['DATABASE_FILE'] = str(tmp_path / "test_outbox.db")
+    importlib.reload(db)
+    db.init_db()
+
+
+def test_jobs_run_in_order_per_channel_and_report_batches(tmp_path):
+    setup_db(tmp_path)
+    published, reports = [], []
+
+    def run_job(job):
+        # Первая задача канала медленнее - порядок всё равно сохраняется
+        if job['payload']['data']['episode'] == 1:
+            time.sleep(0.05)
+        published.append((job['channel_id'], job['payload']['data']['episode']))
+        if job['channel_id'] == '@bad':
+            return [], Exception("Bad Request: chat not found")
+        return [str(job['id'])], None
+
+    outbox.start_outbox(run_job, reports.append)
+    try:
+        first = outbox.enqueue(1, 1, ['@a', '@bad'], [['video', 'f1', {}]], {'episode': 1})
+        second = outbox.enqueue(1, 1, ['@a'], [['video', 'f2', {}]], {'episode': 2})
+        outbox.wait_idle()
+    finally:
+        outbox.stop_outbox()
+
+    assert [episode for channel, episode in published if channel == '@a'] == [1, 2]
+    assert sorted(batch[0]['batch_id'] for batch in reports) == sorted([first, second])
+    batch = next(batch for batch in reports if batch[0]['batch_id'] == first)
+    assert {job['channel_id']: job['status'] for job in batch} == {'@a': 'done', '@bad': 'failed'}
+    assert db.get_outbox_stats() == {'done': 2, 'failed': 1}
+
+
+def test_running_jobs_are_resumed_on_start(tmp_path):
+    setup_db(tmp_path)
+    db.enqueue_jobs([('b1', 1, 1, '@a', '{"items": [], "data": {}}')])
+    db.start_job(db.get_batch_jobs('b1')[0]['id'])
+    done = threading.Event()
+
+    outbox.start_outbox(lambda job: ([], None), lambda jobs: done.set())
+    try:
+        assert done.wait(2)
+    finally:
+        outbox.stop_outbox()
+    assert db.get_batch_jobs('b1')[0]['status'] == 'done'
+
+
+def test_jobs_enqueued_before_start_wait_for_workers(tmp_path):
+    setup_db(tmp_path)
+    batch_id = outbox.enqueue(1, 1, ['@a'], [['video', 'f1', {}]], {'episode': 0})
+    assert db.get_batch_jobs(batch_id)[0]['status'] == 'pending'
+    done = threading.Event()
+
+    outbox.start_outbox(lambda job: ([], None), lambda jobs: done.set())
+    try:
+        assert done.wait(2)
+    finally:
+        outbox.stop_outbox()
+    assert db.get_batch_jobs(batch_id)[0]['status'] == 'done'
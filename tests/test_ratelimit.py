@@ -0,0 +1,100 @@
+import asyncio
+import time
+
+import pytest
+
+import ratelimit
+
+from ratelimit import OutboundLimiter, TokenBucket, mark_bulk
+
+
+def test_token_bucket_burst_then_waits():
+    bucket = TokenBucket(rate=10, capacity=3)
+    assert [bucket.reserve() for _ in range(3)] == [0.0, 0.0, 0.0]
+    # Четвёртый токен - в долг, ждать ~0.1 с; пятый - ещё дольше
+    fourth, fifth = bucket.reserve(), bucket.reserve()
+    assert 0.05 < fourth < fifth <= 0.2
+
+
+def test_token_bucket_oversized_request_is_capped():
+    bucket = TokenBucket(rate=1, capacity=2)
+    assert bucket.reserve(10) == 0.0
+    assert bucket.reserve() > 0.5
+
+
+def test_try_take_keeps_headroom():
+    bucket = TokenBucket(rate=1, capacity=10)
+    assert bucket.try_take(5, headroom=4) == 0.0
+    # Осталось 5: ещё 2 оставили бы меньше 4 - не берём
+    assert bucket.try_take(2, headroom=4) > 0
+    assert bucket.reserve(5) == 0.0
+
+
+def test_chat_buckets_by_chat_type():
+    limiter = OutboundLimiter(global_per_second=100, group_per_minute=20, private_per_second=1)
+    assert limiter.chat_bucket(12345).rate == 1
+    assert limiter.chat_bucket(-100123).rate == limiter.chat_bucket('@channel').rate == 20 / 60
+
+
+def test_private_chat_bucket_only_limits_bulk():
+    limiter = OutboundLimiter(global_per_second=100, private_per_second=1)
+    start = time.monotonic()
+    # Быстрая навигация по меню: правки и ответы в личке не ждут
+    for _ in range(10):
+        limiter.acquire_sync('editMessageText', 42)
+        limiter.acquire_sync('sendMessage', 42)
+    assert time.monotonic() - start < 0.5
+
+    mark_bulk()
+    try:
+        for _ in range(3):
+            limiter.acquire_sync('sendMessage', 43)
+        assert limiter.chat_bucket(43).reserve() > 0.5
+    finally:
+        ratelimit._bulk.set(False)
+
+
+def test_idle_chat_buckets_are_pruned(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(ratelimit.time, 'monotonic', lambda: now[0])
+    limiter = OutboundLimiter(global_per_second=100, group_per_minute=20, max_chats=10)
+
+    for chat_id in range(1, 101):
+        limiter.acquire_sync('sendMessage', f'@channel{chat_id}')
+        now[0] += 5
+    stats = limiter.get_stats()
+    assert stats['chats'] <= 10 and stats['pruned'] >= 90
+
+    # Занятые ведра не удаляются: лимит чата не сбрасывается
+    for chat_id in range(-1, -21, -1):
+        limiter.chat_bucket(chat_id).reserve(5)
+    assert all(str(chat_id) in limiter._chats for chat_id in range(-1, -21, -1))
+    assert limiter.get_stats()['chats'] <= 40
+
+
+@pytest.mark.asyncio
+async def test_interactive_requests_overtake_bulk():
+    limiter = OutboundLimiter(global_per_second=10, group_per_minute=600, interactive_reserve=5)
+    order = []
+
+    async def bulk(n):
+        mark_bulk()
+        for i in range(n):
+            await limiter.acquire('sendVideo', '@channel')
+            order.append('bulk')
+
+    async def interactive():
+        await asyncio.sleep(0.05)
+        await limiter.acquire('sendMessage', 42)
+        order.append('reply')
+
+    # Служебные запросы не ограничиваются
+    await limiter.acquire('getUpdates')
+    start = time.monotonic()
+    await asyncio.gather(bulk(8), interactive())
+
+    # Рассылка исчерпала свою долю ведра и ждёт, а ответ прошёл сразу
+    assert order.index('reply') < 7
+    assert time.monotonic() - start < 1
+    stats = limiter.get_stats()
+    assert stats['bulk'] == 8 and stats['interactive'] == 1
@@ -0,0 +1,66 @@
+from types import SimpleNamespace
+
+import pytest
+import requests
+from aiogram.exceptions import TelegramBadRequest, TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+from telebot.apihelper import ApiTelegramException
+
+import retry
+
+
+def telebot_error(code, description, parameters=None):
+    result_json = {'error_code': code, 'description': description, 'parameters': parameters or {}}
+    return ApiTelegramException('sendVideo', SimpleNamespace(status_code=code), result_json)
+
+
+def test_retry_delay_by_error_kind(monkeypatch):
+    monkeypatch.setattr(retry, 'SEND_MAX_ATTEMPTS', 5)
+    assert retry.retry_delay(TelegramRetryAfter(method=None, message='Flood', retry_after=3), 1) == 3
+    assert retry.retry_delay(telebot_error(429, 'Too Many Requests', {'retry_after': 7}), 1) == 7
+    # Идемпотентные запросы: 5xx и сеть - растущая задержка со случайным разбросом
+    assert 0.5 <= retry.retry_delay(telebot_error(502, 'Bad Gateway'), 1, idempotent=True) <= 1
+    assert 2 <= retry.retry_delay(TelegramNetworkError(method=None, message='timeout'), 3, idempotent=True) <= 4
+    # Постоянные ошибки не повторяются, и попытки конечны
+    assert retry.retry_delay(TelegramBadRequest(method=None, message='chat not found'), 1) is None
+    assert retry.retry_delay(telebot_error(400, 'Bad Request: not enough rights'), 1) is None
+    assert retry.retry_delay(ConnectionError('reset'), 5) is None
+
+
+def test_sends_are_not_retried_after_they_may_have_been_delivered(monkeypatch):
+    monkeypatch.setattr(retry, 'SEND_MAX_ATTEMPTS', 5)
+    # Соединение не установлено - запрос не дошёл, повтор безопасен
+    assert retry.retry_delay(TelegramNetworkError(method=None, message='ClientConnectorError: refused'), 1)
+    assert retry.retry_delay(requests.exceptions.ConnectTimeout('connect timeout'), 1)
+    # Таймаут чтения, обрыв и 5xx: пост мог выйти - повтор его продублировал бы
+    assert retry.retry_delay(TelegramNetworkError(method=None, message='Request timeout error'), 1) is None
+    assert retry.retry_delay(TelegramNetworkError(method=None, message='ServerDisconnectedError: x'), 1) is None
+    assert retry.retry_delay(requests.exceptions.ReadTimeout('read timeout'), 1) is None
+    assert retry.retry_delay(TelegramServerError(method=None, message='Bad Gateway'), 1) is None
+    assert retry.retry_delay(telebot_error(502, 'Bad Gateway'), 1) is None
+
+
+def test_call_sync_retries_and_counts_per_channel(monkeypatch):
+    monkeypatch.setattr(retry.time, 'sleep', lambda seconds: None)
+    errors = [telebot_error(429, 'Too Many Requests', {'retry_after': 1}), ConnectionRefusedError('refused')]
+
+    def send():
+        if errors:
+            raise errors.pop(0)
+        return 'sent'
+
+    before = retry.get_retry_stats().get('@sync', 0)
+    assert retry.call_sync('@sync', send) == 'sent'
+    assert retry.get_retry_stats()['@sync'] == before + 2
+
+
+@pytest.mark.asyncio
+async def test_call_async_stops_on_permanent_error(monkeypatch):
+    calls = []
+
+    async def send():
+        calls.append(1)
+        raise TelegramBadRequest(method=None, message='Bad Request: chat not found')
+
+    with pytest.raises(TelegramBadRequest):
+        await retry.call_async('@async', send)
+    assert len(calls) == 1 and '@async' not in retry.get_retry_stats()
@@ -0,0 +1,62 @@
+import importlib
+import os
+import time
+
+import pytest
+
+import database as db
+import sessions
+
+
+def test_session_behaves_like_state_dict():
+    session = sessions.UserSession()
+    assert session['state'] is None and session['data'] == {} and session['temp'] == {}
+    assert session.get('session_expires', float('inf')) == float('inf')
+    assert 'selected_admin_id' not in session
+
+    session['selected_admin_id'] = 5
+    assert session.pop('selected_admin_id', None) == 5
+    assert session.get('selected_admin_id') is None
+    with pytest.raises(KeyError):
+        session['unknown'] = 1
+    with pytest.raises(AttributeError):
+        session.__dict__
+
+
+def test_store_expires_idle_and_evicts_least_recent():
+    store = sessions.SessionStore(ttl=60, maxsize=2)
+    first = store.get(1)
+    first['state'] = 'waiting_video'
+    store.get(2)
+    assert store.get(1) is first
+    store.get(3)  # вытесняет 2 - к нему обращались раньше всех
+    assert store.get_stats() == {'sessions': 2, 'expired': 0, 'evicted': 1}
+
+    store._sessions[1] = (first, time.time() - 61)
+    store._sessions.move_to_end(1, last=False)
+    assert store.get(1) is not first
+    assert store.get_stats()['expired'] == 1
+
+    store.clear(1)
+    assert len(store) == 1
+
+
+def test_snapshot_roundtrip_through_db(tmp_path):
+    os.environ['DATABASE_FILE'] = str(tmp_path / "test_sessions.db")
+    importlib.reload(db)
+    db.init_db()
+
+    store = sessions.SessionStore(ttl=60, maxsize=10)
+    state = store.get(42)
+    state['state'] = 'select_channels'
+    state['channel_id'] = ['@a', '@b']
+    state['next_episode'] = 3
+    assert db.save_user_sessions(store.snapshot())
+
+    restored = sessions.SessionStore(ttl=60, maxsize=10)
+    restored.restore(db.load_user_sessions())
+    state = restored.get(42)
+    assert state['state'] == 'select_channels'
+    assert state['channel_id'] == ['@a', '@b']
+    assert state['next_episode'] == 3
+    db.close_connections()
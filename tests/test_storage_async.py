@@ -0,0 +1,116 @@
+import importlib
+import os
+import time
+
+import pytest
+import pytest_asyncio
+from aiogram.fsm.storage.base import StorageKey
+
+import database_async as db
+import storage_async
+
+KEY = StorageKey(bot_id=1, chat_id=10, user_id=10)
+
+
+@pytest_asyncio.fixture
+async def async_db(tmp_path):
+    os.environ['DATABASE_FILE'] = str(tmp_path / "test_storage.db")
+    importlib.reload(db)
+    await db.init_db()
+    yield db
+    await db.close_db()
+
+
+@pytest.mark.asyncio
+async def test_changes_are_coalesced_and_survive_restart(async_db):
+    storage = storage_async.SQLiteStorage(ttl=60, flush_interval=60)
+    await storage.set_state(KEY, "UploadStates:waiting_title")
+    await storage.update_data(KEY, {'data': {'title': 'Show'}})
+    await storage.update_data(KEY, {'channel_ids': ['@a']})
+    await storage.set_state(KEY, "UploadStates:waiting_video")
+    assert await db.get_fsm_record(storage_async.storage_key_id(KEY)) is None
+
+    await storage.close()
+    stats = storage.get_stats()
+    assert (stats['changes'], stats['written'], stats['flushes']) == (4, 1, 1)
+
+    restarted = storage_async.SQLiteStorage(ttl=60)
+    assert await restarted.get_state(KEY) == "UploadStates:waiting_video"
+    assert await restarted.get_data(KEY) == {'data': {'title': 'Show'}, 'channel_ids': ['@a']}
+
+    # Пустое состояние удаляет запись
+    await restarted.set_state(KEY, None)
+    await restarted.set_data(KEY, {})
+    await restarted.close()
+    assert await db.get_fsm_record(storage_async.storage_key_id(KEY)) is None
+
+
+@pytest.mark.asyncio
+async def test_stale_states_expire(async_db):
+    storage = storage_async.SQLiteStorage(ttl=60, flush_interval=60)
+    await storage.set_state(KEY, "TemplateStates:waiting_text")
+    await storage.flush()
+
+    storage._records[storage_async.storage_key_id(KEY)].touched = time.time() - 61
+    assert await storage.get_state(KEY) is None
+    assert await storage.get_data(KEY) == {}
+
+    await async_db.save_fsm_records([], [], time.time())
+    assert await db.get_fsm_record(storage_async.storage_key_id(KEY)) is None
+
+
+@pytest.mark.asyncio
+async def test_cache_is_capped_and_expires_behind_fresh_entries(async_db):
+    storage = storage_async.SQLiteStorage(ttl=60, flush_interval=60, cache_size=2)
+    keys = [StorageKey(bot_id=1, chat_id=i, user_id=i) for i in range(4)]
+    for key in keys[:3]:
+        await storage.set_state(key, "UploadStates:waiting_video")
+    # Несохранённые изменения не вытесняются
+    assert storage.get_stats()['cached'] == 3
+    await storage.flush()
+    assert storage.get_stats()['cached'] == 2
+
+    # Вытесненная запись читается из БД
+    assert await storage.get_state(keys[0]) == "UploadStates:waiting_video"
+    assert storage.get_stats()['cached'] == 2
+
+    # Просроченная запись за свежей (загруженной из БД позже) тоже удаляется
+    stale = storage._records[storage_async.storage_key_id(keys[2])]
+    stale.touched = time.time() - 61
+    storage._records.move_to_end(storage_async.storage_key_id(keys[2]))
+    await storage.set_state(keys[3], "AdminStates:waiting_id")
+    await storage.flush()
+    assert storage_async.storage_key_id(keys[2]) not in storage._records
+    assert storage.get_stats()['evicted'] >= 1
+
+
+@pytest.mark.asyncio
+async def test_bounded_memory_storage_caps_keys_and_expires_idle():
+    storage = storage_async.BoundedMemoryStorage(max_keys=2, ttl=60)
+    keys = [StorageKey(bot_id=1, chat_id=i, user_id=i) for i in range(3)]
+
+    # Чтение без состояния ничего не хранит
+    assert await storage.get_state(keys[0]) is None
+    assert storage.get_stats()['keys'] == 0
+
+    await storage.set_state(keys[0], "UploadStates:waiting_video")
+    await storage.update_data(keys[0], {'channel_ids': ['@a'], 'data': {'title': 'Show'}})
+    await storage.set_state(keys[1], "AdminStates:waiting_id")
+    await storage.get_state(keys[0])
+    await storage.set_state(keys[2], "TemplateStates:waiting_text")  # вытесняет keys[1]
+    assert await storage.get_state(keys[1]) is None
+    assert await storage.get_data(keys[0]) == {'channel_ids': ['@a'], 'data': {'title': 'Show'}}
+    stats = storage.get_stats()
+    assert (stats['keys'], stats['evicted']) == (2, 1)
+    assert stats['resident_bytes'] > 0
+
+    key_id = storage_async.storage_key_id(keys[2])
+    state, payload, _ = storage._records[key_id]
+    storage._records[key_id] = (state, payload, time.time() - 61)
+    storage._records.move_to_end(key_id, last=False)
+    assert await storage.get_state(keys[2]) is None
+    assert storage.get_stats()['expired'] == 1
+
+    await storage.set_state(keys[0], None)
+    await storage.set_data(keys[0], {})
+    assert storage.get_stats()['keys'] == 0
@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+from aiogram import Bot, Dispatcher, Router
+from aiogram.types import Message
+from aiohttp.test_utils import TestClient, TestServer
+
+import webhook_async
+
+SECRET = 'test-secret'
+
+
+def recorded_update(update_id: int, text: str) -> dict:
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': 1700000000,
+            'chat': {'id': 1, 'type': 'private'},
+            'from': {'id': 1, 'is_bot': False, 'first_name': 'Admin'},
+            'text': text,
+        },
+    }
+
+
+@pytest.fixture
+def handled():
+    return []
+
+
+@pytest.fixture
+def dispatcher(handled):
+    dp = Dispatcher()
+    router = Router()
+
+    @router.message()
+    async def record(message: Message):
+        await asyncio.sleep(0.05)
+        handled.append(message.text)
+
+    dp.include_router(router)
+    return dp
+
+
+@pytest.mark.asyncio
+async def test_webhook_checks_secret_and_drains_on_shutdown(dispatcher, handled):
+    bot = Bot(token='123456:TEST-token-for-imports-only')
+    app = webhook_async.build_app(dispatcher, bot, SECRET, path='/webhook')
+    client = TestClient(TestServer(app))
+    await client.start_server()
+
+    response = await client.post('/webhook', json=recorded_update(1, 'wrong'),
+                                 headers={'X-Telegram-Bot-Api-Secret-Token': 'nope'})
+    assert response.status == 401
+
+    for update_id in (2, 3, 4):
+        response = await client.post('/webhook', json=recorded_update(update_id, f'msg{update_id}'),
+                                     headers={'X-Telegram-Bot-Api-Secret-Token': SECRET})
+        assert response.status == 200
+    # Ответ пришёл до обработки; остановка сервера дожидается всех апдейтов
+    assert app[webhook_async.WEBHOOK_HANDLER].in_flight == 3
+    await client.close()
+
+    assert sorted(handled) == ['msg2', 'msg3', 'msg4']
+    await bot.session.close()
@@ -0,0 +1,67 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import workers
+
+
+def update(user_id, n):
+    return SimpleNamespace(from_user=SimpleNamespace(id=user_id), n=n)
+
+
+def test_updates_of_one_user_run_in_order_in_one_thread():
+    bot = SimpleNamespace(exception_handler=None)
+    pool = workers.UserWorkerPool(bot, num_threads=3, queue_size=10, put_timeout=1)
+    seen = {}
+    lock = threading.Lock()
+
+    def handler(message):
+        # Первое сообщение медленнее - второе всё равно обрабатывается после него
+        if message.n == 0:
+            time.sleep(0.05)
+        with lock:
+            seen.setdefault(message.from_user.id, []).append((message.n, threading.current_thread().name))
+
+    try:
+        for n in range(3):
+            for user_id in (1, 2, 5):
+                pool.put(handler, update(user_id, n))
+    finally:
+        pool.close()
+
+    for user_id in (1, 2, 5):
+        assert [n for n, _ in seen[user_id]] == [0, 1, 2]
+        assert len({thread for _, thread in seen[user_id]}) == 1
+    assert pool.get_stats()['processed'] == 9
+
+
+def test_full_queue_drops_update_and_exceptions_reach_polling():
+    bot = SimpleNamespace(exception_handler=None)
+    pool = workers.UserWorkerPool(bot, num_threads=1, queue_size=1, put_timeout=0.01)
+    release = threading.Event()
+
+    def blocked(message):
+        release.wait(1)
+
+    def failing(message):
+        raise ValueError("boom")
+
+    try:
+        pool.put(blocked, update(1, 0))
+        time.sleep(0.05)
+        pool.put(failing, update(1, 1))
+        pool.put(blocked, update(1, 2))  # очередь полна - отброшен
+        assert pool.get_stats() == {'queued': [1], 'processed': 0, 'dropped': 1}
+    finally:
+        release.set()
+        pool.close()
+
+    assert pool.exception_event.is_set()
+    try:
+        pool.raise_exceptions()
+    except ValueError as e:
+        assert str(e) == "boom"
+    else:
+        raise AssertionError("exception was not raised")
+    pool.clear_exceptions()
+    pool.raise_exceptions()
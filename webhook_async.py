@@ -0,0 +1,100 @@
+"""
+Режим вебхука для асинхронного бота (aiohttp)
+
+Если задан WEBHOOK_URL, бот не опрашивает Telegram, а поднимает HTTP-сервер:
+Telegram присылает апдейты POST-запросами на WEBHOOK_URL + WEBHOOK_PATH,
+заголовок X-Telegram-Bot-Api-Secret-Token сверяется с WEBHOOK_SECRET.
+Сервер отвечает сразу, апдейт обрабатывается в фоне - одновременно до
+WEBHOOK_MAX_CONNECTIONS запросов от Telegram. При остановке сервер перестаёт
+принимать запросы и дожидается апдейтов, которые ещё обрабатываются.
+"""
+import asyncio
+import logging
+import os
+import secrets
+import signal
+from typing import List, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+from aiohttp import web
+
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+# Пусто - секрет генерируется при каждом запуске (вебхук всё равно переустанавливается)
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+# Сколько секунд при остановке ждать апдейты, которые ещё обрабатываются
+WEBHOOK_SHUTDOWN_TIMEOUT = float(os.getenv("WEBHOOK_SHUTDOWN_TIMEOUT", "30"))
+
+
+class WebhookHandler(SimpleRequestHandler):
+    """Обработчик вебхука: при остановке дожидается фоновой обработки апдейтов.
+
+    Сессию бота не закрывает - это делает main_async.main() после остановки очереди.
+    """
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._background_feed_update_tasks)
+
+    async def close(self) -> None:
+        tasks = set(self._background_feed_update_tasks)
+        if not tasks:
+            return
+        logging.info(f"Webhook: waiting for {len(tasks)} updates in progress")
+        done, pending = await asyncio.wait(tasks, timeout=WEBHOOK_SHUTDOWN_TIMEOUT)
+        for task in pending:
+            task.cancel()
+        if pending:
+            logging.warning(f"Webhook: {len(pending)} updates cancelled on shutdown")
+
+
+# Ключ приложения, под которым лежит обработчик (для метрик и тестов)
+WEBHOOK_HANDLER = web.AppKey("webhook_handler", WebhookHandler)
+
+
+def build_app(dispatcher: Dispatcher, bot: Bot, secret: Optional[str], path: str = WEBHOOK_PATH) -> web.Application:
+    """aiohttp-приложение с обработчиком вебхука на path"""
+    app = web.Application()
+    handler = WebhookHandler(dispatcher, bot, secret_token=secret)
+    handler.register(app, path=path)
+    app[WEBHOOK_HANDLER] = handler
+    return app
+
+
+async def run_webhook(dispatcher: Dispatcher, bot: Bot, allowed_updates: List[str]):
+    """Поднять сервер, зарегистрировать вебхук и работать до SIGINT/SIGTERM"""
+    secret = WEBHOOK_SECRET or secrets.token_urlsafe(32)
+    app = build_app(dispatcher, bot, secret)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT)
+    await site.start()
+
+    url = WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH
+    await bot.set_webhook(
+        url,
+        secret_token=secret,
+        max_connections=WEBHOOK_MAX_CONNECTIONS,
+        allowed_updates=allowed_updates,
+    )
+    logging.info(f"Webhook: listening on {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}, registered {url}")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            # Windows: остановка через KeyboardInterrupt
+            pass
+
+    try:
+        await stop.wait()
+    finally:
+        # Вебхук не удаляем: пока бот перезапускается, Telegram копит апдейты
+        await runner.cleanup()
+        logging.info("Webhook: server stopped")
@@ -0,0 +1,105 @@
+"""
+Пул потоков обработчиков для синхронного бота (pyTelegramBotAPI)
+
+Заменяет стандартный ThreadPool telebot: апдейт попадает в очередь потока,
+выбранного по user_id, поэтому апдейты одного пользователя обрабатываются
+строго по очереди, в одном потоке, - состояние пользователя (sessions.py)
+не нужно защищать замками. Очереди ограничены: если очередь потока полна,
+поток опроса ждёт (до UPDATE_PUT_TIMEOUT секунд), затем апдейт отбрасывается.
+"""
+import logging
+import os
+import queue
+import threading
+from typing import Dict
+
+UPDATE_WORKERS = max(1, int(os.getenv("UPDATE_WORKERS", "4")))
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", "100"))
+UPDATE_PUT_TIMEOUT = float(os.getenv("UPDATE_PUT_TIMEOUT", "5"))
+
+
+def update_user_id(obj) -> int:
+    """user_id автора апдейта (сообщение, callback); для апдейтов без автора - id чата"""
+    user = getattr(obj, 'from_user', None)
+    if user is not None:
+        return user.id
+    chat = getattr(obj, 'chat', None)
+    return chat.id if chat is not None else 0
+
+
+class UserWorkerPool:
+    """Пул потоков с интерфейсом telebot.util.ThreadPool: put/raise_exceptions/clear_exceptions/close"""
+
+    def __init__(self, telebot, num_threads: int = UPDATE_WORKERS, queue_size: int = UPDATE_QUEUE_SIZE,
+                 put_timeout: float = UPDATE_PUT_TIMEOUT):
+        self.telebot = telebot
+        self.put_timeout = put_timeout
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in range(num_threads)]
+        self.workers = [
+            threading.Thread(target=self._run, args=(q,), name=f"updates-{i}", daemon=True)
+            for i, q in enumerate(self.queues)
+        ]
+        self.exception_event = threading.Event()
+        self.exception_info = None
+        self.processed = 0
+        self.dropped = 0
+        self._stats_lock = threading.Lock()
+        for worker in self.workers:
+            worker.start()
+
+    def put(self, func, *args, **kwargs):
+        """Поставить обработчик в очередь потока пользователя (args[0] - апдейт)"""
+        user_id = update_user_id(args[0]) if args else 0
+        try:
+            self.queues[user_id % len(self.queues)].put((func, args, kwargs), timeout=self.put_timeout)
+        except queue.Full:
+            with self._stats_lock:
+                self.dropped += 1
+            logging.warning(f"Update from {user_id} dropped: worker queue is full")
+
+    def _run(self, q: queue.Queue):
+        while True:
+            task = q.get()
+            if task is None:
+                return
+            func, args, kwargs = task
+            try:
+                func(*args, **kwargs)
+            except Exception as e:
+                self._on_exception(e)
+            finally:
+                with self._stats_lock:
+                    self.processed += 1
+
+    def _on_exception(self, error: Exception):
+        # Как в telebot: необработанная ошибка всплывает в потоке опроса
+        if self.telebot.exception_handler is not None:
+            handled = self.telebot.exception_handler.handle(error)
+        else:
+            handled = False
+        if not handled:
+            self.exception_info = error
+            self.exception_event.set()
+
+    def raise_exceptions(self):
+        if self.exception_event.is_set():
+            raise self.exception_info
+
+    def clear_exceptions(self):
+        self.exception_event.clear()
+
+    def close(self):
+        for q in self.queues:
+            q.put(None)
+        for worker in self.workers:
+            if worker is not threading.current_thread():
+                worker.join()
+
+    def get_stats(self) -> Dict:
+        """Глубина очередей потоков, обработано и отброшено апдейтов"""
+        with self._stats_lock:
+            return {
+                'queued': [q.qsize() for q in self.queues],
+                'processed': self.processed,
+                'dropped': self.dropped,
+            }